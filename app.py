@@ -1,27 +1,88 @@
+import os
 import streamlit as st
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dhanhq import dhanhq
 from database import (
     init_db,
-    get_peak_equity,
-    update_peak_equity,
-    add_trade,
+    record_equity,
+    get_latest_equity,
+    get_equity_curve,
+    get_max_drawdown,
     get_all_trades,
     get_active_trades,
     get_kill_switch,
     set_kill_switch,
     get_trade_columns,
+    reconcile_active_trades,
+    save_scan_run,
+    get_scan_reason_counts,
+    get_recent_scan_runs,
+    get_journal_summary,
+    get_journal_breakdown,
+    get_closed_trade_outcomes,
+    get_order_states,
+    get_trade_ids,
+    set_stop_order_ids,
+    SUMMARY_COUNTERS,
 )
-from scanner import scan, fetch_daily_history, scan_portfolio_risk, resolve_security_id
+from scanner import (
+    SCAN_CHECKPOINT_PATH,
+    fetch_daily_history,
+    iter_scan,
+    resolve_security_id,
+    scan_checkpoint_symbols,
+    scan_portfolio_risk,
+)
+from request_scheduler import PRIORITY_PORTFOLIO, PRIORITY_QUOTE, broker_call, get_scheduler
+from journal_queue import (
+    dead_letter_count,
+    enqueue_trades,
+    flush as flush_journal_queue,
+    last_error as journal_queue_error,
+    pending_count,
+    start_journal_worker,
+)
+from execution import (
+    PENDING_STOP_ID,
+    extract_data_rows,
+    get_basket_jobs,
+    place_market_buy,
+    place_stop_order,
+    size_basket,
+    start_basket_job,
+)
+from symbols import SymbolIndex, build_sector_map, load_scrip_master
+from metrics import start_exporter as start_metrics_exporter
+from records import BrokerPosition, candidates_from_frame
 
-BASE_CAPITAL = 10000
+BASE_CAPITAL = float(os.getenv("BASE_CAPITAL", "10000"))
 RISK_PER_TRADE = 0.01
 MAX_DRAWDOWN = 0.08
+BASKET_RISK_BUDGET = 0.03
+BASKET_MAX_POSITIONS = 5
+BASKET_LEG_COLUMNS = ["symbol", "quantity", "price", "stop_price", "risk_amount", "buy_id", "stop_id", "status", "message"]
+# Reruns within this many seconds reuse LTPs instead of re-fetching every active position.
+LTP_CACHE_SECONDS = 60
+# Plain Vega-Lite, so the equity curve does not import and validate through altair on every rerun.
+EQUITY_CURVE_SPEC = {
+    "transform": [{"fold": ["equity", "peak_equity"], "as": ["series", "value"]}],
+    "mark": "line",
+    "encoding": {
+        "x": {"field": "date", "type": "temporal"},
+        "y": {"field": "value", "type": "quantitative", "scale": {"zero": False}},
+        "color": {"field": "series", "type": "nominal"},
+    },
+}
 
 st.set_page_config(layout="wide")
 st.title("Safe Alpha Engine — EOD Mode")
 init_db()
+start_journal_worker()
+try:
+    start_metrics_exporter()
+except OSError as exc:
+    st.warning(f"Metrics exporter could not start: {exc}")
 
 # -----------------------
 # LIVE / PAPER TOGGLE
@@ -39,134 +100,73 @@ if live_mode:
 else:
     st.warning("Paper Mode — No real orders will be placed.")
 
-dhan = dhanhq(
-    st.secrets["DHAN_CLIENT_ID"],
-    st.secrets["DHAN_ACCESS_TOKEN"]
-)
+# One client per process (and per credentials); dhanhq is imported on first use, not at script load.
+@st.cache_resource
+def get_dhan_client(client_id, access_token):
+    from dhanhq import dhanhq
 
-EXCHANGE_EQ = getattr(dhan, "NSE_EQ", getattr(dhan, "NSE", "NSE_EQ"))
-ORDER_TYPE_STOP = getattr(dhan, "STOP_LOSS", getattr(dhan, "SL", "STOP_LOSS"))
-ORDER_TYPE_SL = getattr(dhan, "SL", ORDER_TYPE_STOP)
-ORDER_TYPE_SLM = getattr(dhan, "SLM", None)
-TICK_SIZE = 0.05
+    return dhanhq(client_id, access_token)
 
-# -----------------------
-# SYMBOL MAP
-# -----------------------
-@st.cache_data(ttl=60 * 60)
-def build_symbol_map():
-    def normalize_symbol(symbol):
-        s = str(symbol).strip().upper()
-        if s.endswith("-EQ"):
-            s = s[:-3]
-        return s
-
-    def canonical_symbol(symbol):
-        return "".join(ch for ch in normalize_symbol(symbol) if ch.isalnum())
-
-    urls = [
-        "https://images.dhan.co/api-data/api-scrip-master-detailed.csv",
-        "https://images.dhan.co/api-data/api-scrip-master.csv",
-    ]
-    errors = []
-    for url in urls:
-        try:
-            df = pd.read_csv(url, low_memory=False)
-            df.columns = df.columns.str.strip().str.upper()
-
-            if "SEM_SEGMENT" in df.columns:
-                segment = df["SEM_SEGMENT"].astype(str).str.strip().str.upper()
-                filtered = df[segment == "NSE_EQ"].copy()
-                if not filtered.empty:
-                    df = filtered
-
-            # Prefer cash-equity series to avoid derivatives/alternate lines with short history.
-            for series_col in ["SEM_SERIES", "SERIES", "SM_SERIES"]:
-                if series_col in df.columns:
-                    series = df[series_col].astype(str).str.strip().str.upper()
-                    filtered = df[series == "EQ"].copy()
-                    if not filtered.empty:
-                        df = filtered
-                    break
 
-            symbol_cols = [c for c in ["SEM_TRADING_SYMBOL", "SEM_CUSTOM_SYMBOL", "SEM_SYMBOL"] if c in df.columns]
-            security_id_col = None
-            for candidate in ["SEM_SMST_SECURITY_ID", "SECURITY_ID", "SECURITYID", "SMST_SECURITY_ID"]:
-                if candidate in df.columns:
-                    security_id_col = candidate
-                    break
+# Feature modules are imported where they are used, so the first render only pays for what it shows.
+def start_background_workers(dhan_client):
+    """Start the pre-warm, order tracker and paper fill threads that are enabled (once per process)."""
+    from order_tracker import ORDER_TRACKER_ENABLED, start_order_tracker
+    from paper_fills import PAPER_FILL_WORKER_ENABLED, start_paper_fill_worker
+    from prewarm import PREWARM_ENABLED, start_prewarm_worker
 
-            if not symbol_cols or security_id_col is None:
-                raise ValueError(
-                    f"Required columns missing in {url}. "
-                    f"Found symbols={symbol_cols}, security_id_col={security_id_col}."
-                )
+    if PREWARM_ENABLED:
+        start_prewarm_worker(dhan_client)
+    if ORDER_TRACKER_ENABLED:
+        start_order_tracker(dhan_client)
+    if PAPER_FILL_WORKER_ENABLED:
+        start_paper_fill_worker(dhan_client)
 
-            mapping = {}
-
-            def add_mapping(key, security_id):
-                existing = mapping.get(key)
-                if existing is None:
-                    mapping[key] = [security_id]
-                    return
-                if isinstance(existing, list):
-                    if security_id not in existing:
-                        existing.append(security_id)
-                    return
-                if existing != security_id:
-                    mapping[key] = [existing, security_id]
-            for _, row in df.iterrows():
-                security_id = str(row.get(security_id_col, "")).strip()
-                if not security_id or security_id == "NAN":
-                    continue
-
-                for symbol_col in symbol_cols:
-                    raw_symbol = str(row.get(symbol_col, "")).strip().upper()
-                    if not raw_symbol or raw_symbol == "NAN":
-                        continue
 
-                    # Keep all valid mappings per key; scanner will choose the one with sufficient candles.
-                    add_mapping(raw_symbol, security_id)
-                    add_mapping(normalize_symbol(raw_symbol), security_id)
-                    add_mapping(canonical_symbol(raw_symbol), security_id)
+dhan = get_dhan_client(st.secrets["DHAN_CLIENT_ID"], st.secrets["DHAN_ACCESS_TOKEN"])
+start_background_workers(dhan)
 
-                    # Also ensure both base and -EQ aliases exist.
-                    base = normalize_symbol(raw_symbol)
-                    add_mapping(f"{base}-EQ", security_id)
-                    add_mapping(canonical_symbol(base), security_id)
-
-            if mapping:
-                return mapping
-            raise ValueError(f"No symbol mappings produced from {url}.")
-        except Exception as exc:
-            errors.append(f"{url}: {exc}")
+# -----------------------
+# SYMBOL MAP
+# -----------------------
+# cache_resource, not cache_data: the index is shared read-only and must not be re-copied every rerun.
+@st.cache_resource(ttl=60 * 60)
+def load_symbol_data():
+    master, errors = load_scrip_master()
+    if master is not None:
+        symbol_map = SymbolIndex.from_scrip_master(master)
+        if len(symbol_map):
+            return symbol_map, build_sector_map(master), master
+        errors.append("No symbol mappings produced from the scrip master.")
 
     st.warning(f"Could not load symbol map from Dhan master CSV. Tried: {' | '.join(errors)}")
-    return {}
+    return SymbolIndex({}), {}, None
+
+
+# Failures raise instead of returning None, so st.cache_data only keeps real prices.
+@st.cache_data(ttl=LTP_CACHE_SECONDS, show_spinner=False)
+def _fetch_ltp(_dhan_client, security_id, to_date):
+    raw = fetch_daily_history(
+        dhan_client=_dhan_client,
+        security_id=security_id,
+        from_date=to_date,
+        to_date=to_date,
+        priority=PRIORITY_QUOTE,
+    )
+    payload = raw.get("data", raw) if isinstance(raw, dict) else {}
+    if isinstance(payload, dict):
+        candles = payload.get("candles")
+        if candles:
+            return float(candles[-1][4])
+        closes = payload.get("close", [])
+        if closes:
+            return float(closes[-1])
+    raise ValueError(f"No price for {security_id}")
 
 
 def get_ltp(dhan_client, security_id):
-    to_date = datetime.now().strftime("%Y-%m-%d")
     try:
-        raw = fetch_daily_history(
-            dhan_client=dhan_client,
-            security_id=str(security_id),
-            from_date=to_date,
-            to_date=to_date,
-        )
-    except Exception:
-        return None
-
-    try:
-        payload = raw.get("data", raw) if isinstance(raw, dict) else {}
-        if isinstance(payload, dict):
-            candles = payload.get("candles")
-            if candles:
-                return float(candles[-1][4])
-            closes = payload.get("close", [])
-            if closes:
-                return float(closes[-1])
-        return None
+        return _fetch_ltp(dhan_client, str(security_id), datetime.now().strftime("%Y-%m-%d"))
     except Exception:
         return None
 
@@ -176,104 +176,35 @@ def estimate_equity(dhan_client):
     pricing_errors = 0
 
     for trade in get_active_trades():
-        # Table order from database.py:
-        # id, symbol, security_id, entry_price, stop_price, position_size, confidence, status, entry_date, buy_order_id, stop_order_id
-        security_id = trade[2]
-        entry_price = float(trade[3])
-        position_size = float(trade[5])
-        quantity = int(position_size / entry_price) if entry_price > 0 else 0
+        quantity = int(trade.quantity)
         if quantity <= 0:
             continue
 
-        ltp = get_ltp(dhan_client, security_id)
+        ltp = get_ltp(dhan_client, trade.security_id)
         if ltp is None:
             pricing_errors += 1
             continue
 
-        equity += (ltp - entry_price) * quantity
+        equity += (ltp - trade.entry_price) * quantity
 
     return equity, pricing_errors
 
 
-def _extract_data_rows(response):
-    if not isinstance(response, dict):
-        return []
-    payload = response.get("data", response)
-    if isinstance(payload, list):
-        return payload
-    if isinstance(payload, dict):
-        for key in ("data", "rows", "positions", "holdings"):
-            value = payload.get(key)
-            if isinstance(value, list):
-                return value
-    return []
-
-
-def _first_non_empty(record, keys):
-    for key in keys:
-        value = record.get(key)
-        if value is None:
-            continue
-        text = str(value).strip()
-        if text and text.upper() != "NAN":
-            return text
-    return None
-
-
-def _first_float(record, keys, default=0.0):
-    for key in keys:
-        value = record.get(key)
-        try:
-            num = float(value)
-            return num
-        except (TypeError, ValueError):
-            continue
-    return float(default)
-
-
-def _first_qty(record):
-    return _first_float(
-        record,
-        [
-            "netQty",
-            "netQuantity",
-            "quantity",
-            "qty",
-            "availableQty",
-            "holdingQty",
-            "totalQty",
-        ],
-        default=0.0,
-    )
-
-
-def _first_entry_price(record):
-    return _first_float(
-        record,
-        [
-            "avgPrice",
-            "averagePrice",
-            "avgCostPrice",
-            "buyAvg",
-            "costPrice",
-            "netAvg",
-            "lastTradedPrice",
-            "ltp",
-        ],
-        default=0.0,
-    )
+def _fetch_portfolio_source(source_name, fetch_fn):
+    try:
+        response = broker_call("non_trading", PRIORITY_PORTFOLIO, fetch_fn)
+    except Exception as exc:
+        return source_name, [], f"{source_name}_api_exception: {exc}"
+    return source_name, extract_data_rows(response), None
 
 
 def fetch_broker_portfolio_positions(dhan_client, symbol_map):
-    sources = []
-    for source_name, fetch_fn in (("positions", dhan_client.get_positions), ("holdings", dhan_client.get_holdings)):
-        try:
-            response = fetch_fn()
-        except Exception as exc:
-            sources.append((source_name, [], f"{source_name}_api_exception: {exc}"))
-            continue
-        rows = _extract_data_rows(response)
-        sources.append((source_name, rows, None))
+    # Positions and holdings are independent calls; fetch them together and keep
+    # the positions-first order so the merge below is deterministic.
+    source_fns = (("positions", dhan_client.get_positions), ("holdings", dhan_client.get_holdings))
+    with ThreadPoolExecutor(max_workers=len(source_fns)) as pool:
+        futures = [pool.submit(_fetch_portfolio_source, name, fn) for name, fn in source_fns]
+        sources = [future.result() for future in futures]
 
     by_security_id = {}
     unresolved = []
@@ -284,112 +215,89 @@ def fetch_broker_portfolio_positions(dhan_client, symbol_map):
             source_errors.append(err)
             continue
         for item in rows:
-            if not isinstance(item, dict):
-                continue
-
-            quantity = _first_qty(item)
-            if quantity <= 0:
-                continue
-
-            symbol = _first_non_empty(item, ["tradingSymbol", "trading_symbol", "symbol", "securitySymbol", "displayName"])
-            security_id = _first_non_empty(item, ["securityId", "security_id", "dhanSecurityId", "smstSecurityId"])
-            if not security_id and symbol:
-                security_id = resolve_security_id(symbol_map, symbol)
-
-            if not security_id:
-                unresolved.append(symbol or "UNKNOWN")
+            position = BrokerPosition.from_broker(item, source_name)
+            if position is None:
                 continue
-
-            entry_price = _first_entry_price(item)
-            key = str(security_id)
-            if key in by_security_id:
+            if not position.security_id and position.symbol:
+                position.security_id = resolve_security_id(symbol_map, position.symbol)
+            if not position.security_id:
+                unresolved.append(position.symbol or "UNKNOWN")
                 continue
 
-            by_security_id[key] = {
-                "symbol": symbol or key,
-                "security_id": key,
-                "entry_price": float(entry_price),
-                "stop_price": 0.0,
-                "quantity": float(quantity),
-                "source": source_name,
-            }
+            position.security_id = str(position.security_id)
+            position.symbol = position.symbol or position.security_id
+            by_security_id.setdefault(position.security_id, position)
 
     return list(by_security_id.values()), source_errors, unresolved
 
 
-def _extract_order_id(order_response):
-    if not isinstance(order_response, dict):
-        return None
-    for key in ("orderId", "order_id", "data"):
-        value = order_response.get(key)
-        if isinstance(value, str) and value.strip():
-            return value.strip()
-        if isinstance(value, dict):
-            nested = value.get("orderId") or value.get("order_id")
-            if isinstance(nested, str) and nested.strip():
-                return nested.strip()
-    return None
-
-
-def _place_stop_order(dhan_client, security_id, quantity, stop_price):
-    rounded_stop = round(float(stop_price), 2)
-    if rounded_stop <= 0:
-        raise ValueError(f"Invalid stop price: {stop_price}")
-
-    attempts = []
-    if ORDER_TYPE_SLM is not None:
-        attempts.append(
+def journal_basket_legs(legs, live):
+    from order_tracker import notify_orders_placed
+
+    refs = enqueue_trades(
+        [
             {
-                "order_type": ORDER_TYPE_SLM,
-                "price": 0,
-                "trigger_price": rounded_stop,
-                "label": "SLM",
+                "symbol": leg["symbol"],
+                "security_id": leg["security_id"],
+                "entry_price": leg["price"],
+                "stop_price": leg["stop_price"],
+                "position_size": leg["position_value"],
+                "quantity": leg["quantity"],
+                "confidence": leg["confidence"],
+                "status": leg["status"],
+                "buy_id": leg["buy_id"],
+                "stop_id": leg["stop_id"],
             }
-        )
-
-    sl_limit = max(round(rounded_stop - TICK_SIZE, 2), TICK_SIZE)
-    attempts.append(
-        {
-            "order_type": ORDER_TYPE_SL,
-            "price": sl_limit,
-            "trigger_price": rounded_stop,
-            "label": "SL",
-        }
+            for leg in legs
+        ]
     )
+    if live:
+        notify_orders_placed()
+    return refs
+
+
+def record_basket_stops(legs, refs):
+    """Point journaled basket legs (`refs` from `journal_basket_legs`) at the stops the job attached."""
+    from order_tracker import notify_orders_placed
+
+    if not refs:
+        # Journaling failed when the BUYs were acknowledged; record the legs as they ended up.
+        journal_basket_legs(legs, live=True)
+        return
+    flush_journal_queue(timeout=30.0)
+    trade_ids = get_trade_ids(refs)
+    updates = [
+        (trade_ids[ref], leg["stop_id"])
+        for ref, leg in zip(refs, legs)
+        if ref in trade_ids and leg["stop_id"] != PENDING_STOP_ID
+    ]
+    set_stop_order_ids(updates)
+    notify_orders_placed()
+    missing = sum(ref not in trade_ids for ref in refs)
+    if missing:
+        raise RuntimeError(f"{missing} leg(s) not journaled yet; their stop ids were not recorded")
 
-    last_error = None
-    for attempt in attempts:
-        try:
-            response = dhan_client.place_order(
-                security_id=security_id,
-                exchange_segment=EXCHANGE_EQ,
-                transaction_type=dhan_client.SELL,
-                quantity=quantity,
-                order_type=attempt["order_type"],
-                product_type=dhan_client.CNC,
-                price=attempt["price"],
-                trigger_price=attempt["trigger_price"],
-            )
-            order_id = _extract_order_id(response)
-            if order_id:
-                return order_id, attempt["label"], response
-            last_error = Exception(f"No order id in stop response: {response}")
-        except Exception as exc:
-            last_error = exc
 
-    raise RuntimeError(str(last_error) if last_error else "Unknown stop order placement failure")
+def current_symbol_data():
+    """The pre-warm worker refreshes the scrip master after the close; reuse its copy once available."""
+    from prewarm import get_symbol_data
+
+    return get_symbol_data() or load_symbol_data()
+
 
-symbol_map = build_symbol_map()
+symbol_map, sector_map, scrip_master = current_symbol_data()
 
 # -----------------------
 # PORTFOLIO STATUS
 # -----------------------
-peak = get_peak_equity()
 equity, mtm_errors = estimate_equity(dhan)
-if equity > peak:
-    update_peak_equity(equity)
-    peak = equity
-drawdown = (peak - equity) / peak if peak > 0 else 0
+if mtm_errors == 0:
+    _, _, peak, drawdown = record_equity(equity, base_capital=BASE_CAPITAL)
+else:
+    # Partially priced equity is not written to the curve; compare it to the last recorded peak.
+    latest_point = get_latest_equity()
+    peak = max(float(latest_point[2]) if latest_point else BASE_CAPITAL, equity)
+    drawdown = (peak - equity) / peak if peak > 0 else 0
 
 status_col1, status_col2, status_col3 = st.columns(3)
 status_col1.metric("Peak Equity", f"₹{round(peak, 2)}")
@@ -399,6 +307,81 @@ status_col3.metric("Drawdown", f"{round(drawdown * 100, 2)}%")
 if mtm_errors > 0:
     st.warning(f"MTM pricing unavailable for {mtm_errors} active trade(s). Equity is partially estimated.")
 
+with st.expander("Equity Curve", expanded=False):
+    curve = get_equity_curve()
+    if curve:
+        curve_df = pd.DataFrame(curve, columns=["date", "equity", "peak_equity", "drawdown"]).set_index("date")
+        st.vega_lite_chart(curve_df[["equity", "peak_equity"]].reset_index(), EQUITY_CURVE_SPEC, use_container_width=True)
+        window_start = datetime.now().replace(day=1).strftime("%Y-%m-%d")
+        st.write(
+            f"Max drawdown this month: {round(get_max_drawdown(window_start, curve_df.index[-1]) * 100, 2)}% | "
+            f"All time: {round(get_max_drawdown(curve_df.index[0], curve_df.index[-1]) * 100, 2)}%"
+        )
+    else:
+        st.write("No equity history recorded yet.")
+
+with st.expander("Market Regime", expanded=False):
+    try:
+        from regime import get_regime
+
+        regime = get_regime(dhan)
+        st.caption(f"Session {regime['session']} (computed {regime['computed_at']}, cached once per session).")
+        regime_rows = [dict(entry["metrics"], index=name) for name, entry in regime["indices"].items()]
+        if regime_rows:
+            st.dataframe(pd.DataFrame(regime_rows).set_index("index"), use_container_width=True)
+        for name, message in regime["errors"].items():
+            st.warning(f"{name} regime unavailable: {message}")
+    except Exception as exc:
+        regime = None
+        st.warning(f"Regime data unavailable: {exc}")
+
+with st.expander("Symbol Lookup", expanded=False):
+    symbol_query = st.text_input("Symbol (prefix or approximate spelling)", key="symbol_query")
+    if symbol_query.strip():
+        matches = symbol_map.search(symbol_query, limit=10)
+        if matches:
+            st.dataframe(
+                pd.DataFrame(
+                    [{"symbol": symbol, "security_ids": ", ".join(ids)} for symbol, ids in matches]
+                ),
+                use_container_width=True,
+            )
+        else:
+            st.info("No matching symbols.")
+
+with st.expander("Order Tracker", expanded=False):
+    from order_tracker import tracker_status
+
+    tracker = tracker_status()
+    st.caption(
+        f"State: {tracker['state']} | last poll: {tracker['last_poll'] or 'never'} | "
+        f"next poll in: {tracker['interval'] or '-'}s"
+    )
+    if tracker["error"]:
+        st.warning(f"Order tracker is retrying: {tracker['error']}")
+    if tracker["last_summary"] and tracker["last_summary"]["stop_failures"]:
+        st.error(f"{tracker['last_summary']['stop_failures']} live position(s) have no working stop order.")
+    if tracker["last_summary"] and tracker["last_summary"].get("stops_waiting"):
+        st.warning(
+            f"{tracker['last_summary']['stops_waiting']} live position(s) have no stop order; "
+            "it is re-placed once the market opens."
+        )
+    order_states = get_order_states(limit=50)
+    if order_states:
+        st.dataframe(
+            pd.DataFrame(
+                order_states,
+                columns=[
+                    "order_id", "trade_id", "kind", "security_id", "quantity", "status", "filled_qty", "message", "updated_at",
+                ],
+            ),
+            use_container_width=True,
+        )
+
+with st.expander("Broker API Scheduler", expanded=False):
+    st.caption("Per endpoint class: requests, queue depth and wait time in the shared token-bucket scheduler.")
+    st.dataframe(pd.DataFrame(get_scheduler().snapshot()), use_container_width=True)
+
 auto_circuit_active = drawdown >= MAX_DRAWDOWN
 if auto_circuit_active:
     st.error("Auto circuit breaker active (drawdown limit breached).")
@@ -410,8 +393,83 @@ tab_eod, tab_risk, tab_journal = st.tabs(["EOD Buy Scan", "Portfolio Risk Scan",
 
 with tab_eod:
     st.caption("Runs the end-of-day opportunity scan and places paper/live buy + stop orders.")
-    if st.button("Run EOD Scan", disabled=trading_blocked, key="run_eod_scan"):
-        df, diagnostics_df = scan(dhan, symbol_map)
+    basket_mode = st.toggle("Basket mode (deploy several candidates)", value=False, key="basket_mode")
+    if basket_mode:
+        basket_col1, basket_col2 = st.columns(2)
+        basket_max_positions = basket_col1.number_input(
+            "Max positions", min_value=1, max_value=20, value=BASKET_MAX_POSITIONS, step=1
+        )
+        basket_risk_budget = basket_col2.number_input(
+            "Total risk budget (% of capital)", min_value=0.5, max_value=10.0, value=BASKET_RISK_BUDGET * 100, step=0.5
+        ) / 100
+    from prewarm import get_staged_scan, prewarm_status
+    from universes import DEFAULT_UNIVERSE, list_universes, resolve_universe
+
+    universe_names = list_universes(scrip_master)
+    universe_symbols = None
+    universe_name = st.selectbox(
+        "Universe",
+        universe_names,
+        index=universe_names.index(DEFAULT_UNIVERSE) if DEFAULT_UNIVERSE in universe_names else 0,
+        key="scan_universe",
+    )
+    if universe_name:
+        try:
+            universe = resolve_universe(universe_name, symbol_map, scrip_master)
+            universe_symbols = universe["symbols"]
+            st.caption(
+                f"{len(universe_symbols)} symbols resolved"
+                + (f"; {len(universe['missing'])} without a security id." if universe["missing"] else ".")
+            )
+        except Exception as exc:
+            st.warning(f"Universe {universe_name} unavailable: {exc}")
+    prewarm = prewarm_status()
+    if prewarm["warm"]:
+        st.caption(f"Pre-warm: warm — scan staged for session {prewarm['session']} at {prewarm['computed_at']}.")
+    elif prewarm["state"] == "running":
+        st.caption("Pre-warm: running — the scan will run live until staging finishes.")
+    else:
+        reason = f" (last attempt failed: {prewarm['error']})" if prewarm["error"] else ""
+        st.caption(f"Pre-warm: cold — the scan will run live{reason}.")
+    checkpointed = scan_checkpoint_symbols()
+    if checkpointed:
+        st.caption(f"An interrupted scan checkpointed {checkpointed} symbols; running the same scan today resumes it.")
+    use_staged_scan = st.toggle("Use pre-warmed scan when available", value=True, key="use_staged_scan")
+    if st.button("Run EOD Scan", disabled=trading_blocked or universe_symbols == [], key="run_eod_scan"):
+        staged = get_staged_scan(universe=universe_name) if use_staged_scan else None
+        if staged is not None:
+            # Already saved to scan history when it was staged.
+            df, diagnostics_df, _ = staged
+        else:
+            scan_progress = st.progress(0.0, text="Scanning...")
+            live_table = st.empty()
+            partial_candidates = []
+            # Each finished chunk is checkpointed; a rerun or crash mid-scan resumes from there.
+            for event in iter_scan(
+                dhan,
+                symbol_map,
+                sector_map=sector_map,
+                regime=regime,
+                universe=universe_symbols,
+                checkpoint_path=SCAN_CHECKPOINT_PATH,
+            ):
+                scan_progress.progress(
+                    event["done"] / max(event["total"], 1), text=f"Scanned {event['done']}/{event['total']} symbols"
+                )
+                if event["final"]:
+                    df, diagnostics_df = event["candidates"], event["diagnostics"]
+                elif not event["candidates"].empty:
+                    partial_candidates.append(event["candidates"])
+                    live_table.dataframe(
+                        pd.concat(partial_candidates, ignore_index=True).sort_values("confidence", ascending=False),
+                        use_container_width=True,
+                    )
+            scan_progress.empty()
+            live_table.empty()
+            try:
+                save_scan_run(df.to_dict("records"), diagnostics_df.to_dict("records"))
+            except Exception as exc:
+                st.warning(f"Scan history could not be saved: {exc}")
         if not diagnostics_df.empty:
             with st.expander("Scan Diagnostics", expanded=True):
                 total = len(diagnostics_df)
@@ -421,15 +479,45 @@ with tab_eod:
                 st.write(f"Total symbols checked: {total} | Selected: {selected} | Skipped: {skipped} | Errors: {errors}")
                 st.dataframe(diagnostics_df, use_container_width=True)
 
-        if df.empty:
+        candidates = candidates_from_frame(df)
+        if not candidates:
             st.warning("No valid setups today.")
+        elif basket_mode:
+            basket = size_basket(
+                candidates,
+                base_capital=BASE_CAPITAL,
+                risk_per_trade=RISK_PER_TRADE,
+                total_risk_budget=basket_risk_budget,
+                max_positions=basket_max_positions,
+            )
+            if not basket:
+                st.warning("No candidate fits the basket risk budget (quantity computed as 0 for all setups).")
+            elif live_mode:
+                # Fill polling takes up to FILL_TIMEOUT, so it runs on a background thread. The legs are
+                # journaled once the BUYs are acknowledged and get their stop ids once the stops attach.
+                basket_refs = []
+                start_basket_job(
+                    dhan,
+                    basket,
+                    on_bought=lambda legs: basket_refs.extend(journal_basket_legs(legs, live=True)),
+                    on_done=lambda legs: record_basket_stops(legs, basket_refs),
+                )
+                st.info(
+                    f"Basket submitted: {len(basket)} BUY order(s). Stops attach as fills confirm; "
+                    "see \"Live basket orders\" below."
+                )
+            else:
+                legs = [dict(leg, buy_id="PAPER_BUY", stop_id="PAPER_STOP", status="ACTIVE", message="paper") for leg in basket]
+                journal_basket_legs(legs, live=False)
+                st.info(f"Basket simulated: {len(legs)} position(s).")
+                st.dataframe(pd.DataFrame(legs)[BASKET_LEG_COLUMNS], use_container_width=True)
         else:
             risk_capital = BASE_CAPITAL * RISK_PER_TRADE
             selected = None
 
-            for _, row in df.iterrows():
-                price = float(row["price"])
-                stop_price = float(row["stop_price"])
+            for candidate in candidates:
+                price = candidate.price
+                stop_price = candidate.stop_price
                 stop_pct = (price - stop_price) / price if price > 0 else -1
                 if stop_pct <= 0:
                     continue
@@ -440,11 +528,11 @@ with tab_eod:
                     continue
 
                 selected = {
-                    "symbol": row["symbol"],
-                    "security_id": row["security_id"],
+                    "symbol": candidate.symbol,
+                    "security_id": candidate.security_id,
                     "price": price,
                     "stop_price": stop_price,
-                    "confidence": float(row["confidence"]),
+                    "confidence": float(candidate.confidence),
                     "position_value": position_value,
                     "quantity": quantity,
                 }
@@ -452,22 +540,22 @@ with tab_eod:
 
             if selected is None:
                 fallback = None
-                for _, row in df.iterrows():
-                    price = float(row["price"])
-                    stop_price = float(row["stop_price"])
+                for candidate in candidates:
+                    price = candidate.price
+                    stop_price = candidate.stop_price
                     if price <= 0 or stop_price <= 0 or stop_price >= price:
                         continue
                     if price > BASE_CAPITAL:
                         continue
                     fallback = {
-                        "symbol": row["symbol"],
-                        "security_id": row["security_id"],
+                        "symbol": candidate.symbol,
+                        "security_id": candidate.security_id,
                         "price": price,
                         "stop_price": stop_price,
-                        "confidence": float(row["confidence"]),
+                        "confidence": float(candidate.confidence),
                         "position_value": price,
                         "quantity": 1,
-                        "signal_strength": row.get("signal_strength", "unknown"),
+                        "signal_strength": candidate.signal_strength,
                     }
                     break
 
@@ -492,22 +580,13 @@ with tab_eod:
 
                 if live_mode:
                     try:
-                        buy = dhan.place_order(
-                            security_id=security_id,
-                            exchange_segment=EXCHANGE_EQ,
-                            transaction_type=dhan.BUY,
-                            quantity=quantity,
-                            order_type=dhan.MARKET,
-                            product_type=dhan.CNC,
-                            price=0
-                        )
-                        buy_id = buy.get("orderId", "LIVE_BUY_FAIL") if isinstance(buy, dict) else "LIVE_BUY_FAIL"
+                        buy_id = place_market_buy(dhan, security_id, quantity)
                     except Exception as exc:
                         st.error(f"Live BUY order failed for {symbol}: {exc}")
                         buy_id = "LIVE_BUY_FAIL"
 
                     try:
-                        stop_id, stop_type, _ = _place_stop_order(
+                        stop_id, stop_type, _ = place_stop_order(
                             dhan_client=dhan,
                             security_id=security_id,
                             quantity=quantity,
@@ -523,16 +602,57 @@ with tab_eod:
                     stop_id = "PAPER_STOP"
                     st.info(f"Paper trade simulated: {symbol} | Qty: {quantity}")
 
-                add_trade(
-                    symbol,
-                    security_id,
-                    price,
-                    stop_price,
-                    position_value,
-                    confidence,
-                    buy_id,
-                    stop_id
+                enqueue_trades(
+                    [
+                        {
+                            "symbol": symbol,
+                            "security_id": security_id,
+                            "entry_price": price,
+                            "stop_price": stop_price,
+                            "position_size": position_value,
+                            "quantity": quantity,
+                            "confidence": confidence,
+                            "buy_id": buy_id,
+                            "stop_id": stop_id,
+                        }
+                    ]
                 )
+                if live_mode:
+                    from order_tracker import notify_orders_placed
+
+                    notify_orders_placed()
+
+    basket_jobs = get_basket_jobs()
+    if basket_jobs:
+        with st.expander("Live basket orders", expanded=True):
+            for job_id, job in sorted(basket_jobs.items(), reverse=True):
+                if job["status"] == "failed":
+                    st.error(f"Basket {job_id} failed: {job['error']}")
+                elif job["status"] == "running" and not job["legs"]:
+                    st.write(f"Basket {job_id}: placing {job['size']} BUY order(s) and waiting for fills...")
+                else:
+                    st.write(f"Basket {job_id}: {job['status']}")
+                    if job["error"]:
+                        st.warning(f"Basket {job_id} journal: {job['error']}")
+                    st.dataframe(pd.DataFrame(job["legs"])[BASKET_LEG_COLUMNS], use_container_width=True)
+
+    with st.expander("Scan History", expanded=False):
+        month_start = datetime.now().strftime("%Y-%m-01")
+        recent_runs = get_recent_scan_runs(limit=20)
+        if recent_runs:
+            st.dataframe(
+                pd.DataFrame(recent_runs, columns=["run_id", "started_at", "symbols_checked", "candidates", "errors"]),
+                use_container_width=True,
+            )
+            reason_counts = get_scan_reason_counts(month_start)
+            if reason_counts:
+                st.write("Outcomes this month by symbol and reason:")
+                st.dataframe(
+                    pd.DataFrame(reason_counts, columns=["symbol", "reason", "occurrences", "last_seen"]),
+                    use_container_width=True,
+                )
+        else:
+            st.write("No scan runs recorded yet.")
 
 with tab_risk:
     st.caption("Scans live Dhan positions/holdings and marks each as SELL or HOLD.")
@@ -543,10 +663,16 @@ with tab_risk:
         if unresolved_symbols:
             st.warning(f"Could not resolve security_id for {len(unresolved_symbols)} broker position(s).")
 
+        if not source_errors:
+            # Only reconcile against a complete broker snapshot; a failed source would look like closed trades.
+            closed_count = reconcile_active_trades([pos.security_id for pos in broker_positions])
+            if closed_count:
+                st.info(f"Reconciled journal: {closed_count} live trade(s) no longer held at broker marked CLOSED_AT_BROKER.")
+
         if not broker_positions:
             st.info("No broker positions/holdings to scan.")
         else:
-            risk_df = scan_portfolio_risk(dhan, broker_positions)
+            risk_df = scan_portfolio_risk(dhan, broker_positions, sector_map=sector_map, regime=regime)
             sell_count = int((risk_df["advice"] == "SELL").sum()) if not risk_df.empty else 0
             hold_count = int((risk_df["advice"] == "HOLD").sum()) if not risk_df.empty else 0
             st.write(f"Positions scanned: {len(risk_df)} | SELL alerts: {sell_count} | HOLD: {hold_count}")
@@ -557,6 +683,122 @@ with tab_risk:
             st.dataframe(risk_df, use_container_width=True)
 
 with tab_journal:
+    queued = pending_count()
+    if queued:
+        st.caption(f"{queued} journal row(s) queued for the database and not shown yet.")
+    if journal_queue_error():
+        st.warning(f"Journal queue is retrying database writes: {journal_queue_error()}")
+    dead_letters = dead_letter_count()
+    if dead_letters:
+        st.error(
+            f"{dead_letters} journal row(s) could not be written and were moved to the dead-letter file "
+            "(journal_queue.log.dead)."
+        )
+    from paper_fills import last_errors as paper_fill_errors, paper_fill_status, request_paper_fill_run
+
+    # The daily paper-fill catch-up runs on its worker thread; only its latest outcome is rendered.
+    paper_fill_run = paper_fill_status()
+    if paper_fill_run["error"]:
+        st.warning(f"Paper fill simulation failed (retrying with backoff): {paper_fill_run['error']}")
+    if st.button("Simulate paper fills now", key="run_paper_fills"):
+        request_paper_fill_run()
+        st.info("Paper fill simulation started in the background; refresh to see the result.")
+    if paper_fill_run["last_run"]:
+        st.caption(
+            f"Paper fill simulator last ran at {paper_fill_run['last_run']} and closed "
+            f"{paper_fill_run['closed']} paper trade(s) at their stops."
+        )
+        if paper_fill_run["closed"]:
+            st.dataframe(paper_fill_run["fills"], use_container_width=True)
+    paper_fetch_errors = paper_fill_errors()
+    if paper_fetch_errors:
+        st.warning(
+            f"Paper fill simulator could not fetch candles for {len(paper_fetch_errors)} security id(s); "
+            "their trades were not checked and are retried automatically."
+        )
+        st.dataframe(
+            pd.DataFrame(sorted(paper_fetch_errors.items()), columns=["security_id", "error"]),
+            use_container_width=True,
+        )
+    journal_stats = get_journal_summary()
+    stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
+    stat_col1.metric("Trades (open / closed)", f"{journal_stats['open_trades']} / {journal_stats['closed_trades']}")
+    stat_col2.metric(
+        "Win rate",
+        f"{round(journal_stats['win_rate'] * 100, 1)}%" if journal_stats["win_rate"] is not None else "n/a",
+    )
+    stat_col3.metric("Avg R-multiple", round(journal_stats["avg_r"], 2) if journal_stats["avg_r"] is not None else "n/a")
+    stat_col4.metric("Open exposure", f"₹{round(journal_stats['open_exposure'] or 0, 2)}")
+    with st.expander("Exposure by symbol and results by confidence", expanded=False):
+        for scope, label in (("symbol", "symbol"), ("confidence", "confidence bucket")):
+            breakdown = get_journal_breakdown(scope)
+            if breakdown:
+                st.write(f"By {label}:")
+                st.dataframe(pd.DataFrame(breakdown, columns=[label] + SUMMARY_COUNTERS), use_container_width=True)
+
+    with st.expander("Risk of ruin (Monte Carlo)", expanded=False):
+        from montecarlo import (
+            DEFAULT_PATHS,
+            DEFAULT_TRADES,
+            MAX_PATH_TRADES,
+            capped_paths,
+            drawdown_histogram,
+            fallback_table,
+            simulate_fallback_pair,
+            trade_samples,
+        )
+
+        st.caption(
+            "Bootstraps closed-trade R-multiples into equity paths sized like the EOD tab "
+            f"(₹{BASE_CAPITAL:,.0f} × {RISK_PER_TRADE:.1%} risk, {MAX_DRAWDOWN:.0%} breaker)."
+        )
+        mc_col1, mc_col2, mc_col3 = st.columns(3)
+        mc_paths = mc_col1.number_input("Paths", min_value=1000, max_value=100000, value=DEFAULT_PATHS, step=1000)
+        mc_trades = mc_col2.number_input("Trades per path", min_value=10, max_value=2000, value=DEFAULT_TRADES, step=10)
+        mc_compound = mc_col3.checkbox("Size from current equity", value=False)
+        if st.button("Run simulation", key="run_monte_carlo"):
+            samples = trade_samples(get_closed_trade_outcomes())
+            if samples.empty:
+                st.info("No closed trades with a valid stop to bootstrap from yet.")
+            else:
+                n_paths = capped_paths(mc_paths, mc_trades)
+                if n_paths < mc_paths:
+                    st.caption(
+                        f"Paths reduced to {n_paths:,} to keep paths × trades within {MAX_PATH_TRADES:,} "
+                        "so the run finishes in a few seconds."
+                    )
+                settings = {
+                    "n_paths": n_paths,
+                    "n_trades": int(mc_trades),
+                    "base_capital": BASE_CAPITAL,
+                    "risk_per_trade": RISK_PER_TRADE,
+                    "max_drawdown": MAX_DRAWDOWN,
+                    "compound": mc_compound,
+                }
+                st.write(f"Bootstrapped from {len(samples)} closed trades.")
+                results = simulate_fallback_pair(samples, seed=0, **settings)
+                st.dataframe(fallback_table(results, BASE_CAPITAL).T, use_container_width=True)
+                st.write("Max drawdown distribution (current fallback setting):")
+                st.bar_chart(drawdown_histogram(results[allow_min_qty_fallback]))
+
+    with st.expander("Export data (Arrow / Parquet)", expanded=False):
+        from export import EXPORT_SOURCES, get_export_jobs, start_export_job
+
+        export_sources = st.multiselect("Tables", list(EXPORT_SOURCES), default=["trades", "scan_diagnostics"])
+        export_col1, export_col2 = st.columns(2)
+        export_format = export_col1.selectbox("Format", ["parquet", "arrow"])
+        export_incremental_only = export_col2.checkbox("Only rows added or changed since last export", value=True)
+        export_dir = st.text_input("Output directory", value=os.getenv("EXPORT_DIR", "exports"))
+        if st.button("Start export", key="start_export", disabled=not export_sources):
+            start_export_job(export_sources, export_dir, fmt=export_format, incremental=export_incremental_only)
+            st.info("Export started in the background.")
+        for job_id, job in sorted(get_export_jobs().items(), reverse=True):
+            if job["status"] == "failed":
+                st.error(f"Export {job_id} failed: {job['error']}")
+            else:
+                written = ", ".join(f"{item['source']}: {item['rows']}" for item in job["results"])
+                st.write(f"Export {job_id}: {job['status']}" + (f" ({written} rows)" if written else ""))
+
     trades = get_all_trades()
     if trades:
         df_trades = pd.DataFrame(trades, columns=get_trade_columns())
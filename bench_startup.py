@@ -0,0 +1,166 @@
+"""Startup benchmark: cold imports of app.py's dependencies and the first Streamlit render.
+
+Every sample runs in a fresh interpreter, so nothing is in sys.modules yet, the way a
+Streamlit Cloud cold start sees it:
+
+- imports: app.py's top-level imports, timed one after another in the app's order
+  (each number is what that import adds on top of the earlier ones)
+- render: the first `AppTest` run of app.py (cold imports, caches, first page) and a rerun
+
+The render uses a throwaway SQLite database and disables the pre-warm, order tracker and
+paper fill threads. Pass `--scrip-master` with a local CSV to keep the scrip master download out of
+the numbers. DHAN_CLIENT_ID / DHAN_ACCESS_TOKEN come from the environment; with the
+placeholder values broker calls fail the way they would offline.
+
+    python bench_startup.py --runs 5 --scrip-master master.csv
+
+Medians are printed and one JSON line per invocation is appended to --history.
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+DEFAULT_HISTORY = "bench_startup.jsonl"
+
+
+def app_imports(path=APP_PATH):
+    """Top-level modules imported by app.py, in source order."""
+    with open(path, "r", encoding="utf-8") as handle:
+        tree = ast.parse(handle.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            if name not in modules:
+                modules.append(name)
+    return modules
+
+
+def _child_imports():
+    import importlib
+
+    timings = {}
+    total = time.perf_counter()
+    for module in app_imports():
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings[module] = time.perf_counter() - start
+    timings["total"] = time.perf_counter() - total
+    return timings
+
+
+def _child_render():
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=300)
+    app.secrets["DHAN_CLIENT_ID"] = os.getenv("DHAN_CLIENT_ID", "bench")
+    app.secrets["DHAN_ACCESS_TOKEN"] = os.getenv("DHAN_ACCESS_TOKEN", "bench")
+    timings = {}
+    for label in ("first_render", "rerun"):
+        start = time.perf_counter()
+        app.run()
+        timings[label] = time.perf_counter() - start
+        if app.exception:
+            raise RuntimeError(f"app.py raised during {label}: {app.exception[0].message}")
+    return timings
+
+
+def _sample(phase, scrip_master=None):
+    """Run one phase in a fresh interpreter with isolated state; returns its timings."""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            SQLITE_DB_NAME=os.path.join(workdir, "trades.db"),
+            JOURNAL_QUEUE_PATH=os.path.join(workdir, "journal_queue.log"),
+            REGIME_CACHE_PATH=os.path.join(workdir, "regime_cache.json"),
+            PREWARM_STAGE_PATH=os.path.join(workdir, "prewarm_stage.json"),
+            SCAN_CHECKPOINT_PATH=os.path.join(workdir, "scan_checkpoint.jsonl"),
+            PREWARM="0",
+            ORDER_TRACKER="0",
+            PAPER_FILLS="0",
+            METRICS_PORT="",
+            METRICS_TEXTFILE="",
+        )
+        env.pop("DATABASE_URL", None)
+        if scrip_master:
+            env["SCRIP_MASTER_URLS"] = os.path.abspath(scrip_master)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", phase],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"{phase} sample failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(runs=3, scrip_master=None, phases=("imports", "render")):
+    """Median seconds per measurement over `runs` fresh-interpreter samples of each phase."""
+    medians = {}
+    for phase in phases:
+        samples = [_sample(phase, scrip_master) for _ in range(runs)]
+        medians[phase] = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+    return medians
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh-interpreter samples per phase")
+    parser.add_argument("--scrip-master", help="local scrip master CSV instead of the Dhan download")
+    parser.add_argument("--phase", choices=["imports", "render"], action="append", help="limit to one phase")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSONL file to append results to ('' to skip)")
+    parser.add_argument("--child", choices=["imports", "render"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        timings = _child_imports() if args.child == "imports" else _child_render()
+        print(json.dumps(timings))
+        return
+
+    results = run(args.runs, args.scrip_master, tuple(args.phase or ("imports", "render")))
+    for phase, timings in results.items():
+        print(f"{phase} (median of {args.runs}):")
+        rows = sorted(timings.items(), key=lambda item: item[1], reverse=True) if phase == "imports" else timings.items()
+        for key, seconds in rows:
+            print(f"  {key:<24} {seconds * 1000:9.1f} ms")
+
+    if args.history:
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "runs": args.runs,
+            "scrip_master": bool(args.scrip_master),
+            "results": results,
+        }
+        with open(args.history, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
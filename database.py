@@ -1,22 +1,35 @@
+import json
+import math
 import os
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from metrics import timed
+from records import TRADE_FIELDS, TradeRecord
 
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 SQLITE_DB_NAME = os.getenv("SQLITE_DB_NAME", "trades.db")
-TRADE_COLUMNS = [
-    "id",
-    "symbol",
-    "security_id",
-    "entry_price",
-    "stop_price",
-    "position_size",
-    "confidence",
-    "status",
-    "entry_date",
-    "buy_order_id",
-    "stop_order_id",
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Placeholder the first schema wrote into portfolio.peak_equity; not a real peak.
+LEGACY_PEAK_SEED = 10000.0
+DIAGNOSTIC_COLUMNS = ["symbol", "security_id", "status", "reason", "score", "message"]
+SUMMARY_COUNTERS = [
+    "trades", "open_trades", "open_exposure", "closed_trades", "wins", "losses", "r_trades", "sum_r",
 ]
+# Journal analytics cover trades that were actually opened; failed/rejected buys are excluded.
+JOURNAL_TRADE_FILTER = "(status = 'ACTIVE' OR status LIKE 'CLOSED%')"
+R_MULTIPLE_SQL = (
+    "CASE WHEN exit_price IS NOT NULL AND entry_price > stop_price "
+    "THEN (exit_price - entry_price) / (entry_price - stop_price) END"
+)
+CONFIDENCE_BUCKET_SQL = (
+    "CASE WHEN confidence >= 90 THEN '90+' WHEN confidence >= 80 THEN '80-89' "
+    "WHEN confidence >= 70 THEN '70-79' ELSE '<70' END"
+)
+TRADE_COLUMNS = list(TRADE_FIELDS)
+
+
+_wal_enabled = set()
 
 
 def _is_postgres():
@@ -31,79 +44,215 @@ def _connect():
         except ImportError as exc:
             raise RuntimeError("Install psycopg2-binary to use DATABASE_URL/Postgres.") from exc
         return psycopg2.connect(DATABASE_URL)
-    return sqlite3.connect(SQLITE_DB_NAME)
+    conn = sqlite3.connect(SQLITE_DB_NAME, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    # WAL lets the Streamlit thread read while background workers (journal queue) write.
+    # journal_mode is persistent in the file; synchronous and busy_timeout are per connection.
+    if SQLITE_DB_NAME not in _wal_enabled:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled.add(SQLITE_DB_NAME)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    return conn
+
+
+def check_connection():
+    """Raise if the database cannot be reached."""
+    conn = _connect()
+    try:
+        conn.cursor().execute("SELECT 1")
+    finally:
+        conn.close()
 
 
 def _ph():
     return "%s" if _is_postgres() else "?"
 
 
-def init_db():
-    conn = _connect()
-    cursor = conn.cursor()
+def _clean(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
 
+
+def _bulk_insert(cursor, table, columns, values):
+    """Multi-row insert: execute_values on Postgres, executemany on SQLite."""
+    if not values:
+        return
+    column_list = ", ".join(columns)
     if _is_postgres():
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS trades (
-            id BIGSERIAL PRIMARY KEY,
-            symbol TEXT,
-            security_id TEXT,
-            entry_price DOUBLE PRECISION,
-            stop_price DOUBLE PRECISION,
-            position_size DOUBLE PRECISION,
-            confidence DOUBLE PRECISION,
-            status TEXT,
-            entry_date TEXT,
-            buy_order_id TEXT,
-            stop_order_id TEXT
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS portfolio (
-            id INTEGER PRIMARY KEY,
-            peak_equity DOUBLE PRECISION
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS app_state (
-            id INTEGER PRIMARY KEY,
-            kill_switch BOOLEAN
-        )
-        """)
-    else:
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS trades (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT,
-            security_id TEXT,
-            entry_price REAL,
-            stop_price REAL,
-            position_size REAL,
-            confidence REAL,
-            status TEXT,
-            entry_date TEXT,
-            buy_order_id TEXT,
-            stop_order_id TEXT
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS portfolio (
-            id INTEGER PRIMARY KEY,
-            peak_equity REAL
+        from psycopg2.extras import execute_values
+
+        execute_values(cursor, f"INSERT INTO {table} ({column_list}) VALUES %s", values, page_size=1000)
+        return
+    placeholders = ", ".join("?" for _ in columns)
+    cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", values)
+
+
+def _trade_select():
+    return ", ".join(TRADE_COLUMNS)
+
+
+def _ensure_column(cursor, table, column, column_type):
+    if _is_postgres():
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}")
+        return
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _confidence_bucket(confidence):
+    value = _clean(confidence)
+    if value is None:
+        return "<70"
+    value = float(value)
+    if value >= 90:
+        return "90+"
+    if value >= 80:
+        return "80-89"
+    if value >= 70:
+        return "70-79"
+    return "<70"
+
+
+def _rebuild_journal_summary(cursor):
+    """Recompute every summary row from `trades` with SQL aggregation."""
+    aggregates = f"""
+        COUNT(*),
+        COALESCE(SUM(CASE WHEN status = 'ACTIVE' THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN status = 'ACTIVE' THEN position_size ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN status <> 'ACTIVE' THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN exit_price IS NOT NULL AND exit_price > entry_price THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN exit_price IS NOT NULL AND exit_price <= entry_price THEN 1 ELSE 0 END), 0),
+        COUNT({R_MULTIPLE_SQL}),
+        COALESCE(SUM({R_MULTIPLE_SQL}), 0)
+    """
+    columns = ", ".join(["scope", "scope_key"] + SUMMARY_COUNTERS)
+    cursor.execute("DELETE FROM journal_summary")
+    cursor.execute(
+        f"INSERT INTO journal_summary ({columns}) "
+        f"SELECT 'total', 'ALL', {aggregates} FROM trades WHERE {JOURNAL_TRADE_FILTER}"
+    )
+    for scope, key_sql in (("symbol", "COALESCE(symbol, 'UNKNOWN')"), ("confidence", CONFIDENCE_BUCKET_SQL)):
+        cursor.execute(
+            f"INSERT INTO journal_summary ({columns}) "
+            f"SELECT '{scope}', {key_sql}, {aggregates} FROM trades WHERE {JOURNAL_TRADE_FILTER} "
+            f"GROUP BY {key_sql}"
         )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS app_state (
-            id INTEGER PRIMARY KEY,
-            kill_switch INTEGER
+
+
+def _apply_journal_deltas(cursor, deltas):
+    """Add per-trade counter deltas to the total, symbol and confidence summary rows.
+
+    `deltas` is a list of (symbol, confidence, {counter: delta}).
+    """
+    merged = {}
+    for symbol, confidence, delta in deltas:
+        for key in (("total", "ALL"), ("symbol", symbol or "UNKNOWN"), ("confidence", _confidence_bucket(confidence))):
+            bucket = merged.setdefault(key, dict.fromkeys(SUMMARY_COUNTERS, 0))
+            for counter, value in delta.items():
+                bucket[counter] += value
+    if not merged:
+        return
+
+    ph = _ph()
+    columns = ["scope", "scope_key"] + SUMMARY_COUNTERS
+    updates = ", ".join(f"{name}=journal_summary.{name} + excluded.{name}" for name in SUMMARY_COUNTERS)
+    cursor.executemany(
+        f"INSERT INTO journal_summary ({', '.join(columns)}) VALUES ({', '.join(ph for _ in columns)}) "
+        f"ON CONFLICT (scope, scope_key) DO UPDATE SET {updates}",
+        [key + tuple(bucket[name] for name in SUMMARY_COUNTERS) for key, bucket in merged.items()],
+    )
+
+
+def _close_active_trades(cursor, closures):
+    """Close ACTIVE trades and update the journal summary in the caller's transaction.
+
+    `closures` is a list of (trade_id, status, exit_price, exit_date); exit_price may be None.
+    Returns the number of trades closed.
+    """
+    ph = _ph()
+    by_id = {int(trade_id): (status, exit_price, exit_date) for trade_id, status, exit_price, exit_date in closures}
+    ids = list(by_id)
+    open_rows = []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        cursor.execute(
+            f"SELECT id, symbol, confidence, entry_price, stop_price, position_size FROM trades "
+            f"WHERE status={ph} AND id IN ({', '.join(ph for _ in chunk)})",
+            tuple(["ACTIVE"] + chunk),
         )
-        """)
+        open_rows.extend(cursor.fetchall())
+    if not open_rows:
+        return 0
+
+    updated_at = datetime.now().isoformat(timespec="microseconds")
+    updates = []
+    deltas = []
+    for trade_id, symbol, confidence, entry_price, stop_price, position_size in open_rows:
+        status, exit_price, exit_date = by_id[int(trade_id)]
+        updates.append((status, exit_price, exit_date, updated_at, trade_id, "ACTIVE"))
+        if not str(status).startswith("CLOSED"):
+            # Failed/rejected buys drop out of JOURNAL_TRADE_FILTER entirely.
+            deltas.append((symbol, confidence, {"trades": -1, "open_trades": -1, "open_exposure": -float(position_size or 0)}))
+            continue
+        delta = {"open_trades": -1, "open_exposure": -float(position_size or 0), "closed_trades": 1}
+        if exit_price is not None and entry_price is not None:
+            delta["wins" if float(exit_price) > float(entry_price) else "losses"] = 1
+            if stop_price is not None and float(entry_price) > float(stop_price):
+                delta["r_trades"] = 1
+                delta["sum_r"] = (float(exit_price) - float(entry_price)) / (float(entry_price) - float(stop_price))
+        deltas.append((symbol, confidence, delta))
+
+    cursor.executemany(
+        f"UPDATE trades SET status={ph}, exit_price={ph}, exit_date={ph}, updated_at={ph} WHERE id={ph} AND status={ph}",
+        updates,
+    )
+    _apply_journal_deltas(cursor, deltas)
+    return len(updates)
+
+
+def _column_types():
+    if _is_postgres():
+        return {"pk": "BIGSERIAL PRIMARY KEY", "ref": "BIGINT", "real": "DOUBLE PRECISION", "bool": "BOOLEAN"}
+    return {"pk": "INTEGER PRIMARY KEY AUTOINCREMENT", "ref": "INTEGER", "real": "REAL", "bool": "INTEGER"}
+
+
+def _migration_base_tables(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS trades (
+        id {t["pk"]},
+        symbol TEXT,
+        security_id TEXT,
+        entry_price {t["real"]},
+        stop_price {t["real"]},
+        position_size {t["real"]},
+        confidence {t["real"]},
+        status TEXT,
+        entry_date TEXT,
+        buy_order_id TEXT,
+        stop_order_id TEXT
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS portfolio (
+        id INTEGER PRIMARY KEY,
+        peak_equity {t["real"]}
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS app_state (
+        id INTEGER PRIMARY KEY,
+        kill_switch {t["bool"]}
+    )
+    """)
 
     cursor.execute(f"SELECT * FROM portfolio WHERE id={_ph()}", (1,))
     if not cursor.fetchone():
         cursor.execute(
             f"INSERT INTO portfolio (id, peak_equity) VALUES ({_ph()}, {_ph()})",
-            (1, 10000),
+            (1, LEGACY_PEAK_SEED),
         )
 
     cursor.execute(f"SELECT * FROM app_state WHERE id={_ph()}", (1,))
@@ -113,68 +262,901 @@ def init_db():
             (1, False if _is_postgres() else 0),
         )
 
-    conn.commit()
-    conn.close()
+
+def _migration_trade_refs(cursor):
+    _ensure_column(cursor, "trades", "entry_ref", "TEXT")
+    # Write-behind journal replays are idempotent on entry_ref.
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_trades_entry_ref ON trades (entry_ref)")
+    # Reconciliation and the active-trade hot path both filter on status first.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_status_security ON trades (status, security_id)")
+
+
+def _migration_scan_history(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS scan_runs (
+        id {t["pk"]},
+        started_at TEXT,
+        run_date TEXT,
+        symbols_checked INTEGER,
+        candidates INTEGER,
+        errors INTEGER
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS scan_diagnostics (
+        id {t["pk"]},
+        run_id {t["ref"]},
+        run_date TEXT,
+        symbol TEXT,
+        security_id TEXT,
+        status TEXT,
+        reason TEXT,
+        score {t["real"]},
+        message TEXT,
+        details TEXT
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS scan_candidates (
+        id {t["pk"]},
+        run_id {t["ref"]},
+        run_date TEXT,
+        symbol TEXT,
+        security_id TEXT,
+        price {t["real"]},
+        stop_price {t["real"]},
+        confidence {t["real"]},
+        signal_strength TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_diag_run ON scan_diagnostics (run_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_diag_symbol ON scan_diagnostics (symbol, reason, run_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_diag_reason ON scan_diagnostics (reason, run_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_cand_run ON scan_candidates (run_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_cand_symbol ON scan_candidates (symbol, run_date)")
+
+
+def _migration_trade_exits(cursor):
+    _ensure_column(cursor, "trades", "exit_price", _column_types()["real"])
+    _ensure_column(cursor, "trades", "exit_date", "TEXT")
+
+
+def _migration_equity_curve(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS equity_curve (
+        snapshot_date TEXT PRIMARY KEY,
+        equity {t["real"]},
+        peak_equity {t["real"]},
+        drawdown {t["real"]},
+        updated_at TEXT
+    )
+    """)
+
+
+def _migration_journal_summary(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS journal_summary (
+        scope TEXT NOT NULL,
+        scope_key TEXT NOT NULL,
+        trades INTEGER DEFAULT 0,
+        open_trades INTEGER DEFAULT 0,
+        open_exposure {t["real"]} DEFAULT 0,
+        closed_trades INTEGER DEFAULT 0,
+        wins INTEGER DEFAULT 0,
+        losses INTEGER DEFAULT 0,
+        r_trades INTEGER DEFAULT 0,
+        sum_r {t["real"]} DEFAULT 0,
+        PRIMARY KEY (scope, scope_key)
+    )
+    """)
+    _rebuild_journal_summary(cursor)
+
+
+def _migration_candles(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS candles (
+        security_id TEXT NOT NULL,
+        candle_date TEXT NOT NULL,
+        open {t["real"]},
+        high {t["real"]},
+        low {t["real"]},
+        close {t["real"]},
+        volume {t["real"]},
+        PRIMARY KEY (security_id, candle_date)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_candles_date ON candles (candle_date)")
+
+
+def _migration_orders(cursor):
+    t = _column_types()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id TEXT PRIMARY KEY,
+        trade_id {t["ref"]},
+        kind TEXT,
+        security_id TEXT,
+        quantity INTEGER,
+        status TEXT,
+        filled_qty INTEGER,
+        message TEXT,
+        first_seen TEXT,
+        updated_at TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_trade ON orders (trade_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_updated ON orders (updated_at)")
+
+
+def _migration_candle_updates(cursor):
+    _ensure_column(cursor, "candles", "updated_at", "TEXT")
+    # Existing bars count as written on their own date, so an old candle_date export watermark still lines up.
+    cursor.execute("UPDATE candles SET updated_at=candle_date WHERE updated_at IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_candles_updated ON candles (updated_at)")
+
+
+def _migration_trade_updates(cursor):
+    _ensure_column(cursor, "trades", "updated_at", "TEXT")
+    # Existing trades count as last changed when they closed (or opened), so the entry_date
+    # watermark of an earlier export still lines up and trades closed since are exported again.
+    cursor.execute("UPDATE trades SET updated_at=COALESCE(exit_date, entry_date) WHERE updated_at IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_updated ON trades (updated_at)")
+
+
+def _migration_trade_quantity(cursor):
+    # Shares actually ordered; position_size / entry_price is not always a whole number.
+    _ensure_column(cursor, "trades", "order_quantity", "INTEGER")
+
+
+# Append-only: never edit or reorder a released migration, add a new one instead.
+# Every step is idempotent so databases created before versioning upgrade cleanly.
+MIGRATIONS = [
+    (1, _migration_base_tables),
+    (2, _migration_trade_refs),
+    (3, _migration_scan_history),
+    (4, _migration_trade_exits),
+    (5, _migration_equity_curve),
+    (6, _migration_journal_summary),
+    (7, _migration_candles),
+    (8, _migration_orders),
+    (9, _migration_candle_updates),
+    (10, _migration_trade_updates),
+    (11, _migration_trade_quantity),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_ready = set()
+
+
+def _db_target():
+    return DATABASE_URL if _is_postgres() else os.path.abspath(SQLITE_DB_NAME)
+
+
+def get_schema_version(cursor):
+    if _is_postgres():
+        cursor.execute("SELECT to_regclass('schema_version')")
+        exists = cursor.fetchone()[0] is not None
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+        exists = cursor.fetchone() is not None
+    if not exists:
+        return 0
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+
+def init_db():
+    """Apply pending schema migrations; a no-op once the schema is current.
+
+    After the first successful call in a process, later calls (every Streamlit rerun)
+    return without touching the database.
+    """
+    target = _db_target()
+    if target in _schema_ready:
+        return
+
+    conn = _connect()
+    cursor = conn.cursor()
+    try:
+        current = get_schema_version(cursor)
+        if current < SCHEMA_VERSION:
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TEXT)")
+            conn.commit()
+            for version, migrate in MIGRATIONS:
+                if version <= current:
+                    continue
+                migrate(cursor)
+                cursor.execute(
+                    f"INSERT INTO schema_version (version, applied_at) VALUES ({_ph()}, {_ph()})",
+                    (version, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+                )
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _schema_ready.add(target)
 
 
 def add_trade(symbol, security_id, entry_price, stop_price,
-              position_size, confidence, buy_id, stop_id):
+              position_size, confidence, buy_id, stop_id, quantity=None):
+    add_trades(
+        [
+            {
+                "symbol": symbol,
+                "security_id": security_id,
+                "entry_price": entry_price,
+                "stop_price": stop_price,
+                "position_size": position_size,
+                "confidence": confidence,
+                "buy_id": buy_id,
+                "stop_id": stop_id,
+                "quantity": quantity,
+            }
+        ]
+    )
+
+
+@timed("db_query_seconds")
+def add_trades(rows):
+    """Insert several journal rows in one transaction.
+
+    Each row is a dict with the `add_trade` fields (`buy_id`/`stop_id` for order ids)
+    plus optional `quantity` (shares ordered), `status` (default ACTIVE), `entry_date`
+    (default today) and `entry_ref`. Rows whose `entry_ref` already exists are skipped, so replays are safe.
+    """
+    if not rows:
+        return 0
 
     conn = _connect()
     cursor = conn.cursor()
     ph = _ph()
+    today = datetime.now().strftime("%Y-%m-%d")
+    updated_at = datetime.now().isoformat(timespec="microseconds")
+    values = [
+        (
+            row["symbol"], row["security_id"], row["entry_price"], row["stop_price"],
+            row["position_size"], row["confidence"],
+            row.get("status", "ACTIVE"), row.get("entry_date") or today,
+            row["buy_id"], row["stop_id"], row.get("quantity"), updated_at, row.get("entry_ref"),
+        )
+        for row in rows
+    ]
+    try:
+        refs = [value[-1] for value in values if value[-1]]
+        existing = set()
+        for start in range(0, len(refs), 500):
+            chunk = refs[start:start + 500]
+            cursor.execute(
+                f"SELECT entry_ref FROM trades WHERE entry_ref IN ({', '.join(ph for _ in chunk)})",
+                tuple(chunk),
+            )
+            existing.update(row[0] for row in cursor.fetchall())
+        # `existing` also collects refs as they are kept, so a ref repeated within the batch
+        # is inserted (and counted in the summary) once.
+        kept = []
+        for value in values:
+            if value[-1]:
+                if value[-1] in existing:
+                    continue
+                existing.add(value[-1])
+            kept.append(value)
+        values = kept
 
-    cursor.execute(f"""
-    INSERT INTO trades
-    (symbol, security_id, entry_price, stop_price, position_size,
-     confidence, status, entry_date, buy_order_id, stop_order_id)
-    VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})
-    """, (
-        symbol, security_id, entry_price, stop_price,
-        position_size, confidence,
-        "ACTIVE", datetime.now().strftime("%Y-%m-%d"),
-        buy_id, stop_id
-    ))
+        cursor.executemany(f"""
+        INSERT INTO trades
+        (symbol, security_id, entry_price, stop_price, position_size,
+         confidence, status, entry_date, buy_order_id, stop_order_id, order_quantity, updated_at, entry_ref)
+        VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})
+        ON CONFLICT (entry_ref) DO NOTHING
+        """, values)
+        _apply_journal_deltas(
+            cursor,
+            [
+                (value[0], value[5], {"trades": 1, "open_trades": 1, "open_exposure": float(value[4] or 0)})
+                for value in values
+                if value[6] == "ACTIVE"
+            ],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(values)
 
-    conn.commit()
+
+@timed("db_query_seconds")
+def get_active_trades():
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {_trade_select()} FROM trades WHERE status={_ph()}", ("ACTIVE",))
+    data = cursor.fetchall()
     conn.close()
+    return [TradeRecord.from_row(row) for row in data]
 
 
-def get_active_trades():
+@timed("db_query_seconds")
+def get_closed_trade_outcomes():
+    """(entry_price, stop_price, exit_price) of closed trades with a valid stop, oldest first."""
     conn = _connect()
     cursor = conn.cursor()
-    cursor.execute(f"SELECT * FROM trades WHERE status={_ph()}", ("ACTIVE",))
+    cursor.execute(
+        "SELECT entry_price, stop_price, exit_price FROM trades "
+        "WHERE exit_price IS NOT NULL AND stop_price IS NOT NULL AND entry_price > stop_price AND stop_price > 0 "
+        "ORDER BY id"
+    )
     data = cursor.fetchall()
     conn.close()
     return data
 
 
+@timed("db_query_seconds")
+def save_order_states(rows):
+    """Upsert order states; `rows` are (order_id, trade_id, kind, security_id, quantity, status, filled_qty, message)."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    values = [tuple(row) + (now, now) for row in rows]
+    if not values:
+        return 0
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    try:
+        cursor.executemany(
+            f"""
+            INSERT INTO orders (
+                order_id, trade_id, kind, security_id, quantity, status, filled_qty, message, first_seen, updated_at
+            )
+            VALUES ({", ".join(ph for _ in range(10))})
+            ON CONFLICT (order_id) DO UPDATE SET
+                status=excluded.status,
+                filled_qty=excluded.filled_qty,
+                message=excluded.message,
+                updated_at=excluded.updated_at
+            """,
+            values,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(values)
+
+
+@timed("db_query_seconds")
+def set_stop_order_ids(updates):
+    """Point trades at re-placed stops; `updates` are (trade_id, stop_order_id)."""
+    updated_at = datetime.now().isoformat(timespec="microseconds")
+    updates = [(str(stop_id), updated_at, int(trade_id)) for trade_id, stop_id in updates]
+    if not updates:
+        return 0
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    try:
+        cursor.executemany(f"UPDATE trades SET stop_order_id={ph}, updated_at={ph} WHERE id={ph}", updates)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(updates)
+
+
+@timed("db_query_seconds")
+def get_trade_ids(entry_refs):
+    """Map journal entry refs to trade ids; refs not inserted yet are left out."""
+    entry_refs = [ref for ref in entry_refs if ref]
+    if not entry_refs:
+        return {}
+
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT entry_ref, id FROM trades WHERE entry_ref IN ({', '.join(_ph() for _ in entry_refs)})",
+        entry_refs,
+    )
+    data = cursor.fetchall()
+    conn.close()
+    return {ref: int(trade_id) for ref, trade_id in data}
+
+
+@timed("db_query_seconds")
+def get_order_states(limit=100):
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT order_id, trade_id, kind, security_id, quantity, status, filled_qty, message, updated_at FROM orders "
+        f"ORDER BY updated_at DESC LIMIT {_ph()}",
+        (int(limit),),
+    )
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
 def get_all_trades():
     conn = _connect()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM trades ORDER BY id DESC")
+    cursor.execute(f"SELECT {_trade_select()} FROM trades ORDER BY id DESC")
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def reconcile_active_trades(broker_security_ids, min_age_days=1, closed_status="CLOSED_AT_BROKER"):
+    """Close live ACTIVE trades whose security is no longer held at the broker.
+
+    Paper trades are never touched. Trades younger than `min_age_days` are skipped so
+    after-market orders that have not filled yet are not closed prematurely.
+    """
+    held = {str(sec).strip() for sec in broker_security_ids if str(sec).strip()}
+    cutoff = (datetime.now() - timedelta(days=int(min_age_days))).strftime("%Y-%m-%d")
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    cursor.execute(
+        f"SELECT id, security_id FROM trades WHERE status={ph} AND entry_date<={ph} "
+        f"AND buy_order_id NOT LIKE {ph}",
+        ("ACTIVE", cutoff, "PAPER%"),
+    )
+    today = datetime.now().strftime("%Y-%m-%d")
+    stale = [(row[0], closed_status, None, today) for row in cursor.fetchall() if str(row[1]).strip() not in held]
+    try:
+        closed = _close_active_trades(cursor, stale) if stale else 0
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return closed
+
+
+@timed("db_query_seconds")
+def save_scan_run(candidates, diagnostics):
+    """Persist one scan run with its candidate and diagnostics rows. Returns the run id.
+
+    Both arguments are lists of dicts (e.g. `DataFrame.to_dict("records")`). Diagnostic
+    fields outside the fixed columns are kept as JSON in `details`.
+    """
+    now = datetime.now()
+    run_date = now.strftime("%Y-%m-%d")
+    errors = sum(1 for row in diagnostics if row.get("status") == "error")
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    try:
+        run_values = (now.strftime("%Y-%m-%d %H:%M:%S"), run_date, len(diagnostics), len(candidates), errors)
+        run_sql = (
+            "INSERT INTO scan_runs (started_at, run_date, symbols_checked, candidates, errors) "
+            f"VALUES ({ph}, {ph}, {ph}, {ph}, {ph})"
+        )
+        if _is_postgres():
+            cursor.execute(run_sql + " RETURNING id", run_values)
+            run_id = cursor.fetchone()[0]
+        else:
+            cursor.execute(run_sql, run_values)
+            run_id = cursor.lastrowid
+
+        diagnostic_values = []
+        for row in diagnostics:
+            details = {
+                key: _clean(value)
+                for key, value in row.items()
+                if key not in DIAGNOSTIC_COLUMNS and _clean(value) is not None
+            }
+            score = _clean(row.get("score"))
+            if score is None:
+                score = _clean(row.get("confidence"))
+            diagnostic_values.append(
+                (
+                    run_id, run_date,
+                    _clean(row.get("symbol")), _clean(row.get("security_id")),
+                    _clean(row.get("status")), _clean(row.get("reason")),
+                    float(score) if score is not None else None,
+                    _clean(row.get("message")),
+                    json.dumps(details, default=str) if details else None,
+                )
+            )
+        _bulk_insert(
+            cursor,
+            "scan_diagnostics",
+            ["run_id", "run_date", "symbol", "security_id", "status", "reason", "score", "message", "details"],
+            diagnostic_values,
+        )
+
+        candidate_values = [
+            (
+                run_id, run_date,
+                row.get("symbol"), str(row.get("security_id")),
+                _clean(row.get("price")), _clean(row.get("stop_price")),
+                _clean(row.get("confidence")), _clean(row.get("signal_strength")),
+            )
+            for row in candidates
+        ]
+        _bulk_insert(
+            cursor,
+            "scan_candidates",
+            ["run_id", "run_date", "symbol", "security_id", "price", "stop_price", "confidence", "signal_strength"],
+            candidate_values,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return run_id
+
+
+@timed("db_query_seconds")
+def count_scan_failures(symbol, reason, since_date):
+    """How many scan runs since `since_date` (YYYY-MM-DD) logged `reason` for `symbol`."""
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    cursor.execute(
+        f"SELECT COUNT(*) FROM scan_diagnostics WHERE symbol={ph} AND reason={ph} AND run_date>={ph}",
+        (symbol, reason, since_date),
+    )
+    value = cursor.fetchone()[0]
+    conn.close()
+    return int(value or 0)
+
+
+@timed("db_query_seconds")
+def get_scan_reason_counts(since_date, status=None):
+    """Rows of (symbol, reason, occurrences, last_seen) since `since_date`, most frequent first."""
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    sql = "SELECT symbol, reason, COUNT(*) AS occurrences, MAX(run_date) AS last_seen FROM scan_diagnostics WHERE run_date>=" + ph
+    params = [since_date]
+    if status:
+        sql += f" AND status={ph}"
+        params.append(status)
+    sql += " GROUP BY symbol, reason ORDER BY occurrences DESC, symbol"
+    cursor.execute(sql, tuple(params))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def get_recent_scan_runs(limit=20):
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, started_at, symbols_checked, candidates, errors FROM scan_runs "
+        f"ORDER BY id DESC LIMIT {_ph()}",
+        (int(limit),),
+    )
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def get_scan_diagnostics(run_id):
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT symbol, security_id, status, reason, score, message, details FROM scan_diagnostics "
+        f"WHERE run_id={_ph()} ORDER BY id",
+        (run_id,),
+    )
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def get_open_paper_trades():
+    """(id, security_id, stop_price, entry_date) for every ACTIVE paper trade."""
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    cursor.execute(
+        f"SELECT id, security_id, stop_price, entry_date FROM trades WHERE status={ph} AND buy_order_id={ph}",
+        ("ACTIVE", "PAPER_BUY"),
+    )
     data = cursor.fetchall()
     conn.close()
     return data
 
 
-def update_peak_equity(value):
+@timed("db_query_seconds")
+def close_trades(closures):
+    """Bulk-close trades. `closures` is an iterable of (trade_id, status, exit_price, exit_date).
+
+    Only rows that are still ACTIVE are updated, so repeated runs are harmless.
+    """
+    closures = list(closures)
+    if not closures:
+        return 0
+
     conn = _connect()
     cursor = conn.cursor()
-    cursor.execute(f"UPDATE portfolio SET peak_equity={_ph()} WHERE id={_ph()}", (value, 1))
+    try:
+        closed = _close_active_trades(cursor, closures)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return closed
+
+
+def _latest_equity_point(cursor, on_or_before=None):
+    ph = _ph()
+    sql = "SELECT snapshot_date, equity, peak_equity, drawdown FROM equity_curve"
+    params = ()
+    if on_or_before:
+        sql += f" WHERE snapshot_date<={ph}"
+        params = (on_or_before,)
+    cursor.execute(sql + " ORDER BY snapshot_date DESC LIMIT 1", params)
+    return cursor.fetchone()
+
+
+@timed("db_query_seconds")
+def record_equity(equity, snapshot_date=None, base_capital=None):
+    """Append or update the equity point for `snapshot_date` (default today).
+
+    The running peak and drawdown are carried forward from the previous point, so each
+    write is one indexed lookup plus one upsert. Meant for appending in date order.
+    The first point's peak starts at `base_capital` (or `equity` when not given).
+    Returns (snapshot_date, equity, peak_equity, drawdown).
+    """
+    snapshot_date = snapshot_date or datetime.now().strftime("%Y-%m-%d")
+    equity = float(equity)
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    previous = _latest_equity_point(cursor, snapshot_date)
+    if previous is not None:
+        prev_peak = float(previous[2])
+    else:
+        # First point: carry over a legacy single-row peak that was actually set, so the breaker
+        # state survives; the migration's placeholder seed says nothing about this account.
+        cursor.execute(f"SELECT peak_equity FROM portfolio WHERE id={ph}", (1,))
+        legacy = cursor.fetchone()
+        legacy_peak = float(legacy[0]) if legacy and legacy[0] is not None else 0.0
+        if legacy_peak == LEGACY_PEAK_SEED:
+            legacy_peak = 0.0
+        prev_peak = max(legacy_peak, float(base_capital) if base_capital is not None else equity)
+
+    peak = max(prev_peak, equity)
+    drawdown = (peak - equity) / peak if peak > 0 else 0.0
+    point = (snapshot_date, equity, peak, drawdown)
+
+    unchanged = (
+        previous is not None
+        and previous[0] == snapshot_date
+        and round(float(previous[1]), 2) == round(equity, 2)
+    )
+    if not unchanged:
+        cursor.execute(
+            f"""
+            INSERT INTO equity_curve (snapshot_date, equity, peak_equity, drawdown, updated_at)
+            VALUES ({ph}, {ph}, {ph}, {ph}, {ph})
+            ON CONFLICT (snapshot_date) DO UPDATE SET
+                equity=excluded.equity,
+                peak_equity=excluded.peak_equity,
+                drawdown=excluded.drawdown,
+                updated_at=excluded.updated_at
+            """,
+            point + (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+        )
+        conn.commit()
+    conn.close()
+    return point
+
+
+@timed("db_query_seconds")
+def get_latest_equity():
+    """Most recent (snapshot_date, equity, peak_equity, drawdown), or None."""
+    conn = _connect()
+    cursor = conn.cursor()
+    row = _latest_equity_point(cursor)
+    conn.close()
+    return row
+
+
+@timed("db_query_seconds")
+def get_equity_curve(start_date=None, end_date=None):
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    sql = "SELECT snapshot_date, equity, peak_equity, drawdown FROM equity_curve WHERE 1=1"
+    params = []
+    if start_date:
+        sql += f" AND snapshot_date>={ph}"
+        params.append(start_date)
+    if end_date:
+        sql += f" AND snapshot_date<={ph}"
+        params.append(end_date)
+    cursor.execute(sql + " ORDER BY snapshot_date", tuple(params))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def get_max_drawdown(start_date, end_date):
+    """Worst peak-to-trough drawdown with the peak measured inside [start_date, end_date]."""
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    cursor.execute(
+        f"""
+        SELECT MAX((window_peak - equity) / window_peak) FROM (
+            SELECT equity,
+                   MAX(equity) OVER (ORDER BY snapshot_date ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+                       AS window_peak
+            FROM equity_curve
+            WHERE snapshot_date>={ph} AND snapshot_date<={ph}
+        ) curve
+        WHERE window_peak > 0
+        """,
+        (start_date, end_date),
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return float(row[0]) if row and row[0] is not None else 0.0
+
+
+@timed("db_query_seconds")
+def rebuild_journal_summary():
+    conn = _connect()
+    cursor = conn.cursor()
+    _rebuild_journal_summary(cursor)
     conn.commit()
     conn.close()
 
 
-def get_peak_equity():
+@timed("db_query_seconds")
+def get_journal_summary():
+    """Headline journal statistics from the maintained summary row (O(1) regardless of journal size)."""
     conn = _connect()
     cursor = conn.cursor()
-    cursor.execute(f"SELECT peak_equity FROM portfolio WHERE id={_ph()}", (1,))
-    value = cursor.fetchone()[0]
+    ph = _ph()
+    cursor.execute(
+        f"SELECT {', '.join(SUMMARY_COUNTERS)} FROM journal_summary WHERE scope={ph} AND scope_key={ph}",
+        ("total", "ALL"),
+    )
+    row = cursor.fetchone()
     conn.close()
-    return value
+    stats = dict(zip(SUMMARY_COUNTERS, row)) if row else dict.fromkeys(SUMMARY_COUNTERS, 0)
+    decided = (stats["wins"] or 0) + (stats["losses"] or 0)
+    stats["win_rate"] = (stats["wins"] / decided) if decided else None
+    stats["avg_r"] = (stats["sum_r"] / stats["r_trades"]) if stats["r_trades"] else None
+    return stats
+
+
+@timed("db_query_seconds")
+def get_journal_breakdown(scope):
+    """Summary rows for `scope` ("symbol" or "confidence"): key followed by SUMMARY_COUNTERS."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT scope_key, {', '.join(SUMMARY_COUNTERS)} FROM journal_summary WHERE scope={_ph()} "
+        "ORDER BY open_exposure DESC, trades DESC",
+        (scope,),
+    )
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+@timed("db_query_seconds")
+def save_candles(security_id, rows):
+    """Upsert daily candles; `rows` are (candle_date, open, high, low, close, volume) tuples.
+
+    Every insert or update stamps `updated_at`, which incremental exports use as their watermark.
+    """
+    updated_at = datetime.now().isoformat(timespec="microseconds")
+    values = [(str(security_id),) + tuple(row) + (updated_at,) for row in rows]
+    if not values:
+        return 0
+
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    try:
+        cursor.executemany(
+            f"""
+            INSERT INTO candles (security_id, candle_date, open, high, low, close, volume, updated_at)
+            VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})
+            ON CONFLICT (security_id, candle_date) DO UPDATE SET
+                open=excluded.open, high=excluded.high, low=excluded.low,
+                close=excluded.close, volume=excluded.volume, updated_at=excluded.updated_at
+            """,
+            values,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(values)
+
+
+@timed("db_query_seconds")
+def get_candles(security_id, since_date=None):
+    conn = _connect()
+    cursor = conn.cursor()
+    ph = _ph()
+    sql = f"SELECT candle_date, open, high, low, close, volume FROM candles WHERE security_id={ph}"
+    params = [str(security_id)]
+    if since_date:
+        sql += f" AND candle_date>={ph}"
+        params.append(since_date)
+    cursor.execute(sql + " ORDER BY candle_date", tuple(params))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+def select_after_sql(table, columns, after=None, order_by=()):
+    """(sql, params) selecting `columns` from `table` where each `after` column is strictly greater than its value.
+
+    Builds parameterized queries for `stream_query` with the right placeholder style.
+    """
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE 1=1"
+    params = []
+    for column, value in (after or {}).items():
+        sql += f" AND {column}>{_ph()}"
+        params.append(value)
+    if order_by:
+        sql += f" ORDER BY {', '.join(order_by)}"
+    return sql, params
+
+
+def stream_query(sql, params=(), chunk_rows=10000):
+    """Yield lists of at most `chunk_rows` result rows without materializing the full result.
+
+    Postgres uses a named (server-side) cursor so rows are pulled from the server chunk by
+    chunk; SQLite steps its cursor lazily with fetchmany.
+    """
+    conn = _connect()
+    try:
+        if _is_postgres():
+            cursor = conn.cursor(name="stream_query")
+            cursor.itersize = int(chunk_rows)
+        else:
+            cursor = conn.cursor()
+        cursor.execute(sql, tuple(params))
+        while True:
+            rows = cursor.fetchmany(int(chunk_rows))
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+    finally:
+        conn.close()
 
 
+@timed("db_query_seconds")
 def set_kill_switch(enabled):
     conn = _connect()
     cursor = conn.cursor()
@@ -186,6 +1168,7 @@ def set_kill_switch(enabled):
     conn.close()
 
 
+@timed("db_query_seconds")
 def get_kill_switch():
     conn = _connect()
     cursor = conn.cursor()
@@ -0,0 +1,327 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from request_scheduler import PRIORITY_ORDER, broker_call
+
+TICK_SIZE = 0.05
+ORDER_POLL_INTERVAL = 2.0
+FILL_TIMEOUT = 60.0
+
+FILLED_STATUSES = {"TRADED"}
+FAILED_STATUSES = {"REJECTED", "CANCELLED", "EXPIRED"}
+# Stop id journaled for a basket leg whose BUY is acknowledged but whose stop is not attached yet.
+PENDING_STOP_ID = "LIVE_STOP_PENDING"
+
+_jobs_lock = threading.Lock()
+_jobs = {}
+
+
+def exchange_eq(dhan_client):
+    return getattr(dhan_client, "NSE_EQ", getattr(dhan_client, "NSE", "NSE_EQ"))
+
+
+def stop_order_types(dhan_client):
+    """Return (SLM, SL) order type constants for the installed dhanhq version."""
+    order_type_stop = getattr(dhan_client, "STOP_LOSS", getattr(dhan_client, "SL", "STOP_LOSS"))
+    return getattr(dhan_client, "SLM", None), getattr(dhan_client, "SL", order_type_stop)
+
+
+def extract_data_rows(response):
+    if not isinstance(response, dict):
+        return []
+    payload = response.get("data", response)
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        for key in ("data", "rows", "positions", "holdings"):
+            value = payload.get(key)
+            if isinstance(value, list):
+                return value
+    return []
+
+
+def extract_order_id(order_response):
+    if not isinstance(order_response, dict):
+        return None
+    for key in ("orderId", "order_id", "data"):
+        value = order_response.get(key)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+        if isinstance(value, dict):
+            nested = value.get("orderId") or value.get("order_id")
+            if isinstance(nested, str) and nested.strip():
+                return nested.strip()
+    return None
+
+
+def place_market_buy(dhan_client, security_id, quantity):
+    response = broker_call(
+        "order",
+        PRIORITY_ORDER,
+        dhan_client.place_order,
+        security_id=security_id,
+        exchange_segment=exchange_eq(dhan_client),
+        transaction_type=dhan_client.BUY,
+        quantity=quantity,
+        order_type=dhan_client.MARKET,
+        product_type=dhan_client.CNC,
+        price=0,
+    )
+    order_id = extract_order_id(response)
+    if not order_id:
+        raise RuntimeError(f"No order id in buy response: {response}")
+    return order_id
+
+
+def place_stop_order(dhan_client, security_id, quantity, stop_price):
+    rounded_stop = round(float(stop_price), 2)
+    if rounded_stop <= 0:
+        raise ValueError(f"Invalid stop price: {stop_price}")
+
+    order_type_slm, order_type_sl = stop_order_types(dhan_client)
+    attempts = []
+    if order_type_slm is not None:
+        attempts.append(
+            {
+                "order_type": order_type_slm,
+                "price": 0,
+                "trigger_price": rounded_stop,
+                "label": "SLM",
+            }
+        )
+
+    sl_limit = max(round(rounded_stop - TICK_SIZE, 2), TICK_SIZE)
+    attempts.append(
+        {
+            "order_type": order_type_sl,
+            "price": sl_limit,
+            "trigger_price": rounded_stop,
+            "label": "SL",
+        }
+    )
+
+    last_error = None
+    for attempt in attempts:
+        try:
+            response = broker_call(
+                "order",
+                PRIORITY_ORDER,
+                dhan_client.place_order,
+                security_id=security_id,
+                exchange_segment=exchange_eq(dhan_client),
+                transaction_type=dhan_client.SELL,
+                quantity=quantity,
+                order_type=attempt["order_type"],
+                product_type=dhan_client.CNC,
+                price=attempt["price"],
+                trigger_price=attempt["trigger_price"],
+            )
+            order_id = extract_order_id(response)
+            if order_id:
+                return order_id, attempt["label"], response
+            last_error = Exception(f"No order id in stop response: {response}")
+        except Exception as exc:
+            last_error = exc
+
+    raise RuntimeError(str(last_error) if last_error else "Unknown stop order placement failure")
+
+
+def fetch_order_book(dhan_client):
+    """One batched call for the status of every order placed today, keyed by order id."""
+    response = broker_call("order", PRIORITY_ORDER, dhan_client.get_order_list)
+    book = {}
+    for item in extract_data_rows(response):
+        if not isinstance(item, dict):
+            continue
+        order_id = str(item.get("orderId") or item.get("order_id") or "").strip()
+        if not order_id:
+            continue
+        status = str(item.get("orderStatus") or item.get("order_status") or item.get("status") or "").strip().upper()
+        try:
+            filled_qty = int(float(item.get("filledQty") or item.get("filled_qty") or 0))
+        except (TypeError, ValueError):
+            filled_qty = 0
+        book[order_id] = {"status": status, "filled_qty": filled_qty, "raw": item}
+    return book
+
+
+def size_basket(candidates, base_capital, risk_per_trade, total_risk_budget, max_positions):
+    """Fixed-fractional sizing for several candidates under one total risk budget.
+
+    `candidates` is an iterable of `records.Candidate`, already in priority order.
+    Notional exposure is capped at `base_capital`.
+    """
+    per_trade_risk = base_capital * risk_per_trade
+    risk_left = base_capital * total_risk_budget
+    capital_left = float(base_capital)
+    basket = []
+
+    for candidate in candidates:
+        if len(basket) >= int(max_positions):
+            break
+        price = candidate.price
+        stop_price = candidate.stop_price
+        per_share_risk = price - stop_price
+        if price <= 0 or per_share_risk <= 0:
+            continue
+
+        risk_amount = min(per_trade_risk, risk_left)
+        quantity = int(risk_amount / per_share_risk)
+        quantity = min(quantity, int(capital_left / price))
+        if quantity <= 0:
+            continue
+
+        position_value = quantity * price
+        risk_left -= quantity * per_share_risk
+        capital_left -= position_value
+        basket.append(
+            {
+                "symbol": candidate.symbol,
+                "security_id": candidate.security_id,
+                "price": price,
+                "stop_price": stop_price,
+                "confidence": float(candidate.confidence),
+                "position_value": position_value,
+                "quantity": quantity,
+                "risk_amount": round(quantity * per_share_risk, 2),
+            }
+        )
+    return basket
+
+
+def _attach_stop(dhan_client, leg, quantity):
+    try:
+        stop_id, stop_type, _ = place_stop_order(
+            dhan_client=dhan_client,
+            security_id=leg["security_id"],
+            quantity=quantity,
+            stop_price=leg["stop_price"],
+        )
+        return stop_id, stop_type, None
+    except Exception as exc:
+        return "LIVE_STOP_FAIL", None, str(exc)
+
+
+def execute_basket(dhan_client, basket, fill_timeout=FILL_TIMEOUT, poll_interval=ORDER_POLL_INTERVAL, on_bought=None):
+    """Place BUY orders for every leg concurrently and attach stops as fills are confirmed.
+
+    `on_bought(legs)` runs once every BUY is acknowledged, before any fill is polled, so the
+    legs can be journaled right away; legs still waiting for a stop carry PENDING_STOP_ID.
+    Fills are confirmed from one order-book call per polling cycle. Legs still pending
+    when `fill_timeout` expires (e.g. after-market orders) get their stop attached anyway,
+    matching the single-order flow, so no position is left unprotected. Returns one
+    journal-ready dict per leg plus a `message` describing the outcome.
+    """
+    legs = [dict(leg, buy_id="LIVE_BUY_FAIL", stop_id=None, status="ACTIVE", message="") for leg in basket]
+    if not legs:
+        return legs
+
+    with ThreadPoolExecutor(max_workers=min(8, len(legs))) as pool:
+        buy_futures = {
+            pool.submit(place_market_buy, dhan_client, leg["security_id"], leg["quantity"]): leg for leg in legs
+        }
+        for future, leg in buy_futures.items():
+            try:
+                leg["buy_id"] = future.result()
+            except Exception as exc:
+                leg["stop_id"] = "LIVE_STOP_SKIPPED"
+                leg["status"] = "BUY_FAILED"
+                leg["message"] = f"buy_failed: {exc}"
+
+        if on_bought is not None:
+            on_bought([dict(leg, stop_id=leg["stop_id"] or PENDING_STOP_ID) for leg in legs])
+
+        pending = {leg["buy_id"]: leg for leg in legs if leg["stop_id"] is None}
+        stop_futures = {}
+        deadline = time.monotonic() + float(fill_timeout)
+
+        while pending and time.monotonic() < deadline:
+            try:
+                book = fetch_order_book(dhan_client)
+            except Exception:
+                book = {}
+            for order_id in list(pending):
+                entry = book.get(order_id)
+                if entry is None:
+                    continue
+                leg = pending[order_id]
+                if entry["status"] in FILLED_STATUSES:
+                    quantity = entry["filled_qty"] or leg["quantity"]
+                    stop_futures[pool.submit(_attach_stop, dhan_client, leg, quantity)] = leg
+                    del pending[order_id]
+                elif entry["status"] in FAILED_STATUSES:
+                    leg["stop_id"] = "LIVE_STOP_SKIPPED"
+                    leg["status"] = "BUY_" + entry["status"]
+                    leg["message"] = f"buy_{entry['status'].lower()}"
+                    del pending[order_id]
+            if pending:
+                time.sleep(float(poll_interval))
+
+        for leg in pending.values():
+            leg["message"] = "fill_not_confirmed_stop_attached"
+            stop_futures[pool.submit(_attach_stop, dhan_client, leg, leg["quantity"])] = leg
+
+        for future, leg in stop_futures.items():
+            stop_id, stop_type, error = future.result()
+            leg["stop_id"] = stop_id
+            if error:
+                leg["message"] = f"stop_failed: {error}"
+            elif not leg["message"]:
+                leg["message"] = f"stop_placed_{stop_type}"
+
+    return legs
+
+
+def start_basket_job(dhan_client, basket, on_bought=None, on_done=None, **kwargs):
+    """Run `execute_basket` on a background thread so the UI is not blocked while fills are polled.
+
+    `on_bought(legs)` runs on that thread as soon as the BUYs are acknowledged (e.g. to
+    journal the legs) and `on_done(legs)` once every leg has its stop (e.g. to record the
+    stop ids). Returns the job id; `get_basket_jobs` reports progress.
+    """
+    job_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    with _jobs_lock:
+        _jobs[job_id] = {"status": "running", "size": len(basket), "legs": [], "error": None}
+
+    def bought(legs):
+        with _jobs_lock:
+            _jobs[job_id]["legs"] = legs
+        if on_bought is None:
+            return
+        # A failing callback must not keep the stops from being attached.
+        try:
+            on_bought(legs)
+        except Exception as exc:
+            with _jobs_lock:
+                _jobs[job_id]["error"] = str(exc)
+
+    def run():
+        try:
+            legs = execute_basket(dhan_client, basket, on_bought=bought, **kwargs)
+            with _jobs_lock:
+                _jobs[job_id]["legs"] = legs
+            if on_done is not None:
+                on_done(legs)
+            with _jobs_lock:
+                _jobs[job_id]["status"] = "done"
+        except Exception as exc:
+            with _jobs_lock:
+                _jobs[job_id].update(status="failed", error=str(exc))
+
+    threading.Thread(target=run, name=f"basket-{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_basket_jobs():
+    with _jobs_lock:
+        return {job_id: dict(job) for job_id, job in _jobs.items()}
+
+
+def basket_buys_in_flight():
+    """BUY order ids of running basket jobs; their stops are still being attached by the job."""
+    with _jobs_lock:
+        return {
+            leg["buy_id"] for job in _jobs.values() if job["status"] == "running" for leg in job["legs"]
+        }
@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from database import TRADE_COLUMNS, select_after_sql, stream_query
+
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_FORMATS = ("parquet", "arrow")
+
+# Column types are fixed up front so every chunk shares one schema even when a chunk is all NULL.
+EXPORT_SOURCES = {
+    "trades": {
+        "table": "trades",
+        "columns": [
+            (name, "int64" if name in ("id", "order_quantity") else "float64" if name in (
+                "entry_price", "stop_price", "position_size", "confidence", "exit_price",
+            ) else "string")
+            for name in TRADE_COLUMNS
+        ] + [("updated_at", "string")],
+        "id_column": None,
+        # Inserts, closes and stop re-placements bump updated_at, so a trade that changed after it
+        # was exported is exported again; the row with the newest updated_at wins.
+        "date_column": "updated_at",
+        "order_by": ["updated_at", "id"],
+    },
+    "scan_runs": {
+        "table": "scan_runs",
+        "columns": [
+            ("id", "int64"), ("started_at", "string"), ("run_date", "string"),
+            ("symbols_checked", "int64"), ("candidates", "int64"), ("errors", "int64"),
+        ],
+        "id_column": "id",
+        "date_column": "run_date",
+    },
+    "scan_diagnostics": {
+        "table": "scan_diagnostics",
+        "columns": [
+            ("id", "int64"), ("run_id", "int64"), ("run_date", "string"), ("symbol", "string"),
+            ("security_id", "string"), ("status", "string"), ("reason", "string"), ("score", "float64"),
+            ("message", "string"), ("details", "string"),
+        ],
+        "id_column": "id",
+        "date_column": "run_date",
+    },
+    "scan_candidates": {
+        "table": "scan_candidates",
+        "columns": [
+            ("id", "int64"), ("run_id", "int64"), ("run_date", "string"), ("symbol", "string"),
+            ("security_id", "string"), ("price", "float64"), ("stop_price", "float64"),
+            ("confidence", "float64"), ("signal_strength", "string"),
+        ],
+        "id_column": "id",
+        "date_column": "run_date",
+    },
+    "candles": {
+        "table": "candles",
+        "columns": [
+            ("security_id", "string"), ("candle_date", "string"), ("open", "float64"), ("high", "float64"),
+            ("low", "float64"), ("close", "float64"), ("volume", "float64"), ("updated_at", "string"),
+        ],
+        "id_column": None,
+        # Upserts bump updated_at, so backfilled and re-fetched bars are exported again; a later file
+        # may repeat a (security_id, candle_date), and the row with the newest updated_at wins.
+        "date_column": "updated_at",
+        "order_by": ["updated_at", "security_id", "candle_date"],
+    },
+}
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Export jobs run one at a time: the watermark file is read at the start of an incremental export
+# and rewritten after each file, so two jobs overlapping would export the same rows twice.
+_export_lock = threading.RLock()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise RuntimeError("Install pyarrow to export Arrow/Parquet files.") from exc
+    return pyarrow
+
+
+def _source_query(source, since_id=None, since_date=None):
+    spec = EXPORT_SOURCES[source]
+    after = {}
+    if since_id is not None and spec["id_column"]:
+        after[spec["id_column"]] = int(since_id)
+    if since_date:
+        after[spec["date_column"]] = str(since_date)
+    order = [spec["id_column"]] if spec["id_column"] else spec["order_by"]
+    return select_after_sql(spec["table"], [name for name, _ in spec["columns"]], after, order)
+
+
+def export_source(source, path, fmt="parquet", since_id=None, since_date=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Stream one table to a Parquet or Arrow IPC file in bounded-memory chunks.
+
+    Only rows after `since_id` (tables with an id) and/or after `since_date` are exported.
+    Returns {"rows", "path", "max_id", "max_date"}; the max values are the next watermark.
+    """
+    if source not in EXPORT_SOURCES:
+        raise ValueError(f"Unknown export source: {source}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    pa = _require_pyarrow()
+    spec = EXPORT_SOURCES[source]
+    names = [name for name, _ in spec["columns"]]
+    schema = pa.schema([(name, pa.string() if kind == "string" else getattr(pa, kind)()) for name, kind in spec["columns"]])
+    id_index = names.index(spec["id_column"]) if spec["id_column"] else None
+    date_index = names.index(spec["date_column"])
+
+    sql, params = _source_query(source, since_id=since_id, since_date=since_date)
+    rows_written = 0
+    max_id = since_id
+    max_date = since_date
+
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(path, schema)
+        sink = None
+    else:
+        sink = pa.OSFile(path, "wb")
+        writer = pa.ipc.new_file(sink, schema)
+    try:
+        for chunk in stream_query(sql, params, chunk_rows=chunk_rows):
+            arrays = []
+            for index, field in enumerate(schema):
+                values = [row[index] for row in chunk]
+                if field.type == pa.string():
+                    values = [None if value is None else str(value) for value in values]
+                arrays.append(pa.array(values, type=field.type))
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows_written += len(chunk)
+
+            if id_index is not None:
+                max_id = max(int(row[id_index]) for row in chunk)
+            chunk_max_date = max((str(row[date_index]) for row in chunk if row[date_index]), default=None)
+            if chunk_max_date and (max_date is None or chunk_max_date > max_date):
+                max_date = chunk_max_date
+    finally:
+        writer.close()
+        if sink is not None:
+            sink.close()
+
+    return {"rows": rows_written, "path": path, "max_id": max_id, "max_date": max_date}
+
+
+def _watermark_path(out_dir):
+    return os.path.join(out_dir, "export_watermarks.json")
+
+
+def load_watermarks(out_dir):
+    try:
+        with open(_watermark_path(out_dir), "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def export_incremental(sources, out_dir, fmt="parquet", chunk_rows=EXPORT_CHUNK_ROWS):
+    """Export everything added since the last run into uniquely named files under `out_dir`.
+
+    Append-only tables use their id as the watermark; trades and candles use `updated_at`. Watermarks
+    are saved to `export_watermarks.json` only after each file is fully written.
+    Runs are serialized, so concurrent jobs never export from the same watermark.
+    """
+    with _export_lock:
+        os.makedirs(out_dir, exist_ok=True)
+        watermarks = load_watermarks(out_dir)
+        # Microseconds plus a random suffix: files from runs in the same second never collide.
+        stamp = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+        extension = "parquet" if fmt == "parquet" else "arrow"
+        results = []
+
+        for source in sources:
+            spec = EXPORT_SOURCES[source]
+            mark = watermarks.get(source, {})
+            path = os.path.join(out_dir, f"{source}_{stamp}.{extension}")
+            result = export_source(
+                source,
+                path,
+                fmt=fmt,
+                since_id=mark.get("max_id") if spec["id_column"] else None,
+                since_date=None if spec["id_column"] else mark.get("max_date"),
+                chunk_rows=chunk_rows,
+            )
+            if result["rows"] == 0:
+                os.remove(path)
+                result["path"] = None
+            else:
+                watermarks[source] = {"max_id": result["max_id"], "max_date": result["max_date"]}
+                tmp_path = f"{_watermark_path(out_dir)}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as handle:
+                    json.dump(watermarks, handle, indent=2)
+                os.replace(tmp_path, _watermark_path(out_dir))
+            results.append(dict(result, source=source))
+        return results
+
+
+def start_export_job(sources, out_dir, fmt="parquet", incremental=True):
+    """Run an export on a background thread so the UI stays responsive. Returns the job id.
+
+    Jobs wait for any export already running, so overlapping clicks run one after another.
+    """
+    job_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    with _jobs_lock:
+        _jobs[job_id] = {"status": "running", "results": [], "error": None, "sources": list(sources)}
+
+    def run():
+        try:
+            with _export_lock:
+                if incremental:
+                    results = export_incremental(sources, out_dir, fmt=fmt)
+                else:
+                    os.makedirs(out_dir, exist_ok=True)
+                    extension = "parquet" if fmt == "parquet" else "arrow"
+                    results = [
+                        dict(export_source(source, os.path.join(out_dir, f"{source}_{job_id}.{extension}"), fmt=fmt), source=source)
+                        for source in sources
+                    ]
+            with _jobs_lock:
+                _jobs[job_id].update(status="done", results=results)
+        except Exception as exc:
+            with _jobs_lock:
+                _jobs[job_id].update(status="failed", error=str(exc))
+
+    threading.Thread(target=run, name=f"export-{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_export_jobs():
+    with _jobs_lock:
+        return {job_id: dict(job) for job_id, job in _jobs.items()}
@@ -0,0 +1,310 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import metrics
+from database import add_trades, check_connection
+
+JOURNAL_QUEUE_PATH = os.getenv("JOURNAL_QUEUE_PATH", "journal_queue.log")
+DRAIN_BATCH_SIZE = 500
+DRAIN_INTERVAL = 2.0
+RETRY_BACKOFF_MAX = 60.0
+# A row the database keeps rejecting on its own (with the database reachable) is moved to the
+# dead-letter file after this many drain attempts, so it cannot block the rows behind it.
+MAX_ROW_ATTEMPTS = 3
+REQUIRED_FIELDS = ("symbol", "security_id", "entry_price", "stop_price", "position_size", "confidence", "buy_id", "stop_id")
+NUMERIC_FIELDS = ("entry_price", "stop_price", "position_size", "confidence")
+
+_append_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+_last_error = None
+_row_attempts = {}
+
+
+def _checkpoint_path():
+    return f"{JOURNAL_QUEUE_PATH}.offset"
+
+
+def _dead_letter_path():
+    return f"{JOURNAL_QUEUE_PATH}.dead"
+
+
+def _read_checkpoint():
+    try:
+        with open(_checkpoint_path(), "r", encoding="utf-8") as handle:
+            return int(handle.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_checkpoint(offset):
+    tmp_path = f"{_checkpoint_path()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(str(int(offset)))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, _checkpoint_path())
+
+
+def _repair_tail():
+    """Terminate a torn final record so later appends start on a fresh line."""
+    try:
+        with open(JOURNAL_QUEUE_PATH, "rb+") as handle:
+            handle.seek(0, os.SEEK_END)
+            if handle.tell() == 0:
+                return
+            handle.seek(-1, os.SEEK_END)
+            if handle.read(1) != b"\n":
+                handle.write(b"\n")
+                handle.flush()
+                os.fsync(handle.fileno())
+    except FileNotFoundError:
+        return
+
+
+def validate_row(row):
+    """Raise ValueError unless `row` has every field `database.add_trades` needs."""
+    if not isinstance(row, dict):
+        raise ValueError(f"journal row is not an object: {row!r}")
+    missing = [field for field in REQUIRED_FIELDS if field not in row]
+    if missing:
+        raise ValueError(f"journal row is missing {', '.join(missing)}")
+    for field in NUMERIC_FIELDS:
+        try:
+            float(row[field])
+        except (TypeError, ValueError):
+            raise ValueError(f"journal row has a non-numeric {field}: {row[field]!r}") from None
+
+
+def enqueue_trades(rows):
+    """Durably append journal rows to the local log and return their entry refs.
+
+    Returns once the rows are fsynced locally; the database insert happens in the
+    background worker. Each row takes the `database.add_trades` shape; a malformed
+    row raises ValueError before anything is written.
+    """
+    rows = list(rows)
+    for row in rows:
+        validate_row(row)
+    records = []
+    refs = []
+    today = datetime.now().strftime("%Y-%m-%d")
+    for row in rows:
+        record = dict(row)
+        record.setdefault("entry_ref", uuid.uuid4().hex)
+        record.setdefault("entry_date", today)
+        records.append(json.dumps(record, default=str))
+        refs.append(record["entry_ref"])
+
+    if not records:
+        return refs
+
+    with _append_lock:
+        with open(JOURNAL_QUEUE_PATH, "a", encoding="utf-8") as handle:
+            handle.write("\n".join(records) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+    _wakeup.set()
+    return refs
+
+
+def _read_batch(offset):
+    """Return (rows, next_offset) for up to DRAIN_BATCH_SIZE complete records after `offset`."""
+    rows = []
+    try:
+        with open(JOURNAL_QUEUE_PATH, "rb") as handle:
+            handle.seek(offset)
+            while len(rows) < DRAIN_BATCH_SIZE:
+                line = handle.readline()
+                if not line or not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                text = line.strip()
+                if not text:
+                    continue
+                try:
+                    rows.append(json.loads(text))
+                except ValueError:
+                    # A torn record from a crash mid-append; it was never acknowledged.
+                    continue
+    except FileNotFoundError:
+        return [], 0
+    return rows, offset
+
+
+def _clamp_checkpoint():
+    """Reset a checkpoint that points past the end of the log (left by an interrupted compaction).
+
+    Everything in the file is then replayed from the start; rows already inserted are skipped
+    by the entry_ref unique index, and none are lost.
+    """
+    try:
+        size = os.path.getsize(JOURNAL_QUEUE_PATH)
+    except FileNotFoundError:
+        size = 0
+    if _read_checkpoint() > size:
+        _write_checkpoint(0)
+
+
+def _compact_if_drained(offset):
+    with _append_lock:
+        try:
+            size = os.path.getsize(JOURNAL_QUEUE_PATH)
+        except FileNotFoundError:
+            size = 0
+        if offset < size:
+            return offset
+        # Checkpoint first: a crash before the truncate replays delivered rows (a no-op via
+        # entry_ref), whereas a stale offset over an emptied file would skip new appends.
+        _write_checkpoint(0)
+        with open(JOURNAL_QUEUE_PATH, "w", encoding="utf-8"):
+            pass
+        return 0
+
+
+def _dead_letter(rows, reason):
+    """Append rows the database will not take to the dead-letter file, with the error."""
+    failed_at = datetime.now().isoformat(timespec="seconds")
+    with open(_dead_letter_path(), "a", encoding="utf-8") as handle:
+        for row, error in rows:
+            handle.write(json.dumps({"failed_at": failed_at, "reason": reason, "error": error, "row": row}, default=str) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+    metrics.inc("journal_dead_letters", value=len(rows), reason=reason)
+
+
+def _insert_rows_individually(rows, batch_error):
+    """Retry a failed batch row by row so one bad record cannot block the queue.
+
+    Invalid rows are dead-lettered at once. Rows the database rejects are dead-lettered after
+    MAX_ROW_ATTEMPTS, counted only while the database itself is reachable. Raises when rows
+    remain to be retried, so the checkpoint stays before the batch (replays are no-ops).
+    """
+    invalid = []
+    rejected = []
+    for row in rows:
+        try:
+            validate_row(row)
+        except ValueError as exc:
+            invalid.append((row, str(exc)))
+            continue
+        try:
+            add_trades([row])
+        except Exception as exc:
+            rejected.append((row, str(exc)))
+            continue
+        _row_attempts.pop(row.get("entry_ref"), None)
+    if invalid:
+        _dead_letter(invalid, "invalid")
+    if not rejected:
+        return len(rows) - len(invalid)
+
+    # Everything failing can mean the database is down rather than the rows being bad.
+    check_connection()
+    retry = []
+    exhausted = []
+    for row, error in rejected:
+        ref = row.get("entry_ref")
+        _row_attempts[ref] = _row_attempts.get(ref, 0) + 1
+        (exhausted if _row_attempts[ref] >= MAX_ROW_ATTEMPTS else retry).append((row, error))
+    if exhausted:
+        _dead_letter(exhausted, "rejected")
+        for row, _ in exhausted:
+            _row_attempts.pop(row.get("entry_ref"), None)
+    if retry:
+        raise RuntimeError(f"{len(retry)} journal row(s) rejected, will retry: {retry[0][1]}") from batch_error
+    return len(rows) - len(invalid) - len(exhausted)
+
+
+def drain_once():
+    """Insert every queued record into the database. Returns the number of rows handed over."""
+    offset = _read_checkpoint()
+    delivered = 0
+    while True:
+        rows, next_offset = _read_batch(offset)
+        if next_offset == offset:
+            break
+        if rows:
+            try:
+                add_trades(rows)
+                delivered += len(rows)
+            except Exception as exc:
+                delivered += _insert_rows_individually(rows, exc)
+        # Checkpoint only after the insert committed: a crash in between replays the batch,
+        # and the entry_ref unique index turns the replay into a no-op.
+        _write_checkpoint(next_offset)
+        offset = next_offset
+    _compact_if_drained(offset)
+    return delivered
+
+
+def _run_worker():
+    global _last_error
+    backoff = DRAIN_INTERVAL
+    while True:
+        _wakeup.wait(backoff)
+        _wakeup.clear()
+        try:
+            drain_once()
+            _last_error = None
+            backoff = DRAIN_INTERVAL
+        except Exception as exc:
+            _last_error = str(exc)
+            backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+
+def start_journal_worker():
+    """Start the background drain thread once per process; replays anything left by a previous run."""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        with _append_lock:
+            _repair_tail()
+            _clamp_checkpoint()
+        _worker = threading.Thread(target=_run_worker, name="journal-write-behind", daemon=True)
+        _worker.start()
+        _wakeup.set()
+        return _worker
+
+
+def flush(timeout=10.0):
+    """Block until the queue is empty or `timeout` elapses. Returns True when fully drained."""
+    deadline = time.monotonic() + float(timeout)
+    while time.monotonic() < deadline:
+        if pending_count() == 0:
+            return True
+        _wakeup.set()
+        time.sleep(0.1)
+    return pending_count() == 0
+
+
+def pending_count():
+    offset = _read_checkpoint()
+    count = 0
+    try:
+        with open(JOURNAL_QUEUE_PATH, "rb") as handle:
+            handle.seek(offset)
+            for line in handle:
+                if line.strip():
+                    count += 1
+    except FileNotFoundError:
+        return 0
+    return count
+
+
+def last_error():
+    return _last_error
+
+
+def dead_letter_count():
+    try:
+        with open(_dead_letter_path(), "rb") as handle:
+            return sum(1 for line in handle if line.strip())
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,48 @@
+import math
+from datetime import date, datetime, timedelta
+
+# Fraction of the seed value an EMA may still carry; (1 - alpha) ** n <= tolerance.
+EMA_TOLERANCE = 0.001
+TRADING_DAYS_PER_YEAR = 248
+# Extra calendar days for exchange holiday clusters and a late-arriving latest bar.
+CALENDAR_BUFFER_DAYS = 14
+
+
+def ema_warmup_bars(span, tolerance=EMA_TOLERANCE):
+    """Bars after which an `adjust=False` EMA's seed weight has decayed below `tolerance`."""
+    alpha = 2.0 / (float(span) + 1.0)
+    if alpha >= 1:
+        return 1
+    return int(math.ceil(math.log(tolerance) / math.log(1.0 - alpha)))
+
+
+def indicator_bars(kind, window, tolerance=EMA_TOLERANCE):
+    """Bars of history one indicator needs for a settled value on the latest bar."""
+    window = int(window)
+    if kind == "ema":
+        return ema_warmup_bars(window, tolerance)
+    if kind in ("atr", "high_prev"):
+        # Both read one bar behind the window (previous close / shifted high).
+        return window + 1
+    return window
+
+
+def required_bars(indicators, min_bars=0, tolerance=EMA_TOLERANCE):
+    """Bars needed for a set of {name: (kind, window)} indicators, at least `min_bars`."""
+    needed = [indicator_bars(kind, window, tolerance) for kind, window in indicators.values()]
+    return max(needed + [int(min_bars)])
+
+
+def bars_to_calendar_days(bars):
+    return int(math.ceil(bars * 365.0 / TRADING_DAYS_PER_YEAR)) + CALENDAR_BUFFER_DAYS
+
+
+def plan_from_date(bars, to_date=None):
+    """Earliest date ("YYYY-MM-DD") to request so that `bars` daily bars end at `to_date`."""
+    if to_date is None:
+        end = date.today()
+    elif isinstance(to_date, str):
+        end = datetime.strptime(to_date, "%Y-%m-%d").date()
+    else:
+        end = to_date
+    return (end - timedelta(days=bars_to_calendar_days(bars))).isoformat()
@@ -0,0 +1,206 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = os.getenv("METRICS_PORT", "").strip()
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "").strip()
+METRICS_TEXTFILE_INTERVAL = float(os.getenv("METRICS_TEXTFILE_INTERVAL", "15"))
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCAN_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0)
+
+# name -> (type, help, buckets). Every metric is declared here so the exposition has
+# HELP/TYPE lines even before the first sample.
+METRICS = {
+    "broker_request_seconds": ("histogram", "Broker SDK call latency, excluding rate-limit wait.", LATENCY_BUCKETS),
+    "broker_queue_wait_seconds": ("histogram", "Time spent waiting for a rate-limit token.", LATENCY_BUCKETS),
+    "broker_request_errors": ("counter", "Broker SDK calls that raised or returned a failure status.", None),
+    "scan_duration_seconds": ("histogram", "Wall time of a full scan.", SCAN_BUCKETS),
+    "scan_symbols": ("counter", "Symbols processed by scans.", None),
+    "scan_symbols_per_second": ("gauge", "Throughput of the most recent scan.", None),
+    "scan_symbols_resumed": ("counter", "Symbols restored from a scan checkpoint instead of fetched.", None),
+    "db_query_seconds": ("histogram", "Database helper latency, including connect and commit.", LATENCY_BUCKETS),
+    "cache_requests": ("counter", "Cache lookups by cache and result (hit/miss).", None),
+    "order_tracker_events": ("counter", "Order tracker polls and stop re-placements by event.", None),
+    "journal_dead_letters": ("counter", "Journal queue rows moved to the dead-letter file, by reason.", None),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_exporter_started = False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1.0, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+
+
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    key = _key(name, labels)
+    index = bisect.bisect_left(buckets, value)
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+        state[0][index] += 1
+        state[1] += value
+
+
+class _Timer:
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def timer(name, **labels):
+    """Context manager that observes its elapsed time into a histogram."""
+    return _Timer(name, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of `timer`; the function name is added as the `operation` label."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, operation=fn.__name__, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_result(cache, hit):
+    inc("cache_requests", cache=cache, result="hit" if hit else "miss")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_float(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def render():
+    """Current values in OpenMetrics text format."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: ([*state[0]], state[1]) for key, state in _histograms.items()}
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"# HELP {name} {help_text}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}_total{_labels_text(labels)} {_format_float(value)}")
+        elif kind == "gauge":
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels_text(labels)} {_format_float(value)}")
+        else:
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + [float("inf")], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels_text(labels, ('le', _format_float(bound)))} {cumulative}")
+                lines.append(f"{name}_count{_labels_text(labels)} {cumulative}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {_format_float(total)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=None):
+    """Atomically write the exposition for a node_exporter textfile collector."""
+    path = path or METRICS_TEXTFILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _run_textfile_writer(path, interval):
+    while True:
+        try:
+            write_textfile(path)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+
+def start_exporter():
+    """Start the exporters configured by METRICS_PORT / METRICS_TEXTFILE, once per process."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    if METRICS_TEXTFILE:
+        threading.Thread(
+            target=_run_textfile_writer,
+            args=(METRICS_TEXTFILE, METRICS_TEXTFILE_INTERVAL),
+            name="metrics-textfile",
+            daemon=True,
+        ).start()
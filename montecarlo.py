@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+DEFAULT_PATHS = 20000
+DEFAULT_TRADES = 250
+# Paths simulated per NumPy block; bounds peak memory at a few arrays of BLOCK_PATHS x n_trades.
+BLOCK_PATHS = 5000
+DRAWDOWN_PERCENTILES = (50, 90, 95, 99)
+# Paths x trades per simulation for interactive use; about 0.7 s per simulation either sizing mode.
+MAX_PATH_TRADES = 10_000_000
+
+
+def trade_samples(outcomes):
+    """Per-trade R-multiple, entry price and stop distance from (entry, stop, exit) rows.
+
+    `outcomes` is what `database.get_closed_trade_outcomes` returns, or any rows/array in
+    that shape (e.g. from a backtest). Rows without a stop below entry are dropped.
+    """
+    values = np.asarray(outcomes, dtype="float64").reshape(-1, 3)
+    entry, stop, exit_price = values[:, 0], values[:, 1], values[:, 2]
+    valid = (entry > stop) & (stop > 0) & np.isfinite(exit_price)
+    entry, stop, exit_price = entry[valid], stop[valid], exit_price[valid]
+    return pd.DataFrame(
+        {
+            "r_multiple": (exit_price - entry) / (entry - stop),
+            "price": entry,
+            "stop_pct": (entry - stop) / entry,
+        }
+    )
+
+
+def _position_pnl(r_multiple, price, stop_pct, risk_budget, base_capital, allow_fallback):
+    """P&L and fallback flags for trades sized like app.py; arrays broadcast elementwise.
+
+    Quantity is floor(risk_budget / per-share risk). When that is 0 the 1-share fallback
+    buys one share if allowed and the price fits in base capital; otherwise the trade is skipped.
+    """
+    per_share_risk = price * stop_pct
+    quantity = np.floor(risk_budget / per_share_risk)
+    fallback = (quantity <= 0) & allow_fallback & (price <= base_capital)
+    quantity = np.where(fallback, 1.0, np.maximum(quantity, 0.0))
+    return quantity * per_share_risk * r_multiple, fallback
+
+
+def simulate(
+    samples,
+    n_paths=DEFAULT_PATHS,
+    n_trades=DEFAULT_TRADES,
+    base_capital=10000.0,
+    risk_per_trade=0.01,
+    max_drawdown=0.08,
+    allow_fallback=True,
+    compound=False,
+    seed=None,
+):
+    """Bootstrap `n_paths` equity paths of `n_trades` trades resampled from `samples`.
+
+    `samples` is a `trade_samples` frame, or a 1-D array of R-multiples (each trade then
+    risks exactly the budget and the fallback never applies). Sizing follows app.py: a
+    fixed `base_capital * risk_per_trade` budget, or current equity times `risk_per_trade`
+    with `compound`. The same `seed` draws the same trade sequences, so runs that differ
+    only in sizing settings are compared path by path.
+
+    Returns arrays with one value per path: `max_drawdown` (trading never stops),
+    `breaker_trade` (1-based trade that first reached `max_drawdown`, 0 if never),
+    `final_equity` (frozen at the breaker, as the app blocks new trades there) and
+    `fallback_trades`.
+    """
+    if isinstance(samples, pd.DataFrame):
+        r_all = samples["r_multiple"].to_numpy(dtype="float64")
+        price_all = samples["price"].to_numpy(dtype="float64")
+        stop_all = samples["stop_pct"].to_numpy(dtype="float64")
+    else:
+        r_all = np.asarray(samples, dtype="float64").ravel()
+        price_all = stop_all = None
+    if len(r_all) == 0:
+        raise ValueError("No trade samples to bootstrap from.")
+
+    rng = np.random.default_rng(seed)
+    results = {"max_drawdown": [], "breaker_trade": [], "final_equity": [], "fallback_trades": []}
+    for start in range(0, n_paths, BLOCK_PATHS):
+        block = min(BLOCK_PATHS, n_paths - start)
+        picks = rng.integers(0, len(r_all), size=(block, n_trades))
+        r_multiple = r_all[picks]
+
+        if price_all is None:
+            budget = base_capital * risk_per_trade
+            if compound:
+                equity = base_capital * np.cumprod(1 + risk_per_trade * r_multiple, axis=1)
+            else:
+                equity = base_capital + np.cumsum(budget * r_multiple, axis=1)
+            fallback = np.zeros(block, dtype="int64")
+        elif compound:
+            # Each trade's size depends on the equity before it: step through trades, vectorized over paths.
+            price, stop_pct = price_all[picks], stop_all[picks]
+            equity = np.empty((block, n_trades))
+            current = np.full(block, float(base_capital))
+            fallback = np.zeros(block, dtype="int64")
+            for trade in range(n_trades):
+                pnl, used = _position_pnl(
+                    r_multiple[:, trade],
+                    price[:, trade],
+                    stop_pct[:, trade],
+                    np.maximum(current, 0) * risk_per_trade,
+                    base_capital,
+                    allow_fallback,
+                )
+                current = current + pnl
+                equity[:, trade] = current
+                fallback += used
+        else:
+            pnl, used = _position_pnl(
+                r_multiple,
+                price_all[picks],
+                stop_all[picks],
+                base_capital * risk_per_trade,
+                base_capital,
+                allow_fallback,
+            )
+            equity = base_capital + np.cumsum(pnl, axis=1)
+            fallback = used.sum(axis=1)
+
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), base_capital)
+        drawdown = 1 - equity / peak
+        breached = drawdown >= max_drawdown
+        hit = breached.any(axis=1)
+        first = breached.argmax(axis=1)
+        results["max_drawdown"].append(drawdown.max(axis=1))
+        results["breaker_trade"].append(np.where(hit, first + 1, 0))
+        results["final_equity"].append(np.where(hit, equity[np.arange(block), first], equity[:, -1]))
+        results["fallback_trades"].append(fallback)
+
+    return {key: np.concatenate(parts) for key, parts in results.items()}
+
+
+def summarize(result, base_capital=10000.0):
+    """Headline statistics of a `simulate` result as a flat dict."""
+    breaker = result["breaker_trade"]
+    hit = breaker > 0
+    summary = {
+        "paths": int(len(breaker)),
+        "p_breaker": float(hit.mean()),
+        "median_trades_to_breaker": float(np.median(breaker[hit])) if hit.any() else None,
+    }
+    for percentile in DRAWDOWN_PERCENTILES:
+        summary[f"drawdown_p{percentile}"] = float(np.percentile(result["max_drawdown"], percentile))
+    summary["median_final_equity"] = float(np.median(result["final_equity"]))
+    summary["p_loss"] = float((result["final_equity"] < base_capital).mean())
+    summary["avg_fallback_trades"] = float(result["fallback_trades"].mean())
+    return summary
+
+
+def capped_paths(n_paths, n_trades, budget=MAX_PATH_TRADES):
+    """`n_paths` reduced so `n_paths * n_trades` stays within `budget` (at least one block's worth of 100)."""
+    return max(min(int(n_paths), int(budget) // max(int(n_trades), 1)), 100)
+
+
+def simulate_fallback_pair(samples, seed=0, **settings):
+    """`simulate` results with the 1-share fallback on (True) and off (False), same trade sequences."""
+    return {
+        allow_fallback: simulate(samples, allow_fallback=allow_fallback, seed=seed, **settings)
+        for allow_fallback in (True, False)
+    }
+
+
+def fallback_table(results, base_capital=10000.0):
+    """Summaries of a `simulate_fallback_pair` result, one row per fallback setting."""
+    rows = []
+    for allow_fallback in (True, False):
+        row = summarize(results[allow_fallback], base_capital)
+        row["fallback"] = "on" if allow_fallback else "off"
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("fallback")
+
+
+def compare_fallback(samples, seed=0, **settings):
+    """Summaries with and without the 1-share fallback over identical trade sequences."""
+    return fallback_table(simulate_fallback_pair(samples, seed=seed, **settings), settings.get("base_capital", 10000.0))
+
+
+def drawdown_histogram(result, bins=40):
+    """Max-drawdown distribution as a DataFrame (bin start in %, share of paths) for charting."""
+    counts, edges = np.histogram(result["max_drawdown"] * 100, bins=bins)
+    return pd.DataFrame({"max_drawdown_pct": np.round(edges[:-1], 2), "share": counts / max(counts.sum(), 1)}).set_index(
+        "max_drawdown_pct"
+    )
@@ -0,0 +1,262 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from datetime import time as clock_time
+from zoneinfo import ZoneInfo
+
+import metrics
+from database import close_trades, get_active_trades, save_order_states, set_stop_order_ids
+from execution import (
+    FAILED_STATUSES,
+    FILLED_STATUSES,
+    PENDING_STOP_ID,
+    basket_buys_in_flight,
+    fetch_order_book,
+    place_stop_order,
+)
+from regime import MARKET_CLOSE
+from scanner import EXCHANGE_TZ
+
+ORDER_TRACKER_ENABLED = os.getenv("ORDER_TRACKER", "1").strip().lower() in ("1", "true", "yes")
+# Poll fast while anything is unsettled, back off to SLOW once every live trade is protected,
+# and only check occasionally when there are no live trades at all.
+FAST_INTERVAL = 5.0
+SLOW_INTERVAL = 60.0
+IDLE_INTERVAL = 300.0
+# After orders are placed, keep polling fast for this long: the journal write-behind queue may
+# not have inserted the new trades yet.
+NOTIFY_FAST_SECONDS = 60.0
+MAX_STOP_ATTEMPTS = 3
+# Stops are only re-placed while the exchange is open, so the daily attempts are not spent pre-open.
+MARKET_OPEN = clock_time(9, 15)
+# Stop ids the order flow records when no stop order exists.
+MISSING_STOP_IDS = {"", "NONE", "LIVE_STOP_FAIL", PENDING_STOP_ID}
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_known = {}
+_attempts = {}
+# (day, stop id) re-placed by this process; one not in the book yet is in transit, not missing.
+# Keyed by day because stops are day orders: yesterday's replacement is missing again today.
+_placed = set()
+_day = None
+_fast_until = 0.0
+_status = {"state": "stopped", "last_poll": None, "interval": None, "error": None, "last_summary": None}
+
+
+def _start_day(today):
+    """Drop per-day state from earlier sessions so it does not grow without bound."""
+    global _day
+    if _day == today:
+        return
+    _day = today
+    for key in [key for key in _attempts if key[0] != today]:
+        del _attempts[key]
+    for key in [key for key in _placed if key[0] != today]:
+        _placed.discard(key)
+    # Order states are re-written once per day at most; the upsert keeps first_seen.
+    _known.clear()
+
+
+def market_open(now):
+    """True on weekdays between MARKET_OPEN and MARKET_CLOSE exchange time."""
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def _is_live(trade):
+    return not str(trade.buy_order_id or "").upper().startswith("PAPER")
+
+
+def _fill_price(entry, default):
+    raw = entry.get("raw", {})
+    for key in ("averageTradedPrice", "average_traded_price", "tradedPrice", "price"):
+        try:
+            price = float(raw.get(key))
+        except (TypeError, ValueError):
+            continue
+        if price > 0:
+            return price
+    return default
+
+
+def _place_replacement(dhan, trade, quantity, today):
+    """Re-place one stop through the SLM -> SL fallback; returns (order state row, new stop id or None)."""
+    key = (today, trade.id)
+    _attempts[key] = _attempts.get(key, 0) + 1
+    try:
+        stop_id, stop_type, _ = place_stop_order(dhan, trade.security_id, quantity, trade.stop_price)
+    except Exception as exc:
+        metrics.inc("order_tracker_events", event="stop_replace_failed")
+        failed_id = f"FAILED-{trade.id}-{_attempts[key]}-{today}"
+        return (failed_id, trade.id, "STOP", trade.security_id, quantity, "PLACE_FAILED", 0, str(exc)), None
+    metrics.inc("order_tracker_events", event="stop_replaced")
+    _placed.add((today, stop_id))
+    return (stop_id, trade.id, "STOP", trade.security_id, quantity, "PLACED", 0, f"replaced_{stop_type}"), stop_id
+
+
+def track_orders_once(dhan, now=None):
+    """One tracking cycle over every live ACTIVE trade, using a single order-book call.
+
+    Records BUY/STOP order states, closes trades whose BUY was rejected/cancelled or whose
+    stop executed, and re-places stops that are missing, rejected, cancelled or expired
+    (stops are day orders, so one from an earlier session is missing too). Re-placement only
+    happens during market hours; missing stops found outside them are counted in
+    `stops_waiting`. Returns a summary; `unsettled` is True while some BUY or stop is still in flight
+    and `market_open` tells whether that can change before the next session.
+    """
+    now = now or datetime.now(ZoneInfo(EXCHANGE_TZ))
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=ZoneInfo(EXCHANGE_TZ))
+    now = now.astimezone(ZoneInfo(EXCHANGE_TZ))
+    today = now.strftime("%Y-%m-%d")
+    _start_day(today)
+    summary = {
+        "trades": 0,
+        "orders": 0,
+        "stops_replaced": 0,
+        "stop_failures": 0,
+        "stops_waiting": 0,
+        "closed": 0,
+        "unsettled": False,
+        "market_open": market_open(now),
+    }
+    trades = [trade for trade in get_active_trades() if _is_live(trade)]
+    summary["trades"] = len(trades)
+    if not trades:
+        return summary
+
+    book = fetch_order_book(dhan)
+    metrics.inc("order_tracker_events", event="poll")
+    in_flight = basket_buys_in_flight()
+    states = []
+    closures = []
+    stop_updates = []
+
+    for trade in trades:
+        buy_id = str(trade.buy_order_id or "").strip()
+        if buy_id == "LIVE_BUY_FAIL":
+            closures.append((trade.id, "BUY_FAILED", None, today))
+            continue
+
+        buy = book.get(buy_id)
+        if buy is not None:
+            states.append((buy_id, trade.id, "BUY", trade.security_id, None, buy["status"], buy["filled_qty"], None))
+            if buy["status"] in FAILED_STATUSES:
+                closures.append((trade.id, "BUY_" + buy["status"], None, today))
+                continue
+        # A BUY missing from today's book was placed in an earlier session and is treated as held;
+        # broker reconciliation closes it if it is not.
+        opened_earlier = buy is None and str(trade.entry_date or today) < today
+        if not (opened_earlier or (buy is not None and buy["status"] in FILLED_STATUSES)):
+            summary["unsettled"] = True
+            continue
+
+        stop_id = str(trade.stop_order_id or "").strip()
+        if stop_id == PENDING_STOP_ID and buy_id in in_flight:
+            # A running basket job is attaching this stop; left pending by a job that died, it is missing.
+            summary["unsettled"] = True
+            continue
+        stop = book.get(stop_id)
+        if stop is not None:
+            states.append((stop_id, trade.id, "STOP", trade.security_id, None, stop["status"], stop["filled_qty"], None))
+            if stop["status"] in FILLED_STATUSES:
+                closures.append((trade.id, "CLOSED_STOP", _fill_price(stop, trade.stop_price), today))
+                continue
+
+        missing = (
+            stop_id.upper() in MISSING_STOP_IDS
+            or (stop is not None and stop["status"] in FAILED_STATUSES)
+            or (stop is None and opened_earlier and (today, stop_id) not in _placed)
+        )
+        if not missing:
+            if stop is None:
+                summary["unsettled"] = True
+            continue
+        if not market_open(now):
+            summary["stops_waiting"] += 1
+            continue
+
+        summary["unsettled"] = True
+        if _attempts.get((today, trade.id), 0) >= MAX_STOP_ATTEMPTS:
+            summary["stop_failures"] += 1
+            continue
+        # Filled shares first, then the journaled order quantity. Legacy rows derive it from the notional,
+        # rounded down (the epsilon absorbs float error): a stop larger than the holding is rejected.
+        quantity = (buy["filled_qty"] if buy is not None else 0) or math.floor(trade.quantity + 1e-6)
+        if quantity <= 0:
+            continue
+        state, new_stop_id = _place_replacement(dhan, trade, quantity, today)
+        states.append(state)
+        if new_stop_id:
+            stop_updates.append((trade.id, new_stop_id))
+            summary["stops_replaced"] += 1
+        else:
+            summary["stop_failures"] += 1
+
+    # Only changed states are written, so a quiet book costs no database writes.
+    changed = [state for state in states if _known.get(state[0]) != state[5:]]
+    save_order_states(changed)
+    for state in changed:
+        _known[state[0]] = state[5:]
+    set_stop_order_ids(stop_updates)
+    summary["closed"] = close_trades(closures)
+    summary["orders"] = len(states)
+    return summary
+
+
+def _next_interval(summary, interval):
+    if time.monotonic() < _fast_until:
+        return FAST_INTERVAL
+    if not summary["trades"]:
+        return IDLE_INTERVAL
+    # After-market orders stay pending until the open; polling them fast all night changes nothing.
+    if not summary["market_open"]:
+        return SLOW_INTERVAL
+    if summary["unsettled"]:
+        return FAST_INTERVAL
+    return min(max(interval * 2, FAST_INTERVAL), SLOW_INTERVAL)
+
+
+def _run_worker(dhan):
+    interval = FAST_INTERVAL
+    while True:
+        try:
+            summary = track_orders_once(dhan)
+            interval = _next_interval(summary, interval)
+            with _lock:
+                _status.update(state="running", error=None, last_summary=summary)
+        except Exception as exc:
+            interval = min(max(interval * 2, FAST_INTERVAL), IDLE_INTERVAL)
+            with _lock:
+                _status.update(state="retrying", error=str(exc))
+        with _lock:
+            _status.update(last_poll=datetime.now().isoformat(timespec="seconds"), interval=interval)
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def notify_orders_placed():
+    """Poll now and keep polling fast for a while (call after placing live orders)."""
+    global _fast_until
+    _fast_until = time.monotonic() + NOTIFY_FAST_SECONDS
+    _wakeup.set()
+
+
+def tracker_status():
+    with _lock:
+        return dict(_status)
+
+
+def start_order_tracker(dhan):
+    """Start the order tracker thread once per process."""
+    global _worker
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        _worker = threading.Thread(target=_run_worker, args=(dhan,), name="order-tracker", daemon=True)
+        _worker.start()
+        _status["state"] = "running"
+        return _worker
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from database import close_trades, get_open_paper_trades
+from scanner import candle_dates, fetch_candle_frames
+
+PAPER_FILL_WORKER_ENABLED = os.getenv("PAPER_FILLS", "1").strip().lower() in ("1", "true", "yes")
+STOP_FILL_STATUS = "CLOSED_STOP"
+# How often the worker checks whether the daily run (or a retry) is due.
+PAPER_FILL_POLL_SECONDS = 60.0
+# A daily run that raised or could not fetch every security is retried after this delay, doubling up to the max.
+RETRY_BACKOFF = 60.0
+RETRY_BACKOFF_MAX = 1800.0
+
+_last_run_date = None
+_retry_at = 0.0
+_backoff = RETRY_BACKOFF
+_last_errors = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_run_requested = False
+_status = {"state": "stopped", "last_run": None, "closed": 0, "fills": None, "error": None}
+
+
+def candles_long(frames):
+    """Stack {security_id: candle DataFrame} into one long frame of security_id, date, open, low."""
+    parts = []
+    for security_id, df in frames.items():
+        if df is None or df.empty:
+            continue
+        parts.append(
+            pd.DataFrame(
+                {
+                    "security_id": security_id,
+                    "date": candle_dates(df).to_numpy(),
+                    "open": df["open"].to_numpy(dtype="float64"),
+                    "low": df["low"].to_numpy(dtype="float64"),
+                }
+            )
+        )
+    if not parts:
+        return pd.DataFrame(columns=["security_id", "date", "open", "low"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def simulate_stop_fills(trades, candles):
+    """Find the first candle after entry that trades through each stop.
+
+    `trades` has id, security_id, stop_price and entry_date; `candles` comes from
+    `candles_long`. A bar whose low reaches the stop fills at the stop, or at the open
+    when the bar gaps below it. Returns id, exit_price and exit_date per stopped trade.
+    """
+    if trades.empty or candles.empty:
+        return pd.DataFrame(columns=["id", "exit_price", "exit_date"])
+
+    merged = trades.merge(candles, on="security_id", how="inner")
+    merged = merged[(merged["date"] > merged["entry_date"]) & (merged["low"] <= merged["stop_price"])]
+    if merged.empty:
+        return pd.DataFrame(columns=["id", "exit_price", "exit_date"])
+
+    first_hits = merged.sort_values(["id", "date"], kind="stable").drop_duplicates("id", keep="first")
+    exit_price = np.where(
+        first_hits["open"] < first_hits["stop_price"],
+        first_hits["open"],
+        first_hits["stop_price"],
+    )
+    return pd.DataFrame(
+        {
+            "id": first_hits["id"].to_numpy(),
+            "exit_price": np.round(exit_price, 2),
+            "exit_date": first_hits["date"].to_numpy(),
+        }
+    )
+
+
+def run_paper_fill_simulation(dhan):
+    """Close every open paper trade whose stop has been hit since entry.
+
+    Returns (fills, errors); `errors` maps security id -> message for candles that could
+    not be fetched, whose trades were not checked.
+    """
+    global _last_errors
+    rows = get_open_paper_trades()
+    if not rows:
+        _last_errors = {}
+        return pd.DataFrame(columns=["id", "exit_price", "exit_date"]), {}
+
+    trades = pd.DataFrame(rows, columns=["id", "security_id", "stop_price", "entry_date"])
+    trades["security_id"] = trades["security_id"].astype(str)
+    trades["stop_price"] = pd.to_numeric(trades["stop_price"], errors="coerce")
+    trades = trades.dropna(subset=["stop_price"])
+    trades = trades[trades["stop_price"] > 0]
+    if trades.empty:
+        _last_errors = {}
+        return pd.DataFrame(columns=["id", "exit_price", "exit_date"]), {}
+
+    # Each security is fetched from its own oldest open trade, not from the oldest trade overall.
+    from_dates = trades.groupby("security_id")["entry_date"].min().to_dict()
+    to_date = datetime.now().strftime("%Y-%m-%d")
+    frames, errors = fetch_candle_frames(
+        dhan, list(from_dates), min(from_dates.values()), to_date, from_dates=from_dates
+    )
+    fills = simulate_stop_fills(trades, candles_long(frames))
+
+    close_trades(
+        (int(row.id), STOP_FILL_STATUS, float(row.exit_price), str(row.exit_date))
+        for row in fills.itertuples(index=False)
+    )
+    _last_errors = dict(errors)
+    return fills, errors
+
+
+def run_paper_fill_simulation_daily(dhan):
+    """Run the simulation once per process per calendar day; None when it is not due.
+
+    The day only counts as done when every security's candles were fetched. Fetch errors
+    and exceptions schedule a retry with exponential backoff instead of waiting a day or
+    re-running on every Streamlit rerun.
+    """
+    global _last_run_date, _retry_at, _backoff
+    today = datetime.now().strftime("%Y-%m-%d")
+    if _last_run_date == today or time.monotonic() < _retry_at:
+        return None
+    try:
+        fills, errors = run_paper_fill_simulation(dhan)
+    except Exception:
+        _retry_at = time.monotonic() + _backoff
+        _backoff = min(_backoff * 2, RETRY_BACKOFF_MAX)
+        raise
+    if errors:
+        _retry_at = time.monotonic() + _backoff
+        _backoff = min(_backoff * 2, RETRY_BACKOFF_MAX)
+    else:
+        _last_run_date = today
+        _retry_at = 0.0
+        _backoff = RETRY_BACKOFF
+    return fills, errors
+
+
+def last_errors():
+    """Candle fetch errors from the latest simulation run, by security id."""
+    return dict(_last_errors)
+
+
+def _run_worker(dhan):
+    global _run_requested
+    while True:
+        with _lock:
+            requested, _run_requested = _run_requested, False
+            _status["state"] = "running"
+        try:
+            result = run_paper_fill_simulation(dhan) if requested else run_paper_fill_simulation_daily(dhan)
+            with _lock:
+                _status.update(state="idle", error=None)
+                if result is not None:
+                    fills, _ = result
+                    _status.update(
+                        last_run=datetime.now().isoformat(timespec="seconds"), closed=len(fills), fills=fills
+                    )
+        except Exception as exc:
+            with _lock:
+                _status.update(state="retrying", error=str(exc))
+        _wakeup.wait(PAPER_FILL_POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_paper_fill_worker(dhan):
+    """Start the thread that runs the daily catch-up (and requested runs) once per process."""
+    global _worker
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        _worker = threading.Thread(target=_run_worker, args=(dhan,), name="paper-fills", daemon=True)
+        _worker.start()
+        return _worker
+
+
+def request_paper_fill_run():
+    """Ask the worker to run the simulation now, whether or not today's run already happened."""
+    global _run_requested
+    with _lock:
+        _run_requested = True
+    _wakeup.set()
+
+
+def paper_fill_status():
+    """Outcome of the worker's latest run: last_run, closed, fills, error and state."""
+    with _lock:
+        return dict(_status)
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time as clock
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from database import save_scan_run
+from regime import get_regime, session_key
+from scanner import EXCHANGE_TZ, scan
+from symbols import SymbolIndex, build_sector_map, load_scrip_master
+from universes import DEFAULT_UNIVERSE, resolve_universe
+
+PREWARM_ENABLED = os.getenv("PREWARM", "1").strip().lower() in ("1", "true", "yes")
+PREWARM_STAGE_PATH = os.getenv("PREWARM_STAGE_PATH", "prewarm_stage.json")
+# Give the broker a few minutes after the 15:30 close to publish the final daily bar.
+PREWARM_AFTER = time(15, 45)
+PREWARM_POLL_SECONDS = 60.0
+RETRY_BACKOFF_MAX = 30 * 60.0
+
+_lock = threading.Lock()
+_run_lock = threading.Lock()
+_worker = None
+_status = {"state": "cold", "session": None, "computed_at": None, "duration_s": None, "error": None}
+_symbol_data = None
+
+
+def _now():
+    return datetime.now(ZoneInfo(EXCHANGE_TZ))
+
+
+def target_session(now=None):
+    """Session the stage should hold, or None while today's close is still settling."""
+    now = now or _now()
+    session = session_key(now)
+    if session == now.date().isoformat() and now.time() < PREWARM_AFTER:
+        return None
+    return session
+
+
+def _read_stage():
+    try:
+        with open(PREWARM_STAGE_PATH, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_stage(stage):
+    tmp_path = f"{PREWARM_STAGE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(stage, handle, default=str)
+    os.replace(tmp_path, PREWARM_STAGE_PATH)
+
+
+def get_symbol_data():
+    """(symbol_map, sector_map, master) from the last pre-warm, or None before the first one."""
+    return _symbol_data
+
+
+def run_prewarm(dhan, session=None):
+    """Refresh symbols, regime and candles, run the scan and stage its output on disk.
+
+    The staged scan run is also saved to scan history here, so using it later does not
+    write a second run. Returns the stage dict.
+    """
+    global _symbol_data
+    session = session or session_key()
+    with _run_lock:
+        started = clock.perf_counter()
+        with _lock:
+            _status.update(state="running", error=None)
+        try:
+            master, errors = load_scrip_master()
+            if master is None:
+                raise RuntimeError(f"Could not load scrip master: {' | '.join(errors)}")
+            symbol_map = SymbolIndex.from_scrip_master(master)
+            sector_map = build_sector_map(master)
+            _symbol_data = (symbol_map, sector_map, master)
+            universe = resolve_universe(DEFAULT_UNIVERSE, symbol_map, master)
+
+            regime = get_regime(dhan)
+            candidates, diagnostics = scan(
+                dhan, symbol_map, sector_map=sector_map, regime=regime, universe=universe["symbols"]
+            )
+            run_id = save_scan_run(candidates.to_dict("records"), diagnostics.to_dict("records"))
+
+            stage = {
+                "session": session,
+                "universe": DEFAULT_UNIVERSE,
+                "computed_at": _now().isoformat(timespec="seconds"),
+                "run_id": run_id,
+                "candidates": candidates.to_dict("records"),
+                "diagnostics": diagnostics.to_dict("records"),
+            }
+            _write_stage(stage)
+            with _lock:
+                _status.update(
+                    state="warm",
+                    session=session,
+                    computed_at=stage["computed_at"],
+                    duration_s=round(clock.perf_counter() - started, 2),
+                )
+            return stage
+        except Exception as exc:
+            with _lock:
+                _status.update(state="failed", error=str(exc), duration_s=round(clock.perf_counter() - started, 2))
+            raise
+
+
+def get_staged_scan(session=None, universe=None):
+    """(candidates, diagnostics, run_id) staged for `session` (default: latest), or None if cold.
+
+    Only the default universe is pre-warmed; asking for any other `universe` returns None.
+    """
+    session = session or target_session() or session_key()
+    stage = _read_stage()
+    if not stage or stage.get("session") != session:
+        return None
+    if universe is not None and stage.get("universe", DEFAULT_UNIVERSE) != universe:
+        return None
+    return pd.DataFrame(stage["candidates"]), pd.DataFrame(stage["diagnostics"]), stage.get("run_id")
+
+
+def prewarm_status():
+    """Worker state plus whether a stage exists for the current session (`warm`)."""
+    with _lock:
+        status = dict(_status)
+    session = target_session() or session_key()
+    stage = _read_stage()
+    status["warm"] = bool(stage and stage.get("session") == session)
+    if status["warm"] and status["state"] == "cold":
+        # Staged by an earlier process.
+        status.update(state="warm", session=stage["session"], computed_at=stage["computed_at"])
+    return status
+
+
+def _run_worker(dhan):
+    backoff = PREWARM_POLL_SECONDS
+    while True:
+        session = target_session()
+        stage = _read_stage()
+        if session and (not stage or stage.get("session") != session):
+            try:
+                run_prewarm(dhan, session)
+                backoff = PREWARM_POLL_SECONDS
+            except Exception:
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+        clock.sleep(backoff)
+
+
+def start_prewarm_worker(dhan):
+    """Start the post-close pre-warm thread once per process."""
+    global _worker
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        _worker = threading.Thread(target=_run_worker, args=(dhan,), name="prewarm", daemon=True)
+        _worker.start()
+        return _worker
@@ -0,0 +1,181 @@
+import math
+
+import pandas as pd
+
+# Column order of `trades` as selected by database.py; TradeRecord.from_row relies on it.
+TRADE_FIELDS = (
+    "id",
+    "symbol",
+    "security_id",
+    "entry_price",
+    "stop_price",
+    "position_size",
+    "confidence",
+    "status",
+    "entry_date",
+    "buy_order_id",
+    "stop_order_id",
+    "entry_ref",
+    "exit_price",
+    "exit_date",
+    "order_quantity",
+)
+
+BROKER_SYMBOL_KEYS = ["tradingSymbol", "trading_symbol", "symbol", "securitySymbol", "displayName"]
+BROKER_SECURITY_ID_KEYS = ["securityId", "security_id", "dhanSecurityId", "smstSecurityId"]
+BROKER_QTY_KEYS = ["netQty", "netQuantity", "quantity", "qty", "availableQty", "holdingQty", "totalQty"]
+BROKER_PRICE_KEYS = ["avgPrice", "averagePrice", "avgCostPrice", "buyAvg", "costPrice", "netAvg", "lastTradedPrice", "ltp"]
+
+
+def _float(value, default=0.0):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if math.isnan(number) else number
+
+
+def _text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text if text and text.upper() != "NAN" else None
+
+
+def _first_text(record, keys):
+    for key in keys:
+        text = _text(record.get(key))
+        if text:
+            return text
+    return None
+
+
+def _first_float(record, keys, default=0.0):
+    for key in keys:
+        try:
+            return float(record.get(key))
+        except (TypeError, ValueError):
+            continue
+    return float(default)
+
+
+class _Record:
+    __slots__ = ()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+
+class TradeRecord(_Record):
+    """One journal row; numeric columns are parsed once in `from_row`."""
+
+    __slots__ = TRADE_FIELDS
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls.__new__(cls)
+        for name, value in zip(TRADE_FIELDS, row):
+            setattr(record, name, value)
+        record.id = int(record.id) if record.id is not None else None
+        record.security_id = str(record.security_id) if record.security_id is not None else ""
+        record.entry_price = _float(record.entry_price)
+        record.stop_price = _float(record.stop_price)
+        record.position_size = _float(record.position_size)
+        record.confidence = _float(record.confidence)
+        record.exit_price = _float(record.exit_price, None)
+        record.order_quantity = int(record.order_quantity) if record.order_quantity is not None else None
+        return record
+
+    @property
+    def quantity(self):
+        """Shares ordered; rows journaled before `order_quantity` existed derive it from the notional."""
+        if self.order_quantity:
+            return float(self.order_quantity)
+        return self.position_size / self.entry_price if self.entry_price > 0 else 0.0
+
+
+class Candidate(_Record):
+    """One scan candidate."""
+
+    __slots__ = (
+        "symbol", "security_id", "price", "stop_price", "confidence", "signal_strength", "rs_score", "sector_rs",
+        "strategy",
+    )
+
+    def __init__(self, symbol, security_id, price, stop_price, confidence, signal_strength,
+                 rs_score=None, sector_rs=None, strategy=None):
+        self.symbol = symbol
+        self.security_id = str(security_id)
+        self.price = float(price)
+        self.stop_price = float(stop_price)
+        self.confidence = confidence
+        self.signal_strength = signal_strength
+        self.rs_score = rs_score
+        self.sector_rs = sector_rs
+        self.strategy = strategy
+
+    @classmethod
+    def from_mapping(cls, row):
+        return cls(
+            symbol=row["symbol"],
+            security_id=row["security_id"],
+            price=row["price"],
+            stop_price=row["stop_price"],
+            confidence=row["confidence"],
+            signal_strength=row.get("signal_strength", "unknown"),
+            rs_score=_float(row.get("rs_score"), None),
+            sector_rs=_float(row.get("sector_rs"), None),
+            strategy=row.get("strategy"),
+        )
+
+
+class BrokerPosition(_Record):
+    """One position or holding from the broker, parsed from its many key spellings."""
+
+    __slots__ = ("symbol", "security_id", "entry_price", "stop_price", "quantity", "source")
+
+    def __init__(self, symbol, security_id, entry_price, quantity, source, stop_price=0.0):
+        self.symbol = symbol
+        self.security_id = security_id
+        self.entry_price = float(entry_price)
+        self.stop_price = float(stop_price)
+        self.quantity = float(quantity)
+        self.source = source
+
+    @classmethod
+    def from_broker(cls, item, source):
+        """Parse one positions/holdings row; None for flat rows. `security_id` may be None."""
+        if not isinstance(item, dict):
+            return None
+        quantity = _first_float(item, BROKER_QTY_KEYS)
+        if quantity <= 0:
+            return None
+        symbol = _first_text(item, BROKER_SYMBOL_KEYS)
+        security_id = _first_text(item, BROKER_SECURITY_ID_KEYS)
+        return cls(
+            symbol=symbol,
+            security_id=security_id,
+            entry_price=_first_float(item, BROKER_PRICE_KEYS),
+            quantity=quantity,
+            source=source,
+        )
+
+
+def candidates_frame(candidates, columns):
+    """DataFrame view of Candidate records with the given columns, for display and storage."""
+    return pd.DataFrame([[getattr(c, name) for name in columns] for c in candidates], columns=columns)
+
+
+def candidates_from_frame(df):
+    return [Candidate.from_mapping(row) for row in df.to_dict("records")]
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from lookback import plan_from_date, required_bars
+from scanner import EXCHANGE_TZ, _to_candle_df, candle_dates, fetch_daily_history
+
+REGIME_CACHE_PATH = os.getenv("REGIME_CACHE_PATH", "regime_cache.json")
+MARKET_CLOSE = time(15, 30)
+# A snapshot with failed indices is served for this long, then only the failed indices are fetched again.
+REGIME_RETRY_SECONDS = 300.0
+
+# Dhan security ids on the IDX_I segment.
+REGIME_INDICES = {
+    "NIFTY": "13",
+    "BANKNIFTY": "25",
+    "FINNIFTY": "27",
+}
+# Scrip-master sector label -> index used for that sector's regime; anything else uses NIFTY.
+SECTOR_INDEX = {
+    "BANK": "BANKNIFTY",
+    "BANKS": "BANKNIFTY",
+    "FINANCIAL SERVICES": "FINNIFTY",
+    "FINANCE": "FINNIFTY",
+}
+BENCHMARK_INDEX = "NIFTY"
+# Indicators behind regime_frame; the 252-bar high sets the floor for the fetch window.
+REGIME_INDICATORS = {"EMA50": ("ema", 50), "EMA200": ("ema", 200), "HIGH252": ("rolling", 252)}
+
+_lock = threading.Lock()
+_snapshot = None
+_retry_at = 0.0
+
+
+def session_key(now=None):
+    """Date of the last completed trading session in exchange time (weekends skipped).
+
+    Before the 15:30 close the key stays on the previous session, so a regime computed
+    mid-day is recomputed once after the close and then reused until the next one.
+    """
+    now = now or datetime.now(ZoneInfo(EXCHANGE_TZ))
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=ZoneInfo(EXCHANGE_TZ))
+    now = now.astimezone(ZoneInfo(EXCHANGE_TZ))
+    day = now.date()
+    if now.time() < MARKET_CLOSE:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day.isoformat()
+
+
+def regime_frame(closes):
+    """Per-bar regime metrics for one index close series (indexed by date)."""
+    closes = pd.Series(closes, dtype="float64")
+    ema50 = closes.ewm(span=50, adjust=False).mean()
+    ema200 = closes.ewm(span=200, adjust=False).mean()
+    slope = ema200.pct_change(20) * 100
+    returns = closes.pct_change()
+    frame = pd.DataFrame(
+        {
+            "close": closes,
+            "ema50": ema50,
+            "ema200": ema200,
+            "above_ema200": closes > ema200,
+            "ema200_slope_pct": slope,
+            "return_20d_pct": closes.pct_change(20) * 100,
+            "volatility_20d_pct": returns.rolling(20).std() * np.sqrt(252) * 100,
+            "drawdown_pct": (1 - closes / closes.rolling(252, min_periods=1).max()) * 100,
+        }
+    )
+    frame["regime"] = np.select(
+        [
+            frame["above_ema200"] & (ema50 > ema200) & (slope > 0),
+            ~frame["above_ema200"] & (ema50 < ema200) & (slope < 0),
+        ],
+        ["bull", "bear"],
+        default="neutral",
+    )
+    # EMA200 is not meaningful until there are 200 bars behind it.
+    frame.loc[frame.index[: min(len(frame), 199)], "regime"] = "unknown"
+    return frame
+
+
+def _latest_metrics(frame):
+    row = frame.iloc[-1]
+    latest = {"date": str(frame.index[-1]), "bars": int(len(frame)), "regime": str(row["regime"])}
+    latest["above_ema200"] = bool(row["above_ema200"]) if len(frame) >= 200 else None
+    for column in ["close", "ema50", "ema200", "ema200_slope_pct", "return_20d_pct", "volatility_20d_pct", "drawdown_pct"]:
+        latest[column] = None if pd.isna(row[column]) else round(float(row[column]), 4)
+    return latest
+
+
+def fetch_index_history(dhan, security_id, from_date, to_date):
+    """Daily closes for one index on the IDX_I segment, indexed by exchange date."""
+    raw = fetch_daily_history(
+        dhan,
+        security_id,
+        from_date,
+        to_date,
+        exchange_segment=getattr(dhan, "INDEX", "IDX_I"),
+        instrument="INDEX",
+    )
+    df = _to_candle_df(raw)
+    if df.empty:
+        return pd.Series(dtype="float64")
+    return pd.Series(df["close"].to_numpy(dtype="float64"), index=candle_dates(df).to_numpy())
+
+
+def _compute_snapshot(dhan, session, previous=None):
+    """Fetch every index, or with `previous` (same session) only the ones that failed in it."""
+    to_date = datetime.now(ZoneInfo(EXCHANGE_TZ)).strftime("%Y-%m-%d")
+    from_date = plan_from_date(required_bars(REGIME_INDICATORS), to_date)
+    indices = dict(previous["indices"]) if previous else {}
+    errors = {}
+    for name, security_id in REGIME_INDICES.items():
+        if name in indices:
+            continue
+        try:
+            closes = fetch_index_history(dhan, security_id, from_date, to_date)
+            if closes.empty:
+                raise ValueError("no_data_returned")
+            closes = closes[closes.index <= session]
+            indices[name] = {
+                "security_id": security_id,
+                "metrics": _latest_metrics(regime_frame(closes)),
+                "history": {"date": [str(d) for d in closes.index], "close": closes.round(4).tolist()},
+            }
+        except Exception as exc:
+            errors[name] = str(exc)
+    return {
+        "session": session,
+        "computed_at": datetime.now(ZoneInfo(EXCHANGE_TZ)).isoformat(timespec="seconds"),
+        "indices": indices,
+        "errors": errors,
+    }
+
+
+def _read_cache():
+    try:
+        with open(REGIME_CACHE_PATH, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_cache(snapshot):
+    tmp_path = f"{REGIME_CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(snapshot, handle)
+    os.replace(tmp_path, REGIME_CACHE_PATH)
+
+
+def get_regime(dhan, refresh=False):
+    """Regime snapshot for the current session, fetched at most once per session.
+
+    Looks in memory, then in the on-disk cache, and only then fetches every index in
+    REGIME_INDICES. A snapshot with fetch errors is not written to disk; it is served for
+    REGIME_RETRY_SECONDS and then only its failed indices are fetched again, so one
+    transient failure does not disable the regime gate for the rest of the session.
+    """
+    global _snapshot, _retry_at
+    session = session_key()
+    with _lock:
+        previous = None
+        if not refresh:
+            if _snapshot is not None and _snapshot.get("session") == session:
+                if not _snapshot["errors"] or clock.monotonic() < _retry_at:
+                    metrics.cache_result("regime_memory", True)
+                    return _snapshot
+                previous = _snapshot
+            metrics.cache_result("regime_memory", False)
+            if previous is None:
+                cached = _read_cache()
+                if cached is not None and cached.get("session") == session:
+                    metrics.cache_result("regime_disk", True)
+                    _snapshot = cached
+                    return _snapshot
+                metrics.cache_result("regime_disk", False)
+
+        snapshot = _compute_snapshot(dhan, session, previous)
+        if snapshot["errors"]:
+            _retry_at = clock.monotonic() + REGIME_RETRY_SECONDS
+        else:
+            _write_cache(snapshot)
+        _snapshot = snapshot
+        return _snapshot
+
+
+def index_metrics(snapshot, name=BENCHMARK_INDEX):
+    """Latest metrics for one index, or None when it failed to load."""
+    entry = (snapshot or {}).get("indices", {}).get(name)
+    return entry["metrics"] if entry else None
+
+
+def sector_regime(snapshot, sector):
+    """Metrics of the index that tracks `sector`, falling back to the benchmark."""
+    name = SECTOR_INDEX.get(str(sector or "").strip().upper(), BENCHMARK_INDEX)
+    return index_metrics(snapshot, name) or index_metrics(snapshot, BENCHMARK_INDEX)
+
+
+def regime_series(dhan, name=BENCHMARK_INDEX):
+    """Per-date regime metrics for one index from the session snapshot, for backtests."""
+    entry = get_regime(dhan).get("indices", {}).get(name)
+    if not entry:
+        return pd.DataFrame()
+    history = entry["history"]
+    return regime_frame(pd.Series(history["close"], index=history["date"], dtype="float64"))
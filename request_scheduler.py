@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import threading
+import time
+
+import metrics
+
+# Priorities: lower value is served first within an endpoint class.
+PRIORITY_ORDER = 0
+PRIORITY_PORTFOLIO = 1
+PRIORITY_QUOTE = 2
+PRIORITY_HISTORY = 3
+
+# Endpoint classes follow Dhan's published rate-limit groups.
+# (tokens per second, burst capacity) — kept slightly under the broker limits.
+ENDPOINT_LIMITS = {
+    "order": (20.0, 10),
+    "data": (4.0, 4),
+    "non_trading": (15.0, 10),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_take(self, now):
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def time_until_token(self, now):
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """Rate-limits broker calls per endpoint class and serves waiters by priority."""
+
+    def __init__(self, limits=None):
+        limits = limits or ENDPOINT_LIMITS
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in limits.items()}
+        self._waiting = {name: [] for name in limits}
+        self._metrics = {
+            name: {
+                "requests": 0,
+                "errors": 0,
+                "queue_depth": 0,
+                "max_queue_depth": 0,
+                "total_wait_s": 0.0,
+                "max_wait_s": 0.0,
+            }
+            for name in limits
+        }
+
+    def acquire(self, endpoint_class, priority=PRIORITY_HISTORY):
+        if endpoint_class not in self._buckets:
+            raise ValueError(f"Unknown endpoint class: {endpoint_class}")
+
+        bucket = self._buckets[endpoint_class]
+        queue = self._waiting[endpoint_class]
+        stats = self._metrics[endpoint_class]
+        started = time.monotonic()
+
+        with self._cond:
+            ticket = (int(priority), next(self._seq))
+            heapq.heappush(queue, ticket)
+            stats["queue_depth"] = len(queue)
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], len(queue))
+
+            while True:
+                now = time.monotonic()
+                if queue[0] == ticket:
+                    if bucket.try_take(now):
+                        heapq.heappop(queue)
+                        break
+                    self._cond.wait(bucket.time_until_token(now))
+                else:
+                    self._cond.wait()
+
+            stats["queue_depth"] = len(queue)
+            waited = time.monotonic() - started
+            stats["requests"] += 1
+            stats["total_wait_s"] += waited
+            stats["max_wait_s"] = max(stats["max_wait_s"], waited)
+            # Wake the next head so it can start timing its own token.
+            self._cond.notify_all()
+        return waited
+
+    def submit(self, endpoint_class, priority, fn, *args, **kwargs):
+        waited = self.acquire(endpoint_class, priority)
+        method = getattr(fn, "__name__", "call")
+        metrics.observe("broker_queue_wait_seconds", waited, endpoint=endpoint_class, method=method)
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self._cond:
+                self._metrics[endpoint_class]["errors"] += 1
+            metrics.inc("broker_request_errors", endpoint=endpoint_class, method=method, kind="exception")
+            raise
+        finally:
+            metrics.observe(
+                "broker_request_seconds", time.perf_counter() - started, endpoint=endpoint_class, method=method
+            )
+        if isinstance(result, dict) and str(result.get("status", "")).lower() == "failure":
+            metrics.inc("broker_request_errors", endpoint=endpoint_class, method=method, kind="failure_status")
+        return result
+
+    def snapshot(self):
+        with self._cond:
+            rows = []
+            for name, stats in self._metrics.items():
+                requests = stats["requests"]
+                rows.append(
+                    {
+                        "endpoint_class": name,
+                        "requests": requests,
+                        "errors": stats["errors"],
+                        "queue_depth": stats["queue_depth"],
+                        "max_queue_depth": stats["max_queue_depth"],
+                        "avg_wait_ms": round(stats["total_wait_s"] / requests * 1000, 2) if requests else 0.0,
+                        "max_wait_ms": round(stats["max_wait_s"] * 1000, 2),
+                    }
+                )
+            return rows
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
+
+
+def broker_call(endpoint_class, priority, fn, *args, **kwargs):
+    """Run one broker SDK call through the shared scheduler."""
+    return get_scheduler().submit(endpoint_class, priority, fn, *args, **kwargs)
@@ -1,13 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import time
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import metrics
+from lookback import plan_from_date, required_bars
+from records import BrokerPosition, Candidate, TradeRecord, candidates_frame
+from request_scheduler import PRIORITY_HISTORY, broker_call
+from symbols import SymbolIndex, canonical_symbol
 
-HISTORY_START = "2023-01-01"
+EXCHANGE_TZ = "Asia/Kolkata"
+CANDLE_STORE_ENABLED = os.getenv("CANDLE_STORE", "0").strip().lower() in ("1", "true", "yes")
+# Stored history counts as covering a window if it starts within this many days of it.
+STORE_COVERAGE_SLACK_DAYS = 7
+# Symbols fetched and reduced to indicator rows per step of a scan; bounds peak memory.
+SCAN_CHUNK_SIZE = int(os.getenv("SCAN_CHUNK_SIZE", "250"))
+FETCH_WORKERS = 8
+SCAN_CHECKPOINT_PATH = os.getenv("SCAN_CHECKPOINT_PATH", "scan_checkpoint.jsonl")
 MIN_CANDLES = 200
 SCORE_THRESHOLD = 70
 SYMBOL_MIN_CANDLES = {
     "TATAMOTORS": 60,
 }
 
+# Fallback universe for strategies without one; larger universes live in universes/ (see universes.py).
 UNIVERSE = [
     "RELIANCE",
     "TCS",
@@ -24,13 +43,21 @@ UNIVERSE = [
 ]
 
 
-def fetch_daily_history(dhan_client, security_id, from_date, to_date):
-    """Compatibility wrapper across dhanhq versions."""
-    exchange_eq = getattr(dhan_client, "NSE_EQ", getattr(dhan_client, "NSE", "NSE_EQ"))
-    instrument_equity = getattr(dhan_client, "EQUITY", "EQUITY")
+def fetch_daily_history(
+    dhan_client, security_id, from_date, to_date, priority=PRIORITY_HISTORY, exchange_segment=None, instrument=None
+):
+    """Compatibility wrapper across dhanhq versions, routed through the request scheduler.
+
+    Defaults to NSE cash equity; pass `exchange_segment`/`instrument` for indices.
+    """
+    exchange_eq = exchange_segment or getattr(dhan_client, "NSE_EQ", getattr(dhan_client, "NSE", "NSE_EQ"))
+    instrument_equity = instrument or getattr(dhan_client, "EQUITY", "EQUITY")
 
     if hasattr(dhan_client, "historical_data"):
-        return dhan_client.historical_data(
+        return broker_call(
+            "data",
+            priority,
+            dhan_client.historical_data,
             security_id=str(security_id),
             exchange_segment=exchange_eq,
             instrument=instrument_equity,
@@ -40,7 +67,10 @@ def fetch_daily_history(dhan_client, security_id, from_date, to_date):
         )
 
     if hasattr(dhan_client, "historical_daily_data"):
-        return dhan_client.historical_daily_data(
+        return broker_call(
+            "data",
+            priority,
+            dhan_client.historical_daily_data,
             security_id=str(security_id),
             exchange_segment=exchange_eq,
             instrument_type=instrument_equity,
@@ -96,6 +126,91 @@ def _to_candle_df(raw):
     return df
 
 
+def candle_dates(df):
+    """Trading dates (YYYY-MM-DD, exchange local time) for a frame from `_to_candle_df`."""
+    numeric = pd.to_numeric(df["timestamp"], errors="coerce")
+    if len(numeric) and numeric.notna().all():
+        stamps = pd.to_datetime(numeric, unit="s", utc=True)
+    else:
+        stamps = pd.to_datetime(df["timestamp"], errors="coerce", utc=True)
+    return stamps.dt.tz_convert(EXCHANGE_TZ).dt.strftime("%Y-%m-%d")
+
+
+def store_candles(security_id, df):
+    """Write-through to the local candle store when CANDLE_STORE=1; never fails the caller."""
+    if not CANDLE_STORE_ENABLED or df.empty:
+        return
+    try:
+        from database import save_candles
+
+        dates = candle_dates(df)
+        rows = zip(
+            dates,
+            df["open"].astype(float),
+            df["high"].astype(float),
+            df["low"].astype(float),
+            df["close"].astype(float),
+            df["volume"].astype(float),
+        )
+        save_candles(security_id, [row for row in rows if isinstance(row[0], str)])
+    except Exception:
+        return
+
+
+def _stored_candle_df(security_id, from_date):
+    """Candles from the local store since `from_date`, shaped like `_to_candle_df` output."""
+    try:
+        from database import get_candles
+
+        rows = get_candles(security_id, since_date=from_date)
+    except Exception:
+        return pd.DataFrame()
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=["candle_date", "open", "high", "low", "close", "volume"])
+    # Midnight exchange time round-trips through candle_dates() to the same trading date.
+    stamps = pd.to_datetime(df["candle_date"]).dt.tz_localize(EXCHANGE_TZ).dt.tz_convert("UTC")
+    df["timestamp"] = (stamps - pd.Timestamp("1970-01-01", tz="UTC")) // pd.Timedelta(seconds=1)
+    return df[["timestamp", "open", "high", "low", "close", "volume", "candle_date"]]
+
+
+def load_candles(dhan, security_id, from_date, to_date, priority=PRIORITY_HISTORY):
+    """Fetch and normalize daily candles for one security, storing them locally if enabled.
+
+    With CANDLE_STORE=1, stored candles that already cover the window are reused and only
+    bars from the last stored date onward are fetched (re-fetching that date refreshes a
+    bar stored before the close).
+    """
+    stored = _stored_candle_df(str(security_id), from_date) if CANDLE_STORE_ENABLED else pd.DataFrame()
+    fetch_from = from_date
+    if not stored.empty:
+        coverage_limit = (
+            datetime.strptime(from_date, "%Y-%m-%d") + pd.Timedelta(days=STORE_COVERAGE_SLACK_DAYS)
+        ).strftime("%Y-%m-%d")
+        if stored["candle_date"].iloc[0] <= coverage_limit:
+            fetch_from = stored["candle_date"].iloc[-1]
+    if CANDLE_STORE_ENABLED:
+        metrics.cache_result("candle_store", fetch_from != from_date)
+
+    raw = fetch_daily_history(
+        dhan_client=dhan,
+        security_id=security_id,
+        from_date=fetch_from,
+        to_date=to_date,
+        priority=priority,
+    )
+    df = _to_candle_df(raw)
+    store_candles(str(security_id), df)
+    if fetch_from == from_date:
+        return df
+
+    if df.empty:
+        return stored.drop(columns=["candle_date"]).reset_index(drop=True)
+    first_fresh = min(fetch_from, candle_dates(df).iloc[0])
+    older = stored[stored["candle_date"] < first_fresh].drop(columns=["candle_date"])
+    return pd.concat([older, df[older.columns]], ignore_index=True)
+
+
 def calculate_atr(df, period=14):
     high_low = df["high"] - df["low"]
     high_close = (df["high"] - df["close"].shift()).abs()
@@ -117,363 +232,805 @@ def is_bullish_engulfing(df):
     )
 
 
-def resolve_security_id(symbol_map, symbol):
-    def canonical_symbol(value):
-        text = str(value).strip().upper()
-        if text.endswith("-EQ"):
-            text = text[:-3]
-        return "".join(ch for ch in text if ch.isalnum())
-
-    candidates = [
-        symbol,
-        str(symbol).upper(),
-        f"{str(symbol).upper()}-EQ",
-        canonical_symbol(symbol),
-    ]
-    for key in candidates:
-        sec = symbol_map.get(key)
-        if sec:
-            return sec
-    return None
+def _as_symbol_index(symbol_map):
+    return symbol_map if isinstance(symbol_map, SymbolIndex) else SymbolIndex.from_symbol_map(symbol_map)
 
 
 def resolve_security_ids(symbol_map, symbol):
-    def canonical_symbol(value):
-        text = str(value).strip().upper()
-        if text.endswith("-EQ"):
-            text = text[:-3]
-        return "".join(ch for ch in text if ch.isalnum())
-
-    keys = [
-        symbol,
-        str(symbol).upper(),
-        f"{str(symbol).upper()}-EQ",
-        canonical_symbol(symbol),
-    ]
+    """All security ids for `symbol`; `symbol_map` is a SymbolIndex or a plain {symbol: id(s)} dict."""
+    if isinstance(symbol_map, SymbolIndex):
+        return list(symbol_map.lookup(symbol))
     ids = []
-    for key in keys:
+    for key in [symbol, str(symbol).upper(), f"{str(symbol).upper()}-EQ", canonical_symbol(symbol)]:
         sec = symbol_map.get(key)
         if not sec:
             continue
-        if isinstance(sec, list):
-            for item in sec:
-                value = str(item).strip()
-                if value and value not in ids:
-                    ids.append(value)
-        else:
-            value = str(sec).strip()
+        for item in sec if isinstance(sec, (list, tuple)) else [sec]:
+            value = str(item).strip()
             if value and value not in ids:
                 ids.append(value)
     return ids
 
 
-def scan(dhan, symbol_map):
-    candidates = []
-    diagnostics = []
+def resolve_security_id(symbol_map, symbol):
+    """First security id for `symbol`, or None."""
+    ids = resolve_security_ids(symbol_map, symbol)
+    return ids[0] if ids else None
 
-    def log(symbol, status, reason, security_id=None, **extra):
-        row = {"symbol": symbol, "status": status, "reason": reason, "security_id": security_id}
-        row.update(extra)
-        diagnostics.append(row)
 
-    to_date = datetime.now().strftime("%Y-%m-%d")
-    from_date = HISTORY_START
-
-    # ---------------------------
-    # MARKET REGIME CHECK
-    # ---------------------------
-    regime_score = 0
-    nifty_id = None
-    for idx_name in ["NIFTY", "NIFTY50", "NIFTY 50"]:
-        nifty_id = resolve_security_id(symbol_map, idx_name)
-        if nifty_id:
-            break
-    # Fallback: Dhan index ID for NIFTY 50 when index symbols are absent in equity-only maps.
-    if not nifty_id:
-        nifty_id = "13"
+CANDIDATE_COLUMNS = ["symbol", "security_id", "price", "stop_price", "confidence", "signal_strength", "rs_score", "sector_rs"]
 
-    if nifty_id:
-        try:
-            raw_nifty = fetch_daily_history(
-                dhan_client=dhan,
-                security_id=nifty_id,
-                from_date=from_date,
-                to_date=to_date,
-            )
-            nifty_df = _to_candle_df(raw_nifty)
-            if len(nifty_df) >= 200:
-                nifty_df["EMA200"] = nifty_df["close"].ewm(span=200, adjust=False).mean()
-                if nifty_df.iloc[-1]["close"] > nifty_df.iloc[-1]["EMA200"]:
-                    regime_score = 20
-        except Exception as exc:
-            log("NIFTY", "error", "regime_fetch_failed", message=str(exc))
-    else:
-        log("NIFTY", "skipped", "regime_symbol_missing")
+DEFAULT_STRATEGY = {
+    "name": "default",
+    "universe": None,
+    "score_threshold": SCORE_THRESHOLD,
+    "strict_threshold": 85,
+    "regime_bonus": 20,
+    "weights": {"trend": 25, "breakout": 20, "atr": 15, "volume": 10, "pattern": 10, "rs": 0},
+    "ema_spans": (20, 50, 200),
+    "atr_period": 14,
+    "atr_max_pct": 0.03,
+    "breakout_lookback": 20,
+    "volume_lookback": 20,
+    "volume_mult": 1.5,
+    "swing_lookback": 10,
+    "atr_stop_mult": 1.5,
+    "regime_index": "NIFTY",
+}
 
-    for symbol in UNIVERSE:
-        required_candles = int(SYMBOL_MIN_CANDLES.get(symbol, MIN_CANDLES))
-        security_ids = resolve_security_ids(symbol_map, symbol)
-        if not security_ids:
-            log(symbol, "skipped", "missing_security_id")
-            continue
 
-        df = pd.DataFrame()
-        security_id = None
-        best_short_df = pd.DataFrame()
-        best_short_id = None
-        last_exc = None
+# Relative-strength horizons in trading bars (~1, 3 and 6 months), ranked across the universe.
+RS_HORIZONS = (21, 63, 126)
 
-        for candidate_id in security_ids:
-            try:
-                raw = fetch_daily_history(
-                    dhan_client=dhan,
-                    security_id=candidate_id,
-                    from_date=from_date,
-                    to_date=to_date,
-                )
-                candidate_df = _to_candle_df(raw)
-            except Exception as exc:
-                last_exc = exc
-                continue
-
-            if len(candidate_df) >= required_candles:
-                security_id = str(candidate_id)
-                df = candidate_df
-                break
-
-            if len(candidate_df) > len(best_short_df):
-                best_short_df = candidate_df
-                best_short_id = str(candidate_id)
-
-        if df.empty:
-            if not best_short_df.empty:
-                log(
-                    symbol,
-                    "skipped",
-                    "insufficient_candles",
-                    security_id=str(best_short_id),
-                    candles=int(len(best_short_df)),
-                    required_candles=required_candles,
-                    candidate_ids=",".join(security_ids),
-                )
-            else:
-                log(
-                    symbol,
-                    "error",
-                    "historical_data_failed",
-                    security_id=",".join(security_ids),
-                    message=str(last_exc) if last_exc else "no_data_returned",
-                )
-            continue
 
-        df["EMA20"] = df["close"].ewm(span=20, adjust=False).mean()
-        df["EMA50"] = df["close"].ewm(span=50, adjust=False).mean()
-        df["EMA200"] = df["close"].ewm(span=200, adjust=False).mean()
-        df["ATR"] = calculate_atr(df)
-        df["VOL_AVG"] = df["volume"].rolling(20).mean()
-        df["HIGH20_PREV"] = df["high"].shift(1).rolling(20).max()
-        df["SWING_LOW10"] = df["low"].rolling(10).min()
-
-        latest = df.iloc[-1]
-        price = float(latest["close"])
-        ema20 = float(latest["EMA20"]) if pd.notna(latest["EMA20"]) else None
-        ema50 = float(latest["EMA50"]) if pd.notna(latest["EMA50"]) else None
-        ema200 = float(latest["EMA200"]) if pd.notna(latest["EMA200"]) else None
-        atr = float(latest["ATR"]) if pd.notna(latest["ATR"]) else None
-        vol_avg = float(latest["VOL_AVG"]) if pd.notna(latest["VOL_AVG"]) else None
-        high20_prev = float(latest["HIGH20_PREV"]) if pd.notna(latest["HIGH20_PREV"]) else None
-        swing_low = float(latest["SWING_LOW10"]) if pd.notna(latest["SWING_LOW10"]) else None
-        volume = float(latest["volume"])
-
-        if None in (ema20, ema50, ema200, atr, vol_avg, high20_prev, swing_low):
-            log(symbol, "skipped", "indicator_nan", security_id=str(security_id))
-            continue
+def relative_strength(close_panel, horizons=RS_HORIZONS, sectors=None):
+    """Cross-sectional return percentiles for every column of a right-aligned close panel.
 
-        score = regime_score
-
-        trend_ok = price > ema20 > ema50 > ema200
-        breakout_ok = price > high20_prev
-        atr_ok = (atr / price) < 0.03 if price > 0 else False
-        volume_ok = volume > (1.5 * vol_avg) if vol_avg > 0 else False
-        pattern_ok = is_bullish_engulfing(df)
-
-        if trend_ok:
-            score += 25
-        if breakout_ok:
-            score += 20
-        if atr_ok:
-            score += 15
-        if volume_ok:
-            score += 10
-        if pattern_ok:
-            score += 10
-
-        if score < SCORE_THRESHOLD:
-            log(
-                symbol,
-                "skipped",
-                "setup_conditions_not_met",
-                security_id=str(security_id),
-                score=int(score),
-                trend_ok=bool(trend_ok),
-                breakout_ok=bool(breakout_ok),
-                atr_ok=bool(atr_ok),
-                volume_ok=bool(volume_ok),
-                pattern_ok=bool(pattern_ok),
-            )
-            continue
+    For each horizon the trailing return is ranked across all symbols (0..1, NaN when the
+    history is too short); `rs_score` is the mean percentile scaled to 0..100. When
+    `sectors` maps columns to sector labels, `sector_rs` ranks the same composite within
+    each sector. Everything is a handful of rank operations, so cost grows with N log N.
+    """
+    columns = ["rs_score", "sector_rs"] + [f"ret_{h}" for h in horizons]
+    if close_panel.empty:
+        return pd.DataFrame(columns=columns)
+
+    values = close_panel.to_numpy(dtype="float64")
+    latest = values[-1]
+    returns = {}
+    for horizon in horizons:
+        if len(values) > horizon:
+            base = values[-1 - horizon]
+            returns[f"ret_{horizon}"] = np.where(base > 0, latest / base - 1, np.nan)
+        else:
+            returns[f"ret_{horizon}"] = np.full(len(latest), np.nan)
+    table = pd.DataFrame(returns, index=close_panel.columns)
 
-        stop_price = min(swing_low, price - (atr * 1.5))
-        if stop_price <= 0 or stop_price >= price:
-            log(
-                symbol,
-                "skipped",
-                "invalid_stop",
-                security_id=str(security_id),
-                stop_price=float(stop_price),
-                close=float(price),
+    percentiles = table.rank(pct=True)
+    table["rs_score"] = percentiles.mean(axis=1) * 100
+    table["sector_rs"] = np.nan
+    if sectors:
+        labels = pd.Series(table.index.map(lambda key: sectors.get(key)), index=table.index)
+        has_sector = labels.notna()
+        if has_sector.any():
+            table.loc[has_sector, "sector_rs"] = (
+                table.loc[has_sector, "rs_score"].groupby(labels[has_sector]).rank(pct=True) * 100
             )
+    return table[columns]
+
+
+def make_strategy(**overrides):
+    """Strategy config: DEFAULT_STRATEGY with `overrides` applied (weights merge key by key)."""
+    strategy = dict(DEFAULT_STRATEGY)
+    strategy["weights"] = dict(DEFAULT_STRATEGY["weights"])
+    for key, value in overrides.items():
+        if key == "weights":
+            strategy["weights"].update(value)
+        else:
+            strategy[key] = value
+    return strategy
+
+
+def _strategy_universe(strategy):
+    return list(strategy.get("universe") or UNIVERSE)
+
+
+def required_indicators(strategies):
+    """Union of indicator columns every strategy needs, as {column: (kind, window)}."""
+    needed = {}
+    for strategy in strategies:
+        for span in strategy["ema_spans"]:
+            needed[f"EMA{span}"] = ("ema", int(span))
+        needed[f"ATR{strategy['atr_period']}"] = ("atr", int(strategy["atr_period"]))
+        needed[f"VOL_AVG{strategy['volume_lookback']}"] = ("vol_avg", int(strategy["volume_lookback"]))
+        needed[f"HIGH{strategy['breakout_lookback']}_PREV"] = ("high_prev", int(strategy["breakout_lookback"]))
+        needed[f"SWING_LOW{strategy['swing_lookback']}"] = ("swing_low", int(strategy["swing_lookback"]))
+    return needed
+
+
+def _latest_indicators(df, needed):
+    """Latest-bar values of every needed indicator plus the raw fields the rules use."""
+    row = {
+        "close": float(df["close"].iloc[-1]),
+        "open": float(df["open"].iloc[-1]),
+        "volume": float(df["volume"].iloc[-1]),
+        "prev_open": float(df["open"].iloc[-2]) if len(df) >= 2 else np.nan,
+        "prev_close": float(df["close"].iloc[-2]) if len(df) >= 2 else np.nan,
+    }
+    for column, (kind, window) in needed.items():
+        if kind == "ema":
+            series = df["close"].ewm(span=window, adjust=False).mean()
+        elif kind == "atr":
+            series = calculate_atr(df, period=window)
+        elif kind == "vol_avg":
+            series = df["volume"].rolling(window).mean()
+        elif kind == "high_prev":
+            series = df["high"].shift(1).rolling(window).max()
+        else:
+            series = df["low"].rolling(window).min()
+        row[column] = float(series.iloc[-1])
+    return row
+
+
+def _load_symbol_frame(dhan, symbol, security_ids, from_date, to_date, log):
+    """(security_id, df) for the first mapped id with enough candles, else None after logging why."""
+    required_candles = int(SYMBOL_MIN_CANDLES.get(symbol, MIN_CANDLES))
+    if not security_ids:
+        log(symbol, "skipped", "missing_security_id")
+        return None
+
+    best_short_df = pd.DataFrame()
+    best_short_id = None
+    last_exc = None
+
+    for candidate_id in security_ids:
+        try:
+            candidate_df = load_candles(dhan, candidate_id, from_date, to_date)
+        except Exception as exc:
+            last_exc = exc
             continue
 
-        candidate = {
-            "symbol": symbol,
-            "security_id": str(security_id),
-            "price": round(price, 2),
-            "stop_price": round(float(stop_price), 2),
-            "confidence": int(score),
-            "signal_strength": "strict" if score >= 85 else "relaxed",
-        }
-        candidates.append(candidate)
+        if len(candidate_df) >= required_candles:
+            return str(candidate_id), candidate_df
+
+        if len(candidate_df) > len(best_short_df):
+            best_short_df = candidate_df
+            best_short_id = str(candidate_id)
+
+    if not best_short_df.empty:
         log(
             symbol,
-            "selected",
-            "candidate_found",
-            security_id=str(security_id),
-            confidence=int(candidate["confidence"]),
-            signal_strength=candidate["signal_strength"],
-        )
-
-    if not candidates:
-        df_candidates = pd.DataFrame(
-            columns=["symbol", "security_id", "price", "stop_price", "confidence", "signal_strength"]
+            "skipped",
+            "insufficient_candles",
+            security_id=str(best_short_id),
+            candles=int(len(best_short_df)),
+            required_candles=required_candles,
+            candidate_ids=",".join(security_ids),
         )
     else:
-        df_candidates = pd.DataFrame(candidates).sort_values("confidence", ascending=False).reset_index(drop=True)
+        log(
+            symbol,
+            "error",
+            "historical_data_failed",
+            security_id=",".join(security_ids),
+            message=str(last_exc) if last_exc else "no_data_returned",
+        )
+    return None
+
 
-    df_diagnostics = pd.DataFrame(diagnostics)
-    return df_candidates, df_diagnostics
+def load_universe_frames(dhan, symbol_map, symbols, from_dates, to_date, log):
+    """Resolve and fetch candles once per symbol; returns {symbol: (security_id, df)}.
 
+    `from_dates` maps each symbol to the start of its planned window. Symbols are fetched
+    concurrently (the request scheduler keeps the pace); each tries every mapped security
+    id and keeps the first with enough candles. Failures are reported through
+    `log(symbol, status, reason, security_id=None, **extra)`. Result order follows `symbols`.
+    """
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    resolved = _as_symbol_index(symbol_map).resolve_many(symbols)
 
-def scan_portfolio_risk(dhan, active_trades):
-    """Scan active positions and return SELL/HOLD advisory with reasons."""
+    def load_one(job):
+        symbol, security_ids = job
+        return _load_symbol_frame(dhan, symbol, list(security_ids), from_dates[symbol], to_date, log)
+
+    jobs = list(zip(symbols, resolved["security_ids"]))
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(jobs))) as pool:
+        results = list(pool.map(load_one, jobs))
+    return {symbol: result for symbol, result in zip(symbols, results) if result is not None}
+
+
+def build_indicator_snapshot(frames, needed):
+    """One row per symbol with the latest indicator values, indexed by symbol."""
     rows = []
-    to_date = datetime.now().strftime("%Y-%m-%d")
-    from_date = HISTORY_START
-
-    def parse_trade(trade):
-        if isinstance(trade, dict):
-            symbol = str(trade.get("symbol", "UNKNOWN"))
-            security_id = str(trade.get("security_id", "")).strip()
-            entry_price = float(trade.get("entry_price", 0) or 0)
-            stop_price = float(trade.get("stop_price", 0) or 0)
-            quantity = float(trade.get("quantity", 0) or 0)
-            return symbol, security_id, entry_price, stop_price, quantity
-
-        # DB tuple fallback:
-        # id, symbol, security_id, entry_price, stop_price, position_size, ...
-        symbol = str(trade[1])
-        security_id = str(trade[2])
-        entry_price = float(trade[3]) if trade[3] is not None else 0.0
-        stop_price = float(trade[4]) if trade[4] is not None else 0.0
-        position_size = float(trade[5]) if trade[5] is not None else 0.0
-        quantity = (position_size / entry_price) if entry_price > 0 else 0.0
-        return symbol, security_id, entry_price, stop_price, quantity
+    for symbol, (security_id, df) in frames.items():
+        row = _latest_indicators(df, needed)
+        row["symbol"] = symbol
+        row["security_id"] = str(security_id)
+        rows.append(row)
+    if not rows:
+        columns = ["symbol", "security_id", "close", "open", "volume", "prev_open", "prev_close"] + list(needed)
+        return pd.DataFrame(columns=columns).set_index("symbol")
+    return pd.DataFrame(rows).set_index("symbol")
+
+
+def _round_or_none(value, digits=1):
+    return None if pd.isna(value) else round(float(value), digits)
+
+
+def evaluate_strategy(strategy, snapshot, regime_ok):
+    """Score every symbol in the snapshot for one strategy as column operations.
+
+    Returns (candidates, diagnostics) in snapshot order: Candidate records and dicts.
+    """
+    fast, mid, slow = (f"EMA{span}" for span in strategy["ema_spans"])
+    atr_col = f"ATR{strategy['atr_period']}"
+    vol_col = f"VOL_AVG{strategy['volume_lookback']}"
+    high_col = f"HIGH{strategy['breakout_lookback']}_PREV"
+    swing_col = f"SWING_LOW{strategy['swing_lookback']}"
+    weights = strategy["weights"]
+
+    snap = snapshot
+    price = snap["close"]
+    indicator_nan = snap[[fast, mid, slow, atr_col, vol_col, high_col, swing_col]].isna().any(axis=1)
 
-    for trade in active_trades:
-        symbol, security_id, entry_price, stop_price, quantity = parse_trade(trade)
-        if not security_id or quantity <= 0:
+    trend_ok = (price > snap[fast]) & (snap[fast] > snap[mid]) & (snap[mid] > snap[slow])
+    breakout_ok = price > snap[high_col]
+    atr_ok = (price > 0) & ((snap[atr_col] / price.where(price > 0)) < strategy["atr_max_pct"])
+    volume_ok = (snap[vol_col] > 0) & (snap["volume"] > strategy["volume_mult"] * snap[vol_col])
+    pattern_ok = (
+        (snap["close"] > snap["open"])
+        & (snap["prev_close"] < snap["prev_open"])
+        & (snap["close"] > snap["prev_open"])
+        & (snap["open"] < snap["prev_close"])
+    )
+
+    score = (
+        (strategy["regime_bonus"] if regime_ok else 0)
+        + trend_ok * weights.get("trend", 0)
+        + breakout_ok * weights.get("breakout", 0)
+        + atr_ok * weights.get("atr", 0)
+        + volume_ok * weights.get("volume", 0)
+        + pattern_ok * weights.get("pattern", 0)
+    )
+    if weights.get("rs"):
+        score = score + (snap["rs_score"].fillna(0) / 100 * weights["rs"]).round()
+    stop_price = np.minimum(snap[swing_col], price - snap[atr_col] * strategy["atr_stop_mult"])
+
+    candidates = []
+    diagnostics = []
+    for symbol in snap.index:
+        security_id = str(snap.at[symbol, "security_id"])
+        if indicator_nan[symbol]:
+            diagnostics.append({"symbol": symbol, "status": "skipped", "reason": "indicator_nan", "security_id": security_id})
             continue
 
-        try:
-            raw = fetch_daily_history(
-                dhan_client=dhan,
-                security_id=security_id,
-                from_date=from_date,
-                to_date=to_date,
-            )
-            df = _to_candle_df(raw)
-        except Exception as exc:
-            rows.append(
+        symbol_score = int(score[symbol])
+        if symbol_score < strategy["score_threshold"]:
+            diagnostics.append(
                 {
                     "symbol": symbol,
+                    "status": "skipped",
+                    "reason": "setup_conditions_not_met",
                     "security_id": security_id,
-                    "entry_price": round(entry_price, 2),
-                    "current_price": None,
-                    "stop_price": round(stop_price, 2),
-                    "pnl_pct": None,
-                    "advice": "SELL",
-                    "reason": f"data_fetch_error: {exc}",
+                    "score": symbol_score,
+                    "trend_ok": bool(trend_ok[symbol]),
+                    "breakout_ok": bool(breakout_ok[symbol]),
+                    "atr_ok": bool(atr_ok[symbol]),
+                    "volume_ok": bool(volume_ok[symbol]),
+                    "pattern_ok": bool(pattern_ok[symbol]),
                 }
             )
             continue
 
-        if len(df) < 60:
-            rows.append(
+        symbol_price = float(price[symbol])
+        symbol_stop = float(stop_price[symbol])
+        if symbol_stop <= 0 or symbol_stop >= symbol_price:
+            diagnostics.append(
                 {
                     "symbol": symbol,
+                    "status": "skipped",
+                    "reason": "invalid_stop",
                     "security_id": security_id,
-                    "entry_price": round(entry_price, 2),
-                    "current_price": None,
-                    "stop_price": round(stop_price, 2),
-                    "pnl_pct": None,
-                    "advice": "SELL",
-                    "reason": "insufficient_candles_for_risk_scan",
+                    "stop_price": symbol_stop,
+                    "close": symbol_price,
                 }
             )
             continue
 
-        df["EMA20"] = df["close"].ewm(span=20, adjust=False).mean()
-        df["EMA50"] = df["close"].ewm(span=50, adjust=False).mean()
-        latest = df.iloc[-1]
-
-        current_price = float(latest["close"])
-        ema20 = float(latest["EMA20"]) if pd.notna(latest["EMA20"]) else None
-        ema50 = float(latest["EMA50"]) if pd.notna(latest["EMA50"]) else None
-        pnl_pct = ((current_price - entry_price) / entry_price * 100) if entry_price > 0 else None
-
-        advice = "HOLD"
-        reason = "trend_intact"
-
-        if stop_price > 0 and current_price <= stop_price:
-            advice = "SELL"
-            reason = "stop_loss_breached"
-        elif ema50 is not None and current_price < ema50:
-            advice = "SELL"
-            reason = "close_below_ema50"
-        elif ema20 is not None and current_price < ema20 and pnl_pct is not None and pnl_pct < 0:
-            advice = "SELL"
-            reason = "close_below_ema20_with_negative_pnl"
-
-        rows.append(
+        signal_strength = "strict" if symbol_score >= strategy["strict_threshold"] else "relaxed"
+        candidates.append(
+            Candidate(
+                symbol=symbol,
+                security_id=security_id,
+                price=round(symbol_price, 2),
+                stop_price=round(symbol_stop, 2),
+                confidence=symbol_score,
+                signal_strength=signal_strength,
+                rs_score=_round_or_none(snap.at[symbol, "rs_score"]),
+                sector_rs=_round_or_none(snap.at[symbol, "sector_rs"]),
+                strategy=strategy["name"],
+            )
+        )
+        diagnostics.append(
             {
                 "symbol": symbol,
+                "status": "selected",
+                "reason": "candidate_found",
                 "security_id": security_id,
-                "entry_price": round(entry_price, 2),
-                "current_price": round(current_price, 2),
-                "stop_price": round(stop_price, 2),
-                "pnl_pct": round(pnl_pct, 2) if pnl_pct is not None else None,
-                "advice": advice,
-                "reason": reason,
+                "confidence": symbol_score,
+                "signal_strength": signal_strength,
             }
         )
+    return candidates, diagnostics
 
-    if not rows:
-        return pd.DataFrame(
-            columns=["symbol", "security_id", "entry_price", "current_price", "stop_price", "pnl_pct", "advice", "reason"]
+
+def _record_scan(scan_kind, started, symbols):
+    elapsed = time.perf_counter() - started
+    metrics.observe("scan_duration_seconds", elapsed, scan=scan_kind)
+    metrics.inc("scan_symbols", symbols, scan=scan_kind)
+    if elapsed > 0:
+        metrics.set_gauge("scan_symbols_per_second", symbols / elapsed, scan=scan_kind)
+
+
+def plan_lookback(strategies, symbols, to_date):
+    """Minimal fetch window per symbol: {symbol: from_date}.
+
+    Each symbol needs enough bars for the indicators of the strategies that cover it
+    (EMAs until they converge, see lookback.py), its minimum candle count and the
+    longest relative-strength horizon.
+    """
+    members = [set(_strategy_universe(strategy)) for strategy in strategies]
+    plans = {}
+    plan = {}
+    for symbol in symbols:
+        # Most symbols share a (covering strategies, minimum bars) pair; plan each pair once.
+        covering = tuple(position for position, member_set in enumerate(members) if symbol in member_set)
+        min_bars = max(int(SYMBOL_MIN_CANDLES.get(symbol, MIN_CANDLES)), max(RS_HORIZONS) + 1)
+        key = (covering, min_bars)
+        if key not in plans:
+            needed = required_indicators([strategies[position] for position in covering])
+            plans[key] = plan_from_date(required_bars(needed, min_bars), to_date)
+        plan[symbol] = plans[key]
+    return plan
+
+
+def load_regime(dhan, log=None):
+    """Session regime snapshot (see regime.py); fetch errors go to `log` per index."""
+    # Imported here because regime.py builds on this module's fetch helpers.
+    from regime import get_regime
+
+    log = log or (lambda *args, **kwargs: None)
+    try:
+        snapshot = get_regime(dhan)
+    except Exception as exc:
+        log("NIFTY", "error", "regime_fetch_failed", message=str(exc))
+        return {}
+    for name, message in snapshot.get("errors", {}).items():
+        log(name, "error", "regime_fetch_failed", message=message)
+    return snapshot
+
+
+def regime_ok_for(strategy, regime):
+    """True when the strategy's regime index closes above its EMA200."""
+    entry = regime.get("indices", {}).get(strategy["regime_index"])
+    return bool(entry and entry["metrics"].get("above_ema200"))
+
+
+def _evaluate_strategies(strategies, snapshot, shared_diagnostics, from_dates, regime):
+    """Score `snapshot` for every strategy; (candidates, diagnostics) DataFrames with a strategy column."""
+    all_candidates = []
+    all_diagnostics = []
+    for strategy in strategies:
+        members = _strategy_universe(strategy)
+        member_set = set(members)
+        candidates, diagnostics = evaluate_strategy(
+            strategy, snapshot[snapshot.index.isin(member_set)], regime_ok_for(strategy, regime)
         )
 
-    df_risk = pd.DataFrame(rows)
-    advice_rank = {"SELL": 0, "HOLD": 1}
-    df_risk["advice_rank"] = df_risk["advice"].map(advice_rank).fillna(9)
-    df_risk = df_risk.sort_values(["advice_rank", "pnl_pct"], na_position="last").drop(columns=["advice_rank"])
+        # Shared load/regime diagnostics are repeated for each strategy that covers the symbol,
+        # then everything is put back in universe order.
+        order = {symbol: position for position, symbol in enumerate(members)}
+        rows = [row for row in shared_diagnostics if row["symbol"] in member_set or row["reason"] == "regime_fetch_failed"]
+        rows.extend(diagnostics)
+        for row in rows:
+            if row["symbol"] in from_dates:
+                row.setdefault("from_date", from_dates[row["symbol"]])
+        rows.sort(key=lambda row: order.get(row["symbol"], -1))
+        all_diagnostics.extend(dict(row, strategy=strategy["name"]) for row in rows)
+        if candidates:
+            frame = candidates_frame(candidates, CANDIDATE_COLUMNS + ["strategy"]).sort_values(
+                ["confidence", "rs_score"], ascending=False, kind="stable", na_position="last"
+            )
+            all_candidates.append(frame)
+
+    if all_candidates:
+        df_candidates = pd.concat(all_candidates, ignore_index=True)
+    else:
+        df_candidates = pd.DataFrame(columns=CANDIDATE_COLUMNS + ["strategy"])
+    return df_candidates, pd.DataFrame(all_diagnostics)
+
+
+def _checkpoint_key(strategies, universe, to_date):
+    payload = json.dumps([to_date, strategies, universe], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _read_scan_checkpoint(path, key):
+    """Chunk records of an interrupted scan with the same key, in order; [] when there is none.
+
+    A torn last line (crash mid-write) is ignored, so that chunk is simply fetched again.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+    except FileNotFoundError:
+        return []
+    chunks = []
+    for position, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if position == 0:
+            if record.get("key") != key:
+                return []
+            continue
+        chunks.append(record)
+    return chunks
+
+
+def _append_scan_checkpoint(path, record, key=None):
+    """Append one chunk record; `key` starts a new checkpoint file instead."""
+    with open(path, "w" if key else "a", encoding="utf-8") as handle:
+        if key:
+            handle.write(json.dumps({"key": key}) + "\n")
+        handle.write(json.dumps(record, default=str) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+def scan_checkpoint_symbols(path=None):
+    """Number of symbols stored in the scan checkpoint at `path`, 0 when there is none."""
+    path = path or SCAN_CHECKPOINT_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            next(handle, None)
+            total = 0
+            for line in handle:
+                try:
+                    total += len(json.loads(line)["symbols"])
+                except (ValueError, KeyError):
+                    break
+            return total
+    except FileNotFoundError:
+        return 0
+
+
+def iter_scan_strategies(dhan, symbol_map, strategies, sector_map=None, regime=None, checkpoint_path=None):
+    """Streaming form of `scan_strategies`: yields one event dict per chunk, then a final one.
+
+    Every event has `done`, `total`, `candidates` and `diagnostics`. Chunk events
+    (`final` False) carry only that chunk's rows; their relative strength is ranked over
+    the symbols loaded so far, so treat them as provisional. The final event carries the
+    full result, identical to `scan_strategies`.
+
+    With `checkpoint_path`, each finished chunk (indicator rows, closes for relative
+    strength, diagnostics) is appended to that file. A later call for the same day,
+    strategies and universe reloads those chunks and only fetches the rest; the file is
+    removed once the scan completes.
+    """
+    strategies = [make_strategy(**strategy) for strategy in strategies]
+    names = [strategy["name"] for strategy in strategies]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Strategy names must be unique: {names}")
+
+    shared_diagnostics = []
+
+    def log(symbol, status, reason, security_id=None, **extra):
+        row = {"symbol": symbol, "status": status, "reason": reason, "security_id": security_id}
+        row.update(extra)
+        shared_diagnostics.append(row)
+
+    started = time.perf_counter()
+    to_date = datetime.now().strftime("%Y-%m-%d")
+
+    if regime is None:
+        regime = load_regime(dhan, log)
+    universe = list(dict.fromkeys(symbol for strategy in strategies for symbol in _strategy_universe(strategy)))
+    from_dates = plan_lookback(strategies, universe, to_date)
+    needed = required_indicators(strategies)
+    rs_bars = max(RS_HORIZONS) + 1
+    snapshots = []
+    close_tails = {}
+    symbol_sectors = {}
+    done = set()
+
+    key = _checkpoint_key(strategies, universe, to_date) if checkpoint_path else None
+    restored = _read_scan_checkpoint(checkpoint_path, key) if checkpoint_path else []
+    for record in restored:
+        if record["snapshot"]:
+            restored_snapshot = pd.DataFrame(record["snapshot"]).set_index("symbol")
+            restored_snapshot["security_id"] = restored_snapshot["security_id"].astype(str)
+            snapshots.append(restored_snapshot)
+        for symbol, closes in record["closes"].items():
+            close_tails[symbol] = pd.DataFrame({"close": np.asarray(closes, dtype="float64")})
+        symbol_sectors.update(record["sectors"])
+        shared_diagnostics.extend(record["diagnostics"])
+        done.update(record["symbols"])
+    if restored:
+        metrics.inc("scan_symbols_resumed", len(done), scan="eod")
+
+    remaining = [symbol for symbol in universe if symbol not in done]
+    for start in range(0, len(remaining), SCAN_CHUNK_SIZE):
+        chunk = remaining[start:start + SCAN_CHUNK_SIZE]
+        first_row = len(shared_diagnostics)
+        frames = load_universe_frames(dhan, symbol_map, chunk, from_dates, to_date, log)
+        chunk_snapshot = build_indicator_snapshot(frames, needed)
+        chunk_closes = {}
+        chunk_sectors = {}
+        for symbol, (security_id, df) in frames.items():
+            chunk_closes[symbol] = df[["close"]].iloc[-rs_bars:].copy()
+            chunk_sectors[symbol] = (sector_map or {}).get(str(security_id))
+        del frames
+        chunk_diagnostics = shared_diagnostics[first_row:]
+
+        if checkpoint_path:
+            record = {
+                "symbols": chunk,
+                "snapshot": chunk_snapshot.reset_index().to_dict("records"),
+                "closes": {symbol: frame["close"].tolist() for symbol, frame in chunk_closes.items()},
+                "sectors": chunk_sectors,
+                "diagnostics": chunk_diagnostics,
+            }
+            _append_scan_checkpoint(checkpoint_path, record, key=None if restored or start else key)
+
+        if not chunk_snapshot.empty:
+            snapshots.append(chunk_snapshot)
+        close_tails.update(chunk_closes)
+        symbol_sectors.update(chunk_sectors)
+        provisional = chunk_snapshot.join(relative_strength(build_close_panel(close_tails), sectors=symbol_sectors))
+        candidates, diagnostics = _evaluate_strategies(strategies, provisional, chunk_diagnostics, from_dates, regime)
+        yield {
+            "final": False,
+            "done": len(done) + start + len(chunk),
+            "total": len(universe),
+            "candidates": candidates,
+            "diagnostics": diagnostics,
+        }
+
+    snapshot = pd.concat(snapshots) if snapshots else build_indicator_snapshot({}, needed)
+    snapshot = snapshot.join(relative_strength(build_close_panel(close_tails), sectors=symbol_sectors))
+    candidates, diagnostics = _evaluate_strategies(strategies, snapshot, shared_diagnostics, from_dates, regime)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    _record_scan("eod", started, len(remaining))
+    yield {"final": True, "done": len(universe), "total": len(universe), "candidates": candidates, "diagnostics": diagnostics}
+
+
+def scan_strategies(dhan, symbol_map, strategies, sector_map=None, regime=None, progress=None, checkpoint_path=None):
+    """Evaluate several strategy configs against one shared fetch and indicator pass.
+
+    Candles are loaded once for the union of all universes and every indicator any
+    strategy needs is computed once per symbol; each extra strategy only adds a
+    vectorized scoring pass. Relative strength is ranked once across the whole loaded
+    universe (sector-relative when `sector_map` has security id -> sector) and breaks
+    confidence ties. Returns (candidates, diagnostics) DataFrames with a `strategy` column.
+
+    The universe is processed in chunks of SCAN_CHUNK_SIZE symbols: after each chunk only
+    its indicator rows and the last closes needed for relative strength are kept, so memory
+    stays bounded for universes of thousands of names. `progress(done, total)` is called
+    after every chunk. See `iter_scan_strategies` for streaming and `checkpoint_path`.
+    """
+    for event in iter_scan_strategies(
+        dhan, symbol_map, strategies, sector_map=sector_map, regime=regime, checkpoint_path=checkpoint_path
+    ):
+        if event["final"]:
+            return event["candidates"], event["diagnostics"]
+        if progress is not None:
+            progress(event["done"], event["total"])
+
+
+def _without_strategy(df):
+    return df.drop(columns=["strategy"], errors="ignore")
+
+
+def iter_scan(dhan, symbol_map, sector_map=None, regime=None, universe=None, checkpoint_path=None):
+    """Streaming form of `scan`; events as in `iter_scan_strategies`, without the strategy column."""
+    strategy = make_strategy(universe=universe) if universe is not None else DEFAULT_STRATEGY
+    for event in iter_scan_strategies(
+        dhan, symbol_map, [strategy], sector_map=sector_map, regime=regime, checkpoint_path=checkpoint_path
+    ):
+        yield dict(
+            event,
+            candidates=_without_strategy(event["candidates"]),
+            diagnostics=_without_strategy(event["diagnostics"]),
+        )
+
+
+def scan(dhan, symbol_map, sector_map=None, regime=None, universe=None, progress=None):
+    """Default strategy over `universe` (a symbol list; UNIVERSE when None)."""
+    for event in iter_scan(dhan, symbol_map, sector_map=sector_map, regime=regime, universe=universe):
+        if event["final"]:
+            return event["candidates"], event["diagnostics"]
+        if progress is not None:
+            progress(event["done"], event["total"])
+
+
+RISK_COLUMNS = [
+    "symbol", "security_id", "entry_price", "current_price", "stop_price", "pnl_pct", "advice", "reason", "regime",
+]
+RISK_MIN_CANDLES = 60
+RISK_INDICATORS = {"EMA20": ("ema", 20), "EMA50": ("ema", 50)}
+
+
+def _parse_position(trade):
+    if isinstance(trade, (BrokerPosition, TradeRecord)):
+        return trade.symbol, trade.security_id, trade.entry_price, trade.stop_price, trade.quantity
+
+    if isinstance(trade, dict):
+        symbol = str(trade.get("symbol", "UNKNOWN"))
+        security_id = str(trade.get("security_id", "")).strip()
+        entry_price = float(trade.get("entry_price", 0) or 0)
+        stop_price = float(trade.get("stop_price", 0) or 0)
+        quantity = float(trade.get("quantity", 0) or 0)
+        return symbol, security_id, entry_price, stop_price, quantity
+
+    # DB tuple fallback:
+    # id, symbol, security_id, entry_price, stop_price, position_size, ...
+    symbol = str(trade[1])
+    security_id = str(trade[2])
+    entry_price = float(trade[3]) if trade[3] is not None else 0.0
+    stop_price = float(trade[4]) if trade[4] is not None else 0.0
+    position_size = float(trade[5]) if trade[5] is not None else 0.0
+    quantity = (position_size / entry_price) if entry_price > 0 else 0.0
+    return symbol, security_id, entry_price, stop_price, quantity
+
+
+def fetch_candle_frames(dhan, security_ids, from_date, to_date, priority=PRIORITY_HISTORY, from_dates=None):
+    """Fetch daily candles for many securities concurrently; the scheduler keeps the pace.
+
+    `from_dates` optionally maps security_id -> its own start date, overriding `from_date`.
+    Returns ({security_id: DataFrame}, {security_id: error message}).
+    """
+    from_dates = from_dates or {}
+
+    def fetch_one(security_id):
+        return load_candles(dhan, security_id, from_dates.get(security_id, from_date), to_date, priority)
+
+    frames = {}
+    errors = {}
+    unique_ids = list(dict.fromkeys(str(sec) for sec in security_ids if str(sec).strip()))
+    if not unique_ids:
+        return frames, errors
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(unique_ids))) as pool:
+        futures = {pool.submit(fetch_one, security_id): security_id for security_id in unique_ids}
+        for future, security_id in futures.items():
+            try:
+                frames[security_id] = future.result()
+            except Exception as exc:
+                errors[security_id] = str(exc)
+    return frames, errors
+
+
+def build_close_panel(frames):
+    """Right-align closing prices into one bar-offset x security_id panel.
+
+    Row 0 is every security's latest bar and earlier bars count down from there, so
+    shorter histories only have leading NaNs and column-wise EMAs match per-series EMAs.
+    """
+    columns = {}
+    for security_id, df in frames.items():
+        if df is None or df.empty:
+            continue
+        closes = df["close"].to_numpy(dtype="float64")
+        columns[security_id] = pd.Series(closes, index=np.arange(-len(closes) + 1, 1))
+    if not columns:
+        return pd.DataFrame()
+    return pd.DataFrame(columns).sort_index()
+
+
+def evaluate_risk_panel(close_panel, positions, fetch_errors=None, regimes=None):
+    """Apply the SELL/HOLD rules to every position at once.
+
+    `positions` is a DataFrame with symbol, security_id, entry_price and stop_price;
+    `close_panel` comes from `build_close_panel`; `regimes` optionally maps security_id
+    to a regime label for display. Returns the advisory frame.
+    """
+    fetch_errors = fetch_errors or {}
+    if close_panel.empty:
+        latest = ema20 = ema50 = candles = pd.Series(dtype="float64")
+    else:
+        latest = close_panel.iloc[-1]
+        ema20 = close_panel.ewm(span=20, adjust=False).mean().iloc[-1]
+        ema50 = close_panel.ewm(span=50, adjust=False).mean().iloc[-1]
+        candles = close_panel.notna().sum()
+
+    sec = positions["security_id"]
+    entry = positions["entry_price"].to_numpy(dtype="float64")
+    stop = positions["stop_price"].to_numpy(dtype="float64")
+    current = sec.map(latest).to_numpy(dtype="float64")
+    e20 = sec.map(ema20).to_numpy(dtype="float64")
+    e50 = sec.map(ema50).to_numpy(dtype="float64")
+    count = sec.map(candles).fillna(0).to_numpy(dtype="float64")
+    fetch_error = sec.map(fetch_errors)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pnl_pct = np.where(entry > 0, (current - entry) / entry * 100, np.nan)
+
+    has_error = fetch_error.notna().to_numpy()
+    too_short = ~has_error & (count < RISK_MIN_CANDLES)
+    valid = ~has_error & ~too_short
+    stop_hit = valid & (stop > 0) & (current <= stop)
+    below_ema50 = valid & (current < e50)
+    below_ema20_loss = valid & (current < e20) & (pnl_pct < 0)
+
+    conditions = [has_error, too_short, stop_hit, below_ema50, below_ema20_loss]
+    reason = np.select(
+        conditions,
+        [
+            ("data_fetch_error: " + fetch_error.fillna("")).to_numpy(),
+            "insufficient_candles_for_risk_scan",
+            "stop_loss_breached",
+            "close_below_ema50",
+            "close_below_ema20_with_negative_pnl",
+        ],
+        default="trend_intact",
+    )
+    advice = np.where(np.logical_or.reduce(conditions), "SELL", "HOLD")
+
+    df_risk = pd.DataFrame(
+        {
+            "symbol": positions["symbol"].to_numpy(),
+            "security_id": sec.to_numpy(),
+            "entry_price": np.round(entry, 2),
+            "current_price": np.where(valid, np.round(current, 2), np.nan),
+            "stop_price": np.round(stop, 2),
+            "pnl_pct": np.where(valid, np.round(pnl_pct, 2), np.nan),
+            "advice": advice,
+            "reason": reason,
+            "regime": sec.map(regimes or {}).to_numpy(),
+        },
+        columns=RISK_COLUMNS,
+    )
+    df_risk = df_risk.sort_values(
+        ["advice", "pnl_pct"],
+        key=lambda col: col.map({"SELL": 0, "HOLD": 1}) if col.name == "advice" else col,
+        na_position="last",
+        kind="stable",
+    )
     return df_risk.reset_index(drop=True)
+
+
+def scan_portfolio_risk(dhan, active_trades, sector_map=None, regime=None):
+    """Scan active positions and return SELL/HOLD advisory with reasons.
+
+    Each row also carries the session regime of the index tracking its sector
+    (NIFTY when the sector is unknown); the regime is informational only.
+    """
+    started = time.perf_counter()
+    to_date = datetime.now().strftime("%Y-%m-%d")
+    from_date = plan_from_date(required_bars(RISK_INDICATORS, RISK_MIN_CANDLES), to_date)
+
+    parsed = [_parse_position(trade) for trade in active_trades]
+    positions = pd.DataFrame(
+        [row for row in parsed if row[1] and row[4] > 0],
+        columns=["symbol", "security_id", "entry_price", "stop_price", "quantity"],
+    )
+    if positions.empty:
+        return pd.DataFrame(columns=RISK_COLUMNS)
+
+    frames, errors = fetch_candle_frames(dhan, positions["security_id"], from_date, to_date)
+    if regime is None:
+        regime = load_regime(dhan)
+    from regime import sector_regime
+
+    regimes = {}
+    for security_id in positions["security_id"]:
+        sector_stats = sector_regime(regime, (sector_map or {}).get(security_id))
+        regimes[security_id] = sector_stats["regime"] if sector_stats else "unknown"
+    df_risk = evaluate_risk_panel(build_close_panel(frames), positions, errors, regimes)
+    _record_scan("risk", started, len(positions))
+    return df_risk
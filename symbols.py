@@ -0,0 +1,252 @@
+import bisect
+import os
+import uuid
+
+import pandas as pd
+
+# Comma-separated override (URLs or local CSV paths), e.g. a mirror or the startup benchmark's fixture.
+SCRIP_MASTER_URLS = [url.strip() for url in os.getenv("SCRIP_MASTER_URLS", "").split(",") if url.strip()] or [
+    "https://images.dhan.co/api-data/api-scrip-master-detailed.csv",
+    "https://images.dhan.co/api-data/api-scrip-master.csv",
+]
+SECURITY_ID_COLUMNS = ["SEM_SMST_SECURITY_ID", "SECURITY_ID", "SECURITYID", "SMST_SECURITY_ID"]
+SYMBOL_COLUMNS = ["SEM_TRADING_SYMBOL", "SEM_CUSTOM_SYMBOL", "SEM_SYMBOL"]
+SECTOR_COLUMNS = ["SEM_SECTOR", "SM_SECTOR", "SECTOR", "SEM_INDUSTRY", "INDUSTRY"]
+
+
+def normalize_symbol(symbol):
+    s = str(symbol).strip().upper()
+    if s.endswith("-EQ"):
+        s = s[:-3]
+    return s
+
+
+def canonical_symbol(symbol):
+    return "".join(ch for ch in normalize_symbol(symbol) if ch.isalnum())
+
+
+def _first_column(df, candidates):
+    for candidate in candidates:
+        if candidate in df.columns:
+            return candidate
+    return None
+
+
+def load_scrip_master(urls=None):
+    """Download the Dhan scrip master and keep NSE cash-equity rows.
+
+    Tries each URL in turn and returns (df, errors) for the first one with usable
+    symbol and security id columns; df is None when every URL failed. Each load gets a
+    fresh `df.attrs["version"]` (see `master_version`).
+    """
+    errors = []
+    for url in urls or SCRIP_MASTER_URLS:
+        try:
+            df = pd.read_csv(url, low_memory=False)
+            df.columns = df.columns.str.strip().str.upper()
+
+            if "SEM_SEGMENT" in df.columns:
+                segment = df["SEM_SEGMENT"].astype(str).str.strip().str.upper()
+                filtered = df[segment == "NSE_EQ"].copy()
+                if not filtered.empty:
+                    df = filtered
+
+            # Prefer cash-equity series to avoid derivatives/alternate lines with short history.
+            for series_col in ["SEM_SERIES", "SERIES", "SM_SERIES"]:
+                if series_col in df.columns:
+                    series = df[series_col].astype(str).str.strip().str.upper()
+                    filtered = df[series == "EQ"].copy()
+                    if not filtered.empty:
+                        df = filtered
+                    break
+
+            symbol_cols = [c for c in SYMBOL_COLUMNS if c in df.columns]
+            security_id_col = _first_column(df, SECURITY_ID_COLUMNS)
+            if not symbol_cols or security_id_col is None:
+                raise ValueError(
+                    f"Required columns missing in {url}. "
+                    f"Found symbols={symbol_cols}, security_id_col={security_id_col}."
+                )
+            df.attrs["version"] = uuid.uuid4().hex
+            return df, errors
+        except Exception as exc:
+            errors.append(f"{url}: {exc}")
+    return None, errors
+
+
+def master_version(master):
+    """Version token of a scrip master frame, for cache keys (never `id()`, which is reused).
+
+    Frames from `load_scrip_master` carry one; any other frame is hashed by content.
+    """
+    version = master.attrs.get("version")
+    if version is None:
+        version = str(int(pd.util.hash_pandas_object(master, index=False).sum()))
+    return version
+
+
+def _canonical_keys(values):
+    """Vectorized `canonical_symbol` over a Series of raw symbols."""
+    text = values.astype(str).str.strip().str.upper()
+    return text.str.replace(r"-EQ$", "", regex=True).str.replace(r"[^A-Z0-9]", "", regex=True)
+
+
+def _deletions(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def _edit_distance(a, b):
+    """Damerau-Levenshtein (optimal string alignment) distance; inputs are short symbols."""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            cost = 0 if char_a == char_b else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SymbolIndex:
+    """Symbol -> security ids, keyed by canonical symbol (upper-case, no -EQ, alphanumeric only).
+
+    Exact lookups are one dict probe; prefix search bisects a sorted key list; typo-tolerant
+    search uses a single-deletion index (symmetric delete), so no query scans every key.
+    """
+
+    def __init__(self, ids_by_key, display=None):
+        self._ids = {key: tuple(ids) for key, ids in ids_by_key.items() if key}
+        self._display = display or {}
+        self._keys = sorted(self._ids)
+        self._deletes = None
+        # Unique per build; caches key on it rather than id(), which a later index can reuse.
+        self.version = uuid.uuid4().hex
+
+    def _deletion_index(self):
+        # Built on the first fuzzy query; exact and prefix lookups never need it.
+        if self._deletes is None:
+            deletes = {}
+            for key in self._keys:
+                for variant in _deletions(key):
+                    deletes.setdefault(variant, []).append(key)
+            self._deletes = deletes
+        return self._deletes
+
+    @classmethod
+    def from_scrip_master(cls, df):
+        symbol_cols = [c for c in SYMBOL_COLUMNS if c in df.columns]
+        security_id_col = _first_column(df, SECURITY_ID_COLUMNS)
+        ids = df[security_id_col].astype(str).str.strip()
+        parts = []
+        for symbol_col in symbol_cols:
+            raw = df[symbol_col].astype(str).str.strip().str.upper()
+            parts.append(pd.DataFrame({"key": _canonical_keys(raw), "symbol": raw.str.replace(r"-EQ$", "", regex=True), "id": ids}))
+        rows = pd.concat(parts, ignore_index=True)
+        rows = rows[(rows["key"] != "") & (rows["key"] != "NAN") & (rows["id"] != "") & (rows["id"].str.upper() != "NAN")]
+        rows = rows.drop_duplicates(["key", "id"])
+        # Keep all ids per key in master order; the scanner picks the one with enough candles.
+        ids_by_key = rows.groupby("key", sort=False)["id"].agg(list).to_dict()
+        display = rows.drop_duplicates("key").set_index("key")["symbol"].to_dict()
+        return cls(ids_by_key, display)
+
+    @classmethod
+    def from_symbol_map(cls, symbol_map):
+        """Build from a plain {symbol: id or [ids]} mapping."""
+        ids_by_key = {}
+        for symbol, value in symbol_map.items():
+            key = canonical_symbol(symbol)
+            target = ids_by_key.setdefault(key, [])
+            for security_id in value if isinstance(value, (list, tuple)) else [value]:
+                security_id = str(security_id).strip()
+                if security_id and security_id not in target:
+                    target.append(security_id)
+        return cls(ids_by_key)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, symbol):
+        return canonical_symbol(symbol) in self._ids
+
+    def lookup(self, symbol):
+        """All security ids for `symbol` (any spelling), or an empty tuple."""
+        return self._ids.get(canonical_symbol(symbol), ())
+
+    def resolve(self, symbol):
+        ids = self.lookup(symbol)
+        return ids[0] if ids else None
+
+    def display_symbol(self, key):
+        return self._display.get(key, key)
+
+    def prefix(self, text, limit=20):
+        """Canonical keys starting with `text`, in sorted order."""
+        start = canonical_symbol(text)
+        if not start:
+            return []
+        index = bisect.bisect_left(self._keys, start)
+        matches = []
+        while index < len(self._keys) and len(matches) < limit and self._keys[index].startswith(start):
+            matches.append(self._keys[index])
+            index += 1
+        return matches
+
+    def fuzzy(self, text, limit=10, max_distance=1):
+        """Keys within `max_distance` edits (insert, delete, substitute, transpose) of `text`."""
+        query = canonical_symbol(text)
+        if not query:
+            return []
+        deletes = self._deletion_index()
+        candidates = set(deletes.get(query, ()))
+        for variant in _deletions(query) | {query}:
+            if variant in self._ids:
+                candidates.add(variant)
+            candidates.update(deletes.get(variant, ()))
+        scored = sorted(
+            (distance, key)
+            for key in candidates
+            for distance in [_edit_distance(query, key)]
+            if distance <= max_distance
+        )
+        return [key for _, key in scored[:limit]]
+
+    def search(self, text, limit=10):
+        """Exact match first, then prefix matches, then near-misses; for symbol entry boxes."""
+        results = []
+        query = canonical_symbol(text)
+        if query in self._ids:
+            results.append(query)
+        for key in self.prefix(query, limit) + self.fuzzy(query, limit):
+            if key not in results:
+                results.append(key)
+        return [(self.display_symbol(key), self._ids[key]) for key in results[:limit]]
+
+    def resolve_many(self, symbols):
+        """Resolve a whole universe at once; DataFrame of symbol, key, security_id, security_ids."""
+        symbols = pd.Series(list(symbols), dtype="object")
+        keys = _canonical_keys(symbols)
+        ids = keys.map(self._ids)
+        return pd.DataFrame(
+            {
+                "symbol": symbols,
+                "key": keys,
+                "security_id": ids.map(lambda value: value[0] if isinstance(value, tuple) and value else None),
+                "security_ids": ids.map(lambda value: value if isinstance(value, tuple) else ()),
+            }
+        )
+
+
+def build_sector_map(df):
+    """Map security id -> sector label when the scrip master carries one; else an empty dict."""
+    sector_col = _first_column(df, SECTOR_COLUMNS)
+    security_id_col = _first_column(df, SECURITY_ID_COLUMNS)
+    if sector_col is None or security_id_col is None:
+        return {}
+
+    ids = df[security_id_col].astype(str).str.strip()
+    sectors = df[sector_col].astype(str).str.strip().str.upper()
+    valid = (ids != "") & (ids.str.upper() != "NAN") & (sectors != "") & (sectors != "NAN")
+    return dict(zip(ids[valid], sectors[valid]))
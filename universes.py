@@ -0,0 +1,113 @@
+import os
+import threading
+
+import pandas as pd
+
+import metrics
+from symbols import SECTOR_COLUMNS, SYMBOL_COLUMNS, _first_column, master_version, normalize_symbol
+
+UNIVERSES_DIR = os.getenv("UNIVERSES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "universes"))
+DEFAULT_UNIVERSE = os.getenv("SCAN_UNIVERSE", "default")
+# Universes derived from the scrip master: "master:all" or "master:<SECTOR LABEL>".
+MASTER_PREFIX = "master:"
+CONSTITUENT_SYMBOL_COLUMNS = ["SYMBOL", "TICKER", "TRADINGSYMBOL", "TRADING_SYMBOL"]
+
+_lock = threading.Lock()
+_resolved = {}
+
+
+def read_constituents(path):
+    """Symbols from a constituent file, in file order without duplicates.
+
+    `.csv` files (e.g. NSE index constituent downloads) use their Symbol column, or the
+    first column when there is none; anything else is one symbol per line with `#` comments.
+    """
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, dtype=str)
+        df.columns = df.columns.str.strip().str.upper()
+        column = _first_column(df, CONSTITUENT_SYMBOL_COLUMNS) or df.columns[0]
+        raw = df[column].dropna().tolist()
+    else:
+        with open(path, "r", encoding="utf-8") as handle:
+            raw = [line.split("#", 1)[0] for line in handle]
+    symbols = [normalize_symbol(symbol) for symbol in raw if str(symbol).strip()]
+    return list(dict.fromkeys(symbols))
+
+
+def _universe_path(name):
+    for extension in (".txt", ".csv"):
+        path = os.path.join(UNIVERSES_DIR, f"{name}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def list_universes(master=None):
+    """Universe names: constituent files in UNIVERSES_DIR, then scrip-master universes."""
+    names = []
+    if os.path.isdir(UNIVERSES_DIR):
+        for filename in sorted(os.listdir(UNIVERSES_DIR)):
+            stem, extension = os.path.splitext(filename)
+            if extension.lower() in (".txt", ".csv") and stem not in names:
+                names.append(stem)
+    if master is not None:
+        names.append(f"{MASTER_PREFIX}all")
+        sector_col = _first_column(master, SECTOR_COLUMNS)
+        if sector_col is not None:
+            sectors = master[sector_col].astype(str).str.strip().str.upper()
+            names.extend(f"{MASTER_PREFIX}{sector}" for sector in sorted(sectors[(sectors != "") & (sectors != "NAN")].unique()))
+    return names
+
+
+def master_universe(master, sector=None):
+    """Every symbol in the (already NSE cash-equity filtered) scrip master, optionally one sector."""
+    symbol_col = next(column for column in SYMBOL_COLUMNS if column in master.columns)
+    rows = master
+    if sector:
+        sector_col = _first_column(master, SECTOR_COLUMNS)
+        if sector_col is None:
+            return []
+        rows = master[master[sector_col].astype(str).str.strip().str.upper() == sector.strip().upper()]
+    symbols = rows[symbol_col].dropna().astype(str).str.strip().str.upper().str.replace(r"-EQ$", "", regex=True)
+    return list(dict.fromkeys(symbols[symbols != ""]))
+
+
+def _source(name, master):
+    """(version, loader) for a universe; `version` changes whenever its symbols may have."""
+    if name.startswith(MASTER_PREFIX):
+        if master is None:
+            raise ValueError(f"Universe {name} needs the scrip master.")
+        sector = name[len(MASTER_PREFIX):]
+        return master_version(master), lambda: master_universe(master, None if sector.lower() == "all" else sector)
+    path = _universe_path(name)
+    if path is None:
+        raise ValueError(f"Unknown universe {name}: no {name}.txt or {name}.csv in {UNIVERSES_DIR}.")
+    return os.path.getmtime(path), lambda: read_constituents(path)
+
+
+def resolve_universe(name, symbol_index, master=None):
+    """Resolve a universe to security ids once; later calls reuse the result.
+
+    Returns {"name", "symbols", "missing"}: `symbols` are the names with at least one
+    security id, in source order. The cache is keyed on the file's mtime (or the master's
+    version) and the index's version, so editing a file or reloading the scrip master re-resolves.
+    """
+    version, loader = _source(name, master)
+    key = (version, symbol_index.version)
+    with _lock:
+        cached = _resolved.get(name)
+        if cached is not None and cached[0] == key:
+            metrics.cache_result("universe", True)
+            return cached[1]
+    metrics.cache_result("universe", False)
+
+    resolved = symbol_index.resolve_many(loader())
+    found = resolved["security_ids"].map(bool)
+    universe = {
+        "name": name,
+        "symbols": resolved.loc[found, "symbol"].tolist(),
+        "missing": resolved.loc[~found, "symbol"].tolist(),
+    }
+    with _lock:
+        _resolved[name] = (key, universe)
+    return universe